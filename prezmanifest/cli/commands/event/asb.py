@@ -4,7 +4,7 @@ from typing import Annotated
 import typer
 
 from prezmanifest.event.asb_client import AzureServiceBusEventClient
-from prezmanifest.event.syncer import sync_rdf_delta
+from prezmanifest.event.syncer import RDF_PATCH_CHUNK_SIZE, sync_rdf_delta
 from prezmanifest.utils import make_httpx_client
 
 app = typer.Typer()
@@ -28,6 +28,11 @@ def event_sync_command(
     ),
     session: str = typer.Argument(..., help="The Azure Service Bus session ID"),
     websocket: bool = typer.Option(False, "--websocket", help="Use WebSockets"),
+    use_async: bool = typer.Option(
+        False,
+        "--async",
+        help="Send each batch of events asynchronously while the next is prepared",
+    ),
     username: Annotated[
         str, typer.Option("--username", "-u", help="SPARQL Endpoint username")
     ] = None,
@@ -37,14 +42,77 @@ def event_sync_command(
     timeout: Annotated[
         int, typer.Option("--timeout", "-t", help="Timeout per request")
     ] = 60,
+    canon_cache: Annotated[
+        Path | None,
+        typer.Option(
+            "--canon-cache",
+            help="A directory in which to cache the canonical forms of graphs between syncs",
+        ),
+    ] = None,
+    canon_cache_max_bytes: Annotated[
+        int,
+        typer.Option(
+            "--canon-cache-max-bytes",
+            help="The size to which the canonical form cache is evicted after each sync",
+        ),
+    ] = 1_000_000_000,
+    canon_workers: Annotated[
+        int,
+        typer.Option(
+            "--canon-workers",
+            help="The number of processes in which to canonicalise graphs with blank nodes",
+        ),
+    ] = 1,
+    sort_buffer_bytes: Annotated[
+        int | None,
+        typer.Option(
+            "--sort-buffer-bytes",
+            help="Diff out-of-core with an external sort holding at most this many bytes of statements in memory",
+        ),
+    ] = None,
+    sort_tmp_dir: Annotated[
+        Path | None,
+        typer.Option(
+            "--sort-tmp-dir",
+            help="The directory for the external sort's temporary files",
+        ),
+    ] = None,
+    sort_tmp_max_bytes: Annotated[
+        int | None,
+        typer.Option(
+            "--sort-tmp-max-bytes",
+            help="The most the external sort's temporary files may take",
+        ),
+    ] = None,
+    chunk_size: Annotated[
+        int,
+        typer.Option(
+            "--chunk-size",
+            help="The most bytes of each event's RDF patch, each a transaction of its own",
+        ),
+    ] = RDF_PATCH_CHUNK_SIZE,
 ):
     cwd = Path.cwd()
     http_client = make_httpx_client(username, password, timeout)
-    event_client = AzureServiceBusEventClient(
-        connection, topic, subscription, session, websocket
-    )
     try:
-        sync_rdf_delta(cwd, manifest, endpoint, http_client, event_client)
+        # the last batch of events is sent as the client closes
+        with AzureServiceBusEventClient(
+            connection, topic, subscription, session, websocket, use_async
+        ) as event_client:
+            sync_rdf_delta(
+                cwd,
+                manifest,
+                endpoint,
+                http_client,
+                event_client,
+                canon_cache_dir=canon_cache,
+                canon_cache_max_bytes=canon_cache_max_bytes,
+                canon_workers=canon_workers,
+                sort_buffer_bytes=sort_buffer_bytes,
+                sort_tmp_dir=sort_tmp_dir,
+                sort_tmp_max_bytes=sort_tmp_max_bytes,
+                chunk_size=chunk_size,
+            )
         print(
             "The Prez Manifest synchronization event has been sent to Azure Service Bus."
         )
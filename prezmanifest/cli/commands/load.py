@@ -1,9 +1,14 @@
+import contextlib
+import json
 from pathlib import Path
 from typing import Annotated
 
 import typer
+from rich.table import Table
 
-from prezmanifest.loader import load
+from prezmanifest.cli.console import console
+from prezmanifest.loader import load, plan
+from prezmanifest.watcher import watch_load
 
 app = typer.Typer(help="Load a Prez Manifest's content into a file or DB")
 
@@ -25,13 +30,47 @@ def sparql_command(
     timeout: Annotated[
         int, typer.Option("--timeout", "-t", help="Timeout per request")
     ] = 60,
+    workers: Annotated[
+        int,
+        typer.Option(
+            "--workers", "-w", help="Number of processes to parse resource files with"
+        ),
+    ] = 1,
+    watch: Annotated[
+        bool,
+        typer.Option(
+            "--watch",
+            help="Keep running, pushing changed resources each time the Manifest's files change",
+        ),
+    ] = False,
+    interval: Annotated[
+        float,
+        typer.Option(
+            "--interval",
+            help="How often, in seconds, to check for changes when watching",
+        ),
+    ] = 1.0,
 ) -> None:
+    if watch:
+        with contextlib.suppress(KeyboardInterrupt):
+            watch_load(
+                manifest,
+                endpoint,
+                sparql_username=username,
+                sparql_password=password,
+                timeout=timeout,
+                parse_workers=workers,
+                interval=interval,
+            )
+        return
+
     load(
         manifest,
         sparql_endpoint=endpoint,
         sparql_username=username,
         sparql_password=password,
         timeout=timeout,
+        parse_workers=workers,
     )
 
 
@@ -43,5 +82,92 @@ def file_command(
         ..., help="The path of the Prez Manifest file to be loaded"
     ),
     file: Path = typer.Argument(..., help="The path of the quads file"),
+    workers: Annotated[
+        int,
+        typer.Option(
+            "--workers", "-w", help="Number of processes to parse resource files with"
+        ),
+    ] = 1,
+) -> None:
+    load(manifest, destination_file=file, parse_workers=workers)
+
+
+@app.command(
+    name="plan",
+    help="List the graphs a load of a Prez Manifest would write, with size, triple, request and time estimates, without loading anything",
+)
+def plan_command(
+    manifest: Path = typer.Argument(
+        ..., help="The path of the Prez Manifest file to be loaded"
+    ),
+    profile: Annotated[
+        Path | None,
+        typer.Option(
+            "--profile",
+            help='A JSON file of throughput figures to estimate with, e.g. {"upload_bytes_per_second": 20000000}',
+        ),
+    ] = None,
+    estimate: Annotated[
+        bool,
+        typer.Option(
+            "--estimate",
+            help="Don't parse the catalogue or resource files: use graph IRIs given in the Manifest and estimate triple counts from file sizes",
+        ),
+    ] = False,
+    workers: Annotated[
+        int,
+        typer.Option(
+            "--workers", "-w", help="Number of processes the load will parse with"
+        ),
+    ] = 1,
+    response_format: str = typer.Option(
+        "table",
+        "--response-format",
+        "-f",
+        help="The response format of the plan. Either 'table' (default) or 'json'",
+    ),
 ) -> None:
-    load(manifest, destination_file=file)
+    p = plan(
+        manifest,
+        json.loads(profile.read_text()) if profile is not None else None,
+        parse=not estimate,
+        parse_workers=workers,
+    )
+
+    if response_format == "json":
+        print(json.dumps(p, indent=4))
+    else:
+        console.print(plan_as_rich_table(p))
+
+
+def plan_as_rich_table(load_plan: dict):
+    t = Table()
+    t.add_column("Graph")
+    t.add_column("Role")
+    t.add_column("Files")
+    t.add_column("Bytes", justify="right")
+    t.add_column("Triples", justify="right")
+    t.add_column("Requests", justify="right")
+
+    for g in load_plan["graphs"]:
+        t.add_row(
+            g["graph"],
+            g["role"],
+            "\n".join(Path(f).name for f in g["files"]),
+            f"{g['bytes']:,}",
+            f"{'~' if g['triples_estimated'] else ''}{g['triples']:,}",
+            str(g["requests"]),
+        )
+
+    totals = load_plan["totals"]
+    t.add_section()
+    t.add_row(
+        f"{totals['graphs']} graphs, ~{totals['seconds']} s",
+        "",
+        "",
+        f"{totals['bytes']:,}",
+        f"{totals['triples']:,}",
+        str(totals["requests"]),
+    )
+
+    return t
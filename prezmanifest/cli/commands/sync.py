@@ -1,4 +1,5 @@
 import collections
+import contextlib
 import json
 from pathlib import Path
 from typing import Annotated
@@ -8,8 +9,9 @@ from rich.table import Table
 
 from prezmanifest.cli.app import app
 from prezmanifest.cli.console import console
-from prezmanifest.syncer import sync
+from prezmanifest.syncer import plan_sync, sync
 from prezmanifest.utils import make_httpx_client
+from prezmanifest.watcher import watch_sync
 
 
 @app.command(
@@ -38,6 +40,63 @@ def sync_command(
     timeout: Annotated[
         int, typer.Option("--timeout", "-t", help="Timeout per request")
     ] = 60,
+    concurrency: Annotated[
+        int,
+        typer.Option(
+            "--concurrency",
+            "-c",
+            help="The number of uploads & downloads to run at once",
+        ),
+    ] = 1,
+    transaction_size: Annotated[
+        int,
+        typer.Option(
+            "--transaction-size",
+            help="The number of remote graphs to replace per SPARQL Update transaction",
+        ),
+    ] = 1,
+    diff: Annotated[
+        bool,
+        typer.Option(
+            "--diff",
+            help="Update remote graphs by sending only the triples that differ from the local artifacts",
+        ),
+    ] = False,
+    state_file: Annotated[
+        Path | None,
+        typer.Option(
+            "--state-file",
+            help="A file in which to keep the remote state between syncs, to skip querying for it when unchanged",
+        ),
+    ] = None,
+    watch: Annotated[
+        bool,
+        typer.Option(
+            "--watch",
+            help="Keep running, syncing again each time the Manifest's files change",
+        ),
+    ] = False,
+    plan: Annotated[
+        bool,
+        typer.Option(
+            "--plan",
+            help="Don't sync: list the transfers a sync would make, with size, triple, request and time estimates",
+        ),
+    ] = False,
+    profile: Annotated[
+        Path | None,
+        typer.Option(
+            "--profile",
+            help='A JSON file of throughput figures to estimate a --plan with, e.g. {"upload_bytes_per_second": 20000000}',
+        ),
+    ] = None,
+    interval: Annotated[
+        float,
+        typer.Option(
+            "--interval",
+            help="How often, in seconds, to check for changes when watching",
+        ),
+    ] = 1.0,
     response_format: str = typer.Option(
         "table",
         "--response-format",
@@ -45,7 +104,52 @@ def sync_command(
         help="The response format of the SPARQL query. Either 'table' (default) or 'json'",
     ),
 ) -> None:
-    r = sync(
+    def _print(r: dict):
+        if response_format == "json":
+            print(json.dumps(r, indent=4))
+        else:
+            console.print(result_as_rich_table(r))
+
+    if plan:
+        p = plan_sync(
+            manifest,
+            endpoint,
+            make_httpx_client(username, password, timeout),
+            update_remote,
+            update_local,
+            add_remote,
+            add_local,
+            transaction_size,
+            diff,
+            state_file=state_file,
+            profile=json.loads(profile.read_text()) if profile is not None else None,
+        )
+        if response_format == "json":
+            print(json.dumps(p, indent=4))
+        else:
+            console.print(plan_as_rich_table(p))
+        return
+
+    if watch:
+        with contextlib.suppress(KeyboardInterrupt):
+            watch_sync(
+                manifest,
+                endpoint,
+                make_httpx_client(username, password, timeout),
+                on_sync=_print,
+                interval=interval,
+                update_remote=update_remote,
+                update_local=update_local,
+                add_remote=add_remote,
+                add_local=add_local,
+                concurrency=concurrency,
+                transaction_size=transaction_size,
+                diff_update=diff,
+                state_file=state_file,
+            )
+        return
+
+    sync_status = sync(
         manifest,
         endpoint,
         make_httpx_client(username, password, timeout),
@@ -53,12 +157,14 @@ def sync_command(
         update_local,
         add_remote,
         add_local,
+        concurrency,
+        transaction_size,
+        diff,
+        state_file=state_file,
     )
-
-    if response_format == "json":
-        print(json.dumps(r, indent=4))
-    else:
-        console.print(result_as_rich_table(r))
+    _print(sync_status)
+    if any(v["direction"] == "failed" for v in sync_status.values()):
+        raise typer.Exit(code=1)
 
 
 def result_as_rich_table(sync_status: dict):
@@ -66,10 +172,48 @@ def result_as_rich_table(sync_status: dict):
     t.add_column("Artifact")
     t.add_column("Main Entity")
     t.add_column("Direction")
+    t.add_column("Time (s)", justify="right")
 
     for k, v in collections.OrderedDict(sorted(sync_status.items())).items():
-        t.add_row(str(k), str(v["main_entity"]), v["direction"])
+        duration = f"{v['duration']:.2f}" if "duration" in v else ""
+        direction = (
+            f"{v['direction']} ({v['error']})" if "error" in v else v["direction"]
+        )
+        t.add_row(str(k), str(v["main_entity"]), direction, duration)
 
     # json.dumps(sync_status, indent=4)
 
     return t
+
+
+def plan_as_rich_table(sync_plan: dict):
+    t = Table()
+    t.add_column("Artifact")
+    t.add_column("Main Entity")
+    t.add_column("Direction")
+    t.add_column("Bytes", justify="right")
+    t.add_column("Triples", justify="right")
+    t.add_column("Requests", justify="right")
+
+    for a in sync_plan["actions"]:
+        t.add_row(
+            str(a["artifact"]) if a["artifact"] is not None else "",
+            a["main_entity"],
+            a["direction"],
+            f"{a['bytes']:,}",
+            f"{'~' if a['triples_estimated'] else ''}{a['triples']:,}",
+            str(a["requests"]),
+        )
+
+    totals = sync_plan["totals"]
+    t.add_section()
+    t.add_row(
+        f"{totals['actions']} actions, ~{totals['seconds']} s",
+        "",
+        "",
+        f"{totals['bytes']:,}",
+        f"{totals['triples']:,}",
+        str(totals["requests"]),
+    )
+
+    return t
@@ -38,4 +38,5 @@ class MVT(DefinedNamespace):
     _NS = Namespace("https://prez.dev/ManifestVersionTypes/")
     _fail = True
 
+    ContentHash: URIRef
     GitCommitHash: URIRef
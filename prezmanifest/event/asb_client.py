@@ -1,10 +1,84 @@
+import asyncio
 import datetime
+import threading
+from concurrent.futures import Future
+from typing import Protocol
 
-from azure.servicebus import ServiceBusClient, ServiceBusMessage, TransportType
+from azure.servicebus import (
+    ServiceBusClient,
+    ServiceBusMessage,
+    ServiceBusMessageBatch,
+    TransportType,
+)
+from azure.servicebus.exceptions import MessageSizeExceededError
 from rdflib import SDO
 
 
+class ServiceBusTransport(Protocol):
+    """The Service Bus operations the event client uses - those of a topic sender - so that it can be given an in-memory
+    stand-in"""
+
+    def create_message_batch(self) -> ServiceBusMessageBatch: ...
+
+    def send_messages(self, message: ServiceBusMessageBatch) -> None: ...
+
+    def close(self) -> None: ...
+
+
+class AsyncServiceBusTransport:
+    """Adapts an azure.servicebus.aio client's topic sender to a ServiceBusTransport.
+
+    Its coroutines run on an event loop in a background thread, where each send is left running, overlapping with
+    whatever the caller does next, until the next send or close. Sends are one at a time, in order."""
+
+    def __init__(self, client, topic: str):
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+        self._client = client
+        self._sender = client.get_topic_sender(topic)
+        self._sending: Future | None = None
+
+    def _run(self, coroutine) -> Future:
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+
+    def _wait(self) -> None:
+        if self._sending is not None:
+            sending = self._sending
+            self._sending = None
+            sending.result()
+
+    def create_message_batch(self) -> ServiceBusMessageBatch:
+        return self._run(self._sender.create_message_batch()).result()
+
+    def send_messages(self, message: ServiceBusMessageBatch) -> None:
+        self._wait()
+        self._sending = self._run(self._sender.send_messages(message))
+
+    def close(self) -> None:
+        async def _close():
+            await self._sender.close()
+            await self._client.close()
+
+        try:
+            self._wait()
+        finally:
+            try:
+                self._run(_close()).result()
+            finally:
+                self._loop.call_soon_threadsafe(self._loop.stop)
+                self._thread.join()
+                self._loop.close()
+
+
 class AzureServiceBusEventClient:
+    """Sends events to an Azure Service Bus topic with one topic sender, kept open until the client is closed.
+
+    Events are packed, in order, into message batches of up to the broker's size limit, each sent once the next event
+    won't fit in it, so the client must be closed, or used as a context manager, for the last batch to be sent. With
+    use_async, batches are sent with azure.servicebus.aio, each while the next is being filled. A transport may be
+    given instead of a connection to Service Bus, such as an in-memory one for testing."""
+
     def __init__(
         self,
         connection_string: str,
@@ -12,18 +86,37 @@ class AzureServiceBusEventClient:
         subscription: str,
         session_id: str,
         websocket: bool = False,
+        use_async: bool = False,
+        transport: ServiceBusTransport | None = None,
     ):
         self.topic = topic
         self.subscription = subscription
         self.session_id = session_id
+        self._inner = None
+        self._batch = None
+        if transport is not None:
+            self._transport = transport
+            return
+
         kwargs = (
             {} if not websocket else {"transport_type": TransportType.AmqpOverWebsocket}
         )
-        self._inner = ServiceBusClient.from_connection_string(
-            connection_string, **kwargs
-        )
+        if use_async:
+            from azure.servicebus.aio import ServiceBusClient as AsyncServiceBusClient
 
-    def create_event(self, payload: str) -> None:
+            self._transport = AsyncServiceBusTransport(
+                AsyncServiceBusClient.from_connection_string(
+                    connection_string, **kwargs
+                ),
+                self.topic,
+            )
+        else:
+            self._inner = ServiceBusClient.from_connection_string(
+                connection_string, **kwargs
+            )
+            self._transport = self._inner.get_topic_sender(self.topic)
+
+    def _message(self, payload: str) -> ServiceBusMessage:
         content_type = "application/rdf-patch-body"
         metadata = {
             str(SDO.encodingFormat): content_type,
@@ -34,18 +127,45 @@ class AzureServiceBusEventClient:
             str(SDO.about): "",
             str(SDO.creator): "prezmanifest",
         }
-        _message = ServiceBusMessage(
+        return ServiceBusMessage(
             payload,
             content_type=content_type,
             application_properties=metadata,
             session_id=self.session_id,
         )
-        sender = self._inner.get_topic_sender(self.topic)
-        sender.send_messages(message=_message)
-        sender.close()
+
+    def create_event(self, payload: str) -> None:
+        message = self._message(payload)
+        if self._batch is None:
+            self._batch = self._transport.create_message_batch()
+        try:
+            self._batch.add_message(message)
+        except MessageSizeExceededError:
+            # a message too large for an empty batch can't be sent at all
+            if len(self._batch) == 0:
+                raise
+            self.flush()
+            self._batch = self._transport.create_message_batch()
+            self._batch.add_message(message)
+
+    def flush(self) -> None:
+        """Sends the batch of events not yet sent, if any"""
+        if self._batch is not None and len(self._batch) > 0:
+            self._transport.send_messages(self._batch)
+        self._batch = None
+
+    def close(self) -> None:
+        try:
+            self.flush()
+        finally:
+            try:
+                self._transport.close()
+            finally:
+                if self._inner is not None:
+                    self._inner.close()
 
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self._inner.close()
+        self.close()
@@ -1,21 +1,60 @@
+import contextlib
+import gzip
+import hashlib
+import heapq
 import io
 import logging
+import os
+import posixpath
+import sys
+import tempfile
+from array import array
+from collections import deque
+from collections.abc import Callable, Generator, Iterable
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
-from typing import Generator
 
 import httpx
-from git import Repo
-from rdflib import RDF, SDO, BNode, Dataset, Graph, Literal, URIRef
+import rdflib
+from git import Blob, Commit, GitCommandError, Repo
+from rdflib import PROF, RDF, SDO, BNode, Dataset, Graph, Literal, Node, URIRef
 from rdflib.compare import to_canonical_graph
+from rdflib.graph import DATASET_DEFAULT_GRAPH_ID
 from rdflib.query import Result
 
 from prezmanifest import load
-from prezmanifest.definednamespaces import MVT, OLIS
+from prezmanifest.definednamespaces import MRR, MVT, OLIS
 from prezmanifest.event.client import EventClient
 from prezmanifest.loader import ReturnDatatype
+from prezmanifest.utils import (
+    _parse_line_oriented,
+    get_catalogue_iri_from_manifest,
+    get_manifest_paths_and_graph,
+    get_rdf_format,
+)
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 logger = logging.getLogger(__name__)
 
+# The size of RDF patch body chunks: 0.8 MB (0.8 * 1024 * 1024), to fit within event streaming platform message size
+# limits (typically 1 MB, with 0.2 MB reserved for metadata)
+RDF_PATCH_CHUNK_SIZE = 838860
+
+# part of every canonical form cache key, so that forms cached before the canonicalisation changed, including with the
+# RDFLib version, aren't used
+CANON_FORM_VERSION = f"components-1 rdflib-{rdflib.__version__}"
+
+# graphs with fewer Blank Node components than this are canonicalised in-process, as sending each to a worker process
+# costs more than canonicalising it
+CANON_MIN_PARALLEL_COMPONENTS = 8
+
+# the number of batches, of roughly equal triple counts, components are sent to worker processes in, per process
+CANON_BATCHES_PER_WORKER = 4
+
 
 def _add_commit_hash_to_dataset(commit_hash: str, ds: Dataset) -> Dataset:
     """Load a manifest, add the commit hash to the system graph, and return the dataset.
@@ -92,139 +131,909 @@ def _retrieve_commit_hash(
     return result.graph.value(subject=vg_iri, predicate=SDO.version)
 
 
-def _rdf_patch_body_substr(s: str) -> Generator[str, None, None]:
-    """Extract the RDF patch body from a string and yield chunks of ~0.8 MB.
+def _manifest_path_in_repo(
+    repo: Repo, manifest: Path | tuple[Path, Path, Graph]
+) -> str:
+    """Returns the Manifest's path relative to the repository's working tree, in git's posix form."""
+    manifest_path = Path(manifest if isinstance(manifest, Path) else manifest[0])
+    try:
+        return (
+            manifest_path.resolve()
+            .relative_to(Path(repo.working_tree_dir).resolve())
+            .as_posix()
+        )
+    except ValueError:
+        raise ValueError(
+            f"The Manifest {manifest_path} is not within the git repository {repo.working_tree_dir}"
+        ) from None
+
+
+def _read_manifest_in_tree(commit: Commit, manifest_path: str) -> Graph:
+    """Reads a Manifest, given by its repository-relative path, from a commit's tree"""
+    try:
+        manifest_blob = commit.tree / manifest_path
+    except KeyError:
+        raise ValueError(
+            f"The Manifest {manifest_path} does not exist in commit {commit.hexsha}"
+        ) from None
+    return Graph().parse(
+        data=manifest_blob.data_stream.read(),
+        format=get_rdf_format(Path(manifest_path)),
+    )
+
+
+def _resolve_path_in_tree(
+    location: Node, manifest_dir: str, blobs: dict[str, Blob]
+) -> list[str]:
+    """Returns the repository-relative paths of the files in a tree that a Manifest path Literal, such as an
+    artifact's, refers to.
+
+    For globs, such as 'vocabs/*.ttl', all files under the glob's directory are returned and the glob itself is left to
+    the loader. URLs, and Literals that don't name a file in the tree, return no paths."""
+    if not isinstance(location, Literal) or (
+        str(location).startswith("http") and "://" in str(location)
+    ):
+        return []
+    if "*" in str(location):
+        glob_dir = posixpath.normpath(
+            posixpath.join(manifest_dir, str(location)[: str(location).find("*")])
+        )
+        prefix = "" if glob_dir == "." else glob_dir.rstrip("/") + "/"
+        return [p for p in blobs if p.startswith(prefix)]
+    p = posixpath.normpath(posixpath.join(manifest_dir, str(location)))
+    return [p] if p in blobs else []
+
+
+def _tree_blobs(commit: Commit) -> dict[str, Blob]:
+    return {item.path: item for item in commit.tree.traverse() if item.type == "blob"}
 
-    Chunks the patch body into approximately 0.8 MB pieces to fit within
-    event streaming platform message size limits (typically 1 MB, with 0.2 MB
-    reserved for metadata).
+
+def _resolve_manifest_files_in_tree(
+    commit: Commit, manifest_path: str
+) -> dict[str, Blob]:
+    """Returns the blobs, keyed by their repository-relative path, of a Manifest and the local files it refers to, as
+    they are in a commit.
+
+    Every Literal in the Manifest that names a file in the tree - artifacts, contentLocations & local validators - is
+    resolved relative to it."""
+    manifest_graph = _read_manifest_in_tree(commit, manifest_path)
+    blobs = _tree_blobs(commit)
+    manifest_dir = posixpath.dirname(manifest_path)
+    files = {manifest_path: blobs[manifest_path]}
+    for o in set(manifest_graph.objects()):
+        for p in _resolve_path_in_tree(o, manifest_dir, blobs):
+            files[p] = blobs[p]
+    return files
+
+
+def _changed_paths(repo: Repo, previous_commit_hash: str) -> set[str] | None:
+    """Returns the repository-relative paths of the files added, modified or deleted between a previous commit and
+    HEAD, as per `git diff --name-status`, or None if the previous commit isn't in the repository, such as in a shallow
+    clone."""
+    try:
+        out = repo.git.diff(
+            "--name-status", "--no-renames", "-z", f"{previous_commit_hash}..HEAD"
+        )
+    except GitCommandError:
+        return None
+    # -z output is status, path, status, path...
+    return {p for p in out.split("\0")[1::2] if p != ""}
+
+
+def _restrict_manifest_to_changes(
+    manifest_graph: Graph,
+    manifest_path: str,
+    blobs: dict[str, Blob],
+    changed_paths: set[str],
+) -> tuple[Graph, dict[str, Blob]]:
+    """Returns a copy of a Manifest, and the blobs of the files it needs, that loads only the graphs whose files are in
+    changed_paths, plus the catalogue and System Graph.
+
+    Resource Data artifacts whose files haven't changed are removed, as are all labels resources unless one of their
+    files has changed, in which case all are kept as they are merged into the one background graph. Graphs that are
+    loaded by both a previous and a current commit's restricted Manifest differ exactly as they would if the whole
+    Manifests were loaded, as long as each Resource Data graph is loaded from the one file."""
+    manifest_dir = posixpath.dirname(manifest_path)
+    g = Graph()
+    g += manifest_graph
+    files = {}
+    label_resources = []
+    label_files = {}
+    for m, r in list(g.subject_objects(PROF.hasResource)):
+        roles = set(g.objects(r, PROF.hasRole))
+        for a in list(g.objects(r, PROF.hasArtifact)):
+            location = g.value(a, SDO.contentLocation) if isinstance(a, BNode) else a
+            paths = _resolve_path_in_tree(location, manifest_dir, blobs)
+            if MRR.CatalogueData in roles:
+                files.update({p: blobs[p] for p in paths})
+            elif roles & {
+                MRR.CompleteCatalogueAndResourceLabels,
+                MRR.IncompleteCatalogueAndResourceLabels,
+            }:
+                label_resources.append((m, r))
+                label_files.update({p: blobs[p] for p in paths})
+            elif MRR.ResourceData in roles:
+                changed = [p for p in paths if p in changed_paths]
+                if len(changed) > 0:
+                    files.update({p: blobs[p] for p in changed})
+                else:
+                    g.remove((r, PROF.hasArtifact, a))
+
+    if len(label_files.keys() & changed_paths) > 0:
+        files.update(label_files)
+    else:
+        for m, r in label_resources:
+            g.remove((m, PROF.hasResource, r))
+
+    return g, files
+
+
+def _git_blob_sha(file: Path) -> str:
+    """Returns a file's git blob SHA, as `git hash-object` would"""
+    content = Path(file).read_bytes()
+    return hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest()
+
+
+def _load_dataset(
+    manifest: Path | tuple[Path, Path, Graph],
+    root: Path,
+    cache_keys: dict | None = None,
+    blobs: dict[str, Blob] | None = None,
+) -> Dataset:
+    """Loads a Manifest's dataset from files under root, a working tree or a copy of one.
+
+    If cache_keys, a dict, is given, it is filled with the canonical form cache key of each graph loaded from files.
+    The key is a hash of the graph's IRI and the repository-relative paths and git blob SHAs of its files, taken from
+    blobs where given, so it is the same in every commit and branch in which those files are unchanged."""
+    if cache_keys is None:
+        return load(manifest, return_data_type=ReturnDatatype.dataset)
+
+    graph_sources = {}
+    ds = load(
+        manifest,
+        return_data_type=ReturnDatatype.dataset,
+        graph_sources=graph_sources,
+    )
+    for iri, files in graph_sources.items():
+        sources = []
+        for f in files:
+            path = Path(f).resolve().relative_to(Path(root).resolve()).as_posix()
+            if blobs is not None and path in blobs:
+                sources.append((path, blobs[path].hexsha))
+            else:
+                sources.append((path, _git_blob_sha(f)))
+        h = hashlib.sha256(f"{CANON_FORM_VERSION} {iri}".encode())
+        for path, sha in sorted(sources):
+            h.update(f"\n{path} {sha}".encode())
+        cache_keys[iri] = h.hexdigest()
+    return ds
+
+
+def _load_commit_dataset(
+    repo: Repo,
+    commit_hash: str,
+    manifest: Path | tuple[Path, Path, Graph],
+    changed_paths: set[str] | None = None,
+    cache_keys: dict | None = None,
+) -> Dataset:
+    """Loads a Manifest as it was at a given commit, reading its files straight from git's object database.
+
+    Only the Manifest and the files it refers to are written, to a temporary directory, so neither the working tree
+    nor HEAD are changed. If changed_paths is given, only the graphs of changed files, the catalogue and the System
+    Graph are loaded and the Manifest, validated when the commit was made, is not validated again. cache_keys is as
+    per _load_dataset()."""
+    manifest_path = _manifest_path_in_repo(repo, manifest)
+    commit = repo.commit(commit_hash)
+    if changed_paths is None:
+        files = _resolve_manifest_files_in_tree(commit, manifest_path)
+    else:
+        manifest_graph, files = _restrict_manifest_to_changes(
+            _read_manifest_in_tree(commit, manifest_path),
+            manifest_path,
+            _tree_blobs(commit),
+            changed_paths,
+        )
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for path, blob in files.items():
+            f = Path(tmp_dir) / path
+            f.parent.mkdir(parents=True, exist_ok=True)
+            with open(f, "wb") as fh:
+                blob.stream_data(fh)
+        tmp_manifest = Path(tmp_dir) / manifest_path
+        if changed_paths is not None:
+            tmp_manifest = (tmp_manifest, tmp_manifest.parent, manifest_graph)
+        return _load_dataset(tmp_manifest, Path(tmp_dir), cache_keys, files)
+
+
+def _read_canon_cache(cache_dir: Path, key: str) -> Graph | None:
+    """Returns the canonical form of a graph from the cache, or None if it isn't cached"""
+    f = Path(cache_dir) / key[:2] / f"{key}.nt.gz"
+    if not f.is_file():
+        return None
+    g = Graph()
+    with gzip.open(f, "rb") as fh:
+        _parse_line_oriented(fh, g, preserve_bnode_ids=True)
+    # a hit makes the entry the most recently used
+    os.utime(f)
+    return g
+
+
+def _write_canon_cache(cache_dir: Path, key: str, graph: Graph) -> None:
+    """Caches the canonical form of a graph as sorted N-Triples"""
+    f = Path(cache_dir) / key[:2] / f"{key}.nt.gz"
+    f.parent.mkdir(parents=True, exist_ok=True)
+    lines = sorted(
+        line for line in graph.serialize(format="nt").splitlines() if line != ""
+    )
+    part = f.with_name(f".part-{f.name}")
+    with gzip.open(part, "wt", encoding="utf-8") as fh:
+        for line in lines:
+            fh.write(line + "\n")
+    part.replace(f)
+
+
+def _evict_canon_cache(cache_dir: Path, max_bytes: int) -> None:
+    """Removes the least recently used cached canonical forms until the cache is no larger than max_bytes"""
+    entries = []
+    for f in Path(cache_dir).glob("*/*.nt.gz"):
+        try:
+            stat = f.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime_ns, stat.st_size, f))
+    total = sum(size for _, size, _ in entries)
+    for _, size, f in sorted(entries):
+        if total <= max_bytes:
+            break
+        f.unlink(missing_ok=True)
+        total -= size
+
+
+def _chunk_rdf_patch_lines(
+    lines: Iterable[str],
+    chunk_size: int = RDF_PATCH_CHUNK_SIZE,
+    final_graph: URIRef | None = OLIS.SystemGraph,
+) -> Generator[str, None, None]:
+    """Packs RDF patch statement lines into chunks, each a self-contained patch of at most chunk_size bytes, UTF-8
+    encoded, so that each chunk can be sent, and retried, on its own.
+
+    Each chunk is a transaction - the statements between a TX . and a TC . line - and the TX . & TC . lines in lines
+    are dropped. Lines are packed greedily in order, so a patch with no statements is one empty transaction and
+    statements are never split. Only the lines of one chunk are held at a time, except for the statements in
+    final_graph, by default the Olis System Graph, which are held back and all sent in the last chunk. The System Graph
+    records the commit a patch brings the endpoint up to, so it is only updated once all other changes are made.
+
+    Raises:
+        ValueError: If a statement is too large to fit in a chunk on its own, or the final_graph statements together.
+    """
+
+    def _transaction(statements: list[str]) -> str:
+        return "TX .\n" + "".join(f"{statement}\n" for statement in statements) + "TC ."
+
+    overhead = len(_transaction([]).encode("utf-8"))
+    final_suffix = f" <{final_graph}> ." if final_graph is not None else None
+    final = []
+    final_size = 0
+    chunk = []
+    size = overhead
+    for line in lines:
+        if line == "TX ." or line == "TC .":
+            continue
+        line_size = len(line.encode("utf-8")) + 1
+        if final_suffix is not None and line.endswith(final_suffix):
+            final.append(line)
+            final_size += line_size
+            continue
+        if size + line_size > chunk_size and len(chunk) > 0:
+            yield _transaction(chunk)
+            chunk = []
+            size = overhead
+        if size + line_size > chunk_size:
+            raise ValueError(
+                f"An RDF patch statement of {line_size - 1} bytes is too large for a chunk of {chunk_size} bytes: "
+                f"{line[:100]}"
+            )
+        chunk.append(line)
+        size += line_size
+
+    if overhead + final_size > chunk_size:
+        raise ValueError(
+            f"The {final_size} bytes of RDF patch statements in {final_graph} are too large for a chunk of "
+            f"{chunk_size} bytes"
+        )
+    if size + final_size > chunk_size:
+        yield _transaction(chunk)
+        chunk = []
+    yield _transaction(chunk + final)
+
+
+def _rdf_patch_body_substr(
+    s: str, chunk_size: int = RDF_PATCH_CHUNK_SIZE
+) -> Generator[str, None, None]:
+    """Extract the RDF patch body from a string and yield it in self-contained chunks of at most chunk_size bytes.
+
+    Chunks the patch body into pieces of, by default, about 0.8 MB to fit within event streaming platform message size
+    limits (typically 1 MB, with 0.2 MB reserved for metadata).
 
     Yields:
-        Chunks of the RDF patch body, attempting to break on line boundaries
-        when possible to avoid splitting individual patch statements.
+        Chunks of the RDF patch body, each a transaction of whole patch statements, as per _chunk_rdf_patch_lines().
     """
     tx = "TX ."
     tc = "TC ."
     tx_pos = s.find(tx)
     tc_pos = s.find(tc) + len(tc)
-    body = s[tx_pos:tc_pos]
+    yield from _chunk_rdf_patch_lines(s[tx_pos:tc_pos].split("\n"), chunk_size)
+
 
-    # Chunk size: 0.8 MB in bytes (0.8 * 1024 * 1024)
-    chunk_size = 838860
+def _nt_term(term: Node) -> str:
+    """Serializes an RDF term as it is in N-Triples & N-Quads"""
+    if isinstance(term, Literal):
+        quoted = (
+            '"'
+            + str(term)
+            .replace("\\", "\\\\")
+            .replace("\n", "\\n")
+            .replace('"', '\\"')
+            .replace("\r", "\\r")
+            + '"'
+        )
+        if term.language:
+            return f"{quoted}@{term.language}"
+        elif term.datatype:
+            return f"{quoted}^^<{term.datatype}>"
+        return quoted
+    return term.n3()
 
-    start = 0
-    while start < len(body):
-        end = min(start + chunk_size, len(body))
-        if end < len(body):
-            # Try to break on a newline to avoid splitting lines
-            newline_pos = body.rfind("\n", start, end)
-            if newline_pos > start:
-                end = newline_pos + 1
-        yield body[start:end]
-        start = end
 
+def _nq_statement(
+    s: Node, p: Node, o: Node, g: Node, term: Callable[[Node], str] = _nt_term
+) -> str:
+    """Serializes a quad as an N-Quads statement, without the graph for the default graph"""
+    if g == DATASET_DEFAULT_GRAPH_ID:
+        return f"{term(s)} {term(p)} {term(o)} ."
+    return f"{term(s)} {term(p)} {term(o)} {term(g)} ."
 
-def _generate_canon_dataset(ds: Dataset) -> Dataset:
-    """Generate a canonical dataset from a dataset."""
-    return_ds = Dataset()
-    for graph in ds.graphs():
-        canon_graph = to_canonical_graph(graph)
-        target_graph = return_ds.graph(graph.identifier)
-        for triple in canon_graph:
-            target_graph.add(triple)
-    return return_ds
 
+def _rdf_patch_statements(
+    operation: str, quads: Iterable[tuple[Node, Node, Node, Node]]
+) -> Generator[str, None, None]:
+    """Yields the RDF patch statements, sorted, for an operation - A or D - on quads.
+
+    Terms are serialized once each, and only the statements are held for sorting, not the quads."""
+    terms = {}
+
+    def _term(t: Node) -> str:
+        v = terms.get(t)
+        if v is None:
+            v = _nt_term(t)
+            terms[t] = v
+        return v
+
+    statements = [
+        f"{operation} {_nq_statement(s, p, o, g, _term)}" for s, p, o, g in quads
+    ]
+    statements.sort()
+    yield from statements
+
+
+def _encode_triples(
+    triples: Iterable[tuple[Node, Node, Node]], ids: dict[Node, int], terms: list[Node]
+) -> array:
+    """Encodes triples as a flat array of the integer IDs of their subjects, predicates & objects, three per triple.
+
+    Terms not already in the term dictionary, ids, are given the next ID and appended to terms, so that terms[i] is the
+    term with ID i."""
+    encoded = array("Q")
+    for triple in triples:
+        for term in triple:
+            i = ids.get(term)
+            if i is None:
+                i = len(terms)
+                ids[term] = i
+                terms.append(term)
+            encoded.append(i)
+    return encoded
+
+
+def _diff_encoded_triples(previous: array, current: array) -> tuple[array, array]:
+    """Returns the encoded triples in previous but not current, and those in current but not previous, given two arrays
+    of encoded triples as per _encode_triples(), each without duplicates.
+
+    Uses NumPy's vectorised set operations, over each triple's IDs as one 24-byte row, if NumPy is installed, and
+    otherwise Python sets of each triple's IDs packed into one integer."""
+    if numpy is not None:
+        row = numpy.dtype((numpy.void, 24))
+        p = numpy.frombuffer(previous, dtype=numpy.uint64).view(row)
+        c = numpy.frombuffer(current, dtype=numpy.uint64).view(row)
+        return (
+            array("Q", numpy.setdiff1d(p, c, assume_unique=True).tobytes()),
+            array("Q", numpy.setdiff1d(c, p, assume_unique=True).tobytes()),
+        )
+
+    width = max(max(previous, default=0), max(current, default=0)).bit_length()
+    mask = (1 << width) - 1
+
+    def _pack(encoded: array) -> set[int]:
+        it = iter(encoded)
+        return {
+            (s << width | p) << width | o for s, p, o in zip(it, it, it, strict=True)
+        }
+
+    def _unpack(packed: set[int]) -> array:
+        unpacked = array("Q")
+        for t in packed:
+            unpacked.extend((t >> 2 * width, t >> width & mask, t & mask))
+        return unpacked
+
+    p = _pack(previous)
+    c = _pack(current)
+    return _unpack(p - c), _unpack(c - p)
 
-def _generate_rdf_patch_from_datasets(ds: Dataset, previous_ds: Dataset) -> str:
-    """Generate an RDF patch body from two datasets.
 
-    Computes the diff between datasets and generates an RDF patch
-    with TX/TC markers but no header.
+def _generate_rdf_patch_lines(
+    ds: Dataset, previous_ds: Dataset | None = None
+) -> Generator[str, None, None]:
+    """Generate the lines of an RDF patch body, with TX/TC markers but no header, from two datasets, or of an add-only
+    patch from one.
+
+    Deletions, statements in previous_ds but not in ds, come before additions and each are sorted, so the patch is the
+    same for the same datasets. Graphs are compared one at a time with their terms interned as integer IDs, as per
+    _encode_triples(), so the differences are computed over packed integer arrays and held as such, and are decoded only
+    when their statements are written.
 
     Parameters:
         ds: The current/target dataset.
         previous_ds: The previous/source dataset.
 
-    Returns:
-        RDF patch body string with TX . at start and TC . at end.
+    Yields:
+        RDF patch body lines, starting with TX . and ending with TC .
     """
-    # Convert datasets to sets of quads for faster diff operations
-    logger.info("Extracting quads from current dataset")
-    ds_quads = set(ds.quads())
-    logger.info(f"Quads: {len(ds_quads)}")
-    logger.info("Extracting quads from previous dataset")
-    previous_ds_quads = set(previous_ds.quads())
-    logger.info(f"Quads: {len(previous_ds_quads)}")
-
-    # Compute diffs using set operations
-    # Statements in previous but not in current = deletions
-    logger.info("Computing deletions (previous - current)")
-    to_delete_quads = previous_ds_quads - ds_quads
-    # Statements in current but not in previous = additions
-    logger.info("Computing additions (current - previous)")
-    to_add_quads = ds_quads - previous_ds_quads
-
-    # Build patch body
-    lines = ["TX ."]
-
-    # Serialize and add deletion statements
-    logger.info("Serializing deletions to N-Quads")
-    if to_delete_quads:
-        delete_ds = Dataset()
-        for s, p, o, g in to_delete_quads:
-            delete_ds.add((s, p, o, g))
-        delete_nquads = delete_ds.serialize(format="nquads")
-        for line in delete_nquads.strip().split("\n"):
-            if line:
-                lines.append(f"D {line}")
-
-    # Serialize and add addition statements
-    logger.info("Serializing additions to N-Quads")
-    if to_add_quads:
-        add_ds = Dataset()
-        for s, p, o, g in to_add_quads:
-            add_ds.add((s, p, o, g))
-        add_nquads = add_ds.serialize(format="nquads")
-        for line in add_nquads.strip().split("\n"):
-            if line:
-                lines.append(f"A {line}")
-
-    lines.append("TC .")
-
-    logger.info("RDF patch generation done")
-    return "\n".join(lines)
-
-
-def _generate_rdf_patch_body_add(ds: Dataset) -> Generator[str, None, None]:
+    yield "TX ."
+    if previous_ds is None:
+        yield from _rdf_patch_statements(
+            "A", ((s, p, o, g.identifier) for g in ds.graphs() for s, p, o in g)
+        )
+    else:
+        ids = {}
+        terms = []
+        deletions = []
+        additions = []
+        graphs = {g.identifier: g for g in previous_ds.graphs()}
+        for g in ds.graphs():
+            previous = graphs.pop(g.identifier, None)
+            deleted, added = _diff_encoded_triples(
+                _encode_triples(previous, ids, terms)
+                if previous is not None
+                else array("Q"),
+                _encode_triples(g, ids, terms),
+            )
+            deletions.append((g.identifier, deleted))
+            additions.append((g.identifier, added))
+        for identifier, previous in graphs.items():
+            deletions.append((identifier, _encode_triples(previous, ids, terms)))
+        del ids
+
+        def _decode(encoded: list[tuple[Node, array]]):
+            for identifier, triples in encoded:
+                for i in range(0, len(triples), 3):
+                    yield (
+                        terms[triples[i]],
+                        terms[triples[i + 1]],
+                        terms[triples[i + 2]],
+                        identifier,
+                    )
+
+        logger.info("Computed deletions (previous - current)")
+        yield from _rdf_patch_statements("D", _decode(deletions))
+        logger.info("Computed additions (current - previous)")
+        yield from _rdf_patch_statements("A", _decode(additions))
+    yield "TC ."
+
+
+def _split_bnode_components(graph: Graph) -> tuple[list, list[list]]:
+    """Splits a graph's triples into those without Blank Nodes and the connected components of those with them, where
+    triples are connected by the Blank Nodes they share."""
+    parents = {}
+
+    def _find(b: BNode) -> BNode:
+        while parents.setdefault(b, b) != b:
+            parents[b] = parents[parents[b]]
+            b = parents[b]
+        return b
+
+    ground = []
+    bnode_triples = []
+    for triple in graph:
+        bnodes = [t for t in triple if isinstance(t, BNode)]
+        if len(bnodes) == 0:
+            ground.append(triple)
+            continue
+        bnode_triples.append((triple, bnodes[0]))
+        for b in bnodes[1:]:
+            parents[_find(b)] = _find(bnodes[0])
+
+    components = {}
+    for triple, b in bnode_triples:
+        components.setdefault(_find(b), []).append(triple)
+    return ground, list(components.values())
+
+
+def _canonicalise_triples(triples: list) -> list:
+    g = Graph()
+    for triple in triples:
+        g.add(triple)
+    return list(to_canonical_graph(g))
+
+
+def _canonicalise_nt(data: bytes) -> bytes:
+    """Worker process variant of _canonicalise_triples() that takes and returns N-Triples"""
+    g = to_canonical_graph(Graph().parse(data=data, format="nt"))
+    return g.serialize(format="nt", encoding="utf-8")
+
+
+def _canonicalise_nt_batch(batch: list[bytes]) -> list[bytes]:
+    """Canonicalises each of a batch of components' N-Triples separately, as per _canonicalise_nt()"""
+    return [_canonicalise_nt(data) for data in batch]
+
+
+def _batch_components(components: list[list], n: int) -> list[list[int]]:
+    """Groups the indexes of components into at most n batches of roughly equal triple counts, largest first"""
+    batches = [(0, i, []) for i in range(min(n, len(components)))]
+    for c in sorted(range(len(components)), key=lambda c: -len(components[c])):
+        size, i, batch = heapq.heappop(batches)
+        batch.append(c)
+        heapq.heappush(batches, (size + len(components[c]), i, batch))
+    return [batch for _, _, batch in sorted(batches, key=lambda b: b[1])]
+
+
+def _canonicalise_components(
+    components: list[list],
+    executor: ProcessPoolExecutor | None = None,
+    workers: int = 1,
+) -> list:
+    """Canonicalises Blank Node components separately, in batches in the worker processes of an executor with workers
+    processes if one is given and there are at least CANON_MIN_PARALLEL_COMPONENTS components, returning all their
+    triples.
+
+    Should two components be given the same Blank Node identifiers, which happens only when they are isomorphic, they
+    are canonicalised together instead so that neither is lost."""
+    if executor is None or len(components) < CANON_MIN_PARALLEL_COMPONENTS:
+        canon_components = [_canonicalise_triples(c) for c in components]
+    else:
+        batches = _batch_components(components, workers * CANON_BATCHES_PER_WORKER)
+        payloads = []
+        for batch in batches:
+            payloads.append([])
+            for c in batch:
+                g = Graph()
+                for triple in components[c]:
+                    g.add(triple)
+                payloads[-1].append(g.serialize(format="nt", encoding="utf-8"))
+        canon_components = [None] * len(components)
+        for batch, results in zip(
+            batches, executor.map(_canonicalise_nt_batch, payloads), strict=True
+        ):
+            for c, data in zip(batch, results, strict=True):
+                g = Graph()
+                _parse_line_oriented(io.BytesIO(data), g, preserve_bnode_ids=True)
+                canon_components[c] = list(g)
+
+    seen = set()
+    for c in canon_components:
+        bnodes = {t for triple in c for t in triple if isinstance(t, BNode)}
+        if not seen.isdisjoint(bnodes):
+            return _canonicalise_triples([t for c in components for t in c])
+        seen |= bnodes
+    return [triple for c in canon_components for triple in c]
+
+
+def _canonical_graphs(
+    ds: Dataset,
+    cache_dir: Path | None = None,
+    cache_keys: dict | None = None,
+    canon_workers: int = 1,
+) -> Generator[tuple[URIRef, Iterable], None, None]:
+    """Yields the IRI and the canonical triples of each graph in a dataset, one graph at a time.
+
+    Graphs without Blank Nodes are already canonical and are yielded as they are. For the others, only the connected
+    components of triples with Blank Nodes are canonicalised, in a pool of canon_workers processes if more than 1.
+
+    If a cache_dir is given, the canonical forms of graphs with cache_keys are read from, or else written to, it."""
+    executor = (
+        ProcessPoolExecutor(max_workers=canon_workers) if canon_workers > 1 else None
+    )
+    try:
+        for graph in ds.graphs():
+            key = None
+            if cache_dir is not None and cache_keys is not None:
+                key = cache_keys.get(graph.identifier)
+            canon_graph = _read_canon_cache(cache_dir, key) if key is not None else None
+            if canon_graph is not None:
+                yield graph.identifier, canon_graph
+                continue
+
+            ground, components = _split_bnode_components(graph)
+            if len(components) == 0:
+                yield graph.identifier, graph
+                continue
+            canon_triples = _canonicalise_components(
+                components, executor, canon_workers
+            )
+            if key is not None:
+                canon_graph = Graph()
+                for triple in ground + canon_triples:
+                    canon_graph.add(triple)
+                _write_canon_cache(cache_dir, key, canon_graph)
+            yield graph.identifier, ground + canon_triples
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+
+def _generate_canon_dataset(
+    ds: Dataset,
+    cache_dir: Path | None = None,
+    cache_keys: dict | None = None,
+    canon_workers: int = 1,
+) -> Dataset:
+    """Generate a canonical dataset from a dataset, as per _canonical_graphs()."""
+    return_ds = Dataset()
+    for identifier, triples in _canonical_graphs(
+        ds, cache_dir, cache_keys, canon_workers
+    ):
+        target_graph = return_ds.graph(identifier)
+        target_graph.addN((s, p, o, target_graph) for s, p, o in triples)
+    return return_ds
+
+
+def _external_sort(
+    lines: Iterable[str],
+    tmp_dir: Path,
+    buffer_bytes: int,
+    tmp_max_bytes: int | None = None,
+) -> Generator[str, None, None]:
+    """Yields lines sorted and without duplicates, holding at most about buffer_bytes of them in memory.
+
+    Lines are sorted in runs that are written to files in tmp_dir, which are then merged. Raises a ValueError if the
+    runs would take more than tmp_max_bytes."""
+    runs = []
+    written = 0
+
+    def _write_run(run: list[str]) -> None:
+        nonlocal written
+        run.sort()
+        fd, f = tempfile.mkstemp(dir=tmp_dir, prefix="run-", suffix=".nq")
+        runs.append(Path(f))
+        with open(fd, "w", encoding="utf-8") as fh:
+            for line in run:
+                fh.write(line + "\n")
+        written += runs[-1].stat().st_size
+        if tmp_max_bytes is not None and written > tmp_max_bytes:
+            raise ValueError(
+                f"Sorting needs more than the {tmp_max_bytes} bytes of temporary files allowed"
+            )
+
+    def _remove_runs() -> None:
+        for f in runs:
+            f.unlink(missing_ok=True)
+
+    # the runs are closed & removed however sorting ends, including with an error or by the generator being closed
+    with contextlib.ExitStack() as stack:
+        stack.callback(_remove_runs)
+
+        run = []
+        size = 0
+        for line in lines:
+            run.append(line)
+            size += sys.getsizeof(line)
+            if size >= buffer_bytes:
+                _write_run(run)
+                run = []
+                size = 0
+
+        if len(runs) == 0:
+            merged = iter(sorted(run))
+        else:
+            if len(run) > 0:
+                _write_run(run)
+            del run
+            files = [stack.enter_context(open(f, encoding="utf-8")) for f in runs]
+            merged = (line[:-1] for line in heapq.merge(*files))
+
+        previous = None
+        for line in merged:
+            if line != previous:
+                yield line
+                previous = line
+
+
+def _merge_join(
+    previous_lines: Iterable[str], lines: Iterable[str]
+) -> Generator[tuple[str, str], None, None]:
+    """Yields ("D", line) for each line only in previous_lines and ("A", line) for each line only in lines, both of
+    which must be sorted and without duplicates, in sorted order"""
+    previous_lines = iter(previous_lines)
+    lines = iter(lines)
+    p = next(previous_lines, None)
+    c = next(lines, None)
+    while p is not None or c is not None:
+        if c is None or (p is not None and p < c):
+            yield "D", p
+            p = next(previous_lines, None)
+        elif p is None or c < p:
+            yield "A", c
+            c = next(lines, None)
+        else:
+            p = next(previous_lines, None)
+            c = next(lines, None)
+
+
+def _generate_rdf_patch_lines_external(
+    ds: Dataset,
+    previous_ds: Dataset | None = None,
+    cache_dir: Path | None = None,
+    cache_keys: dict | None = None,
+    previous_cache_keys: dict | None = None,
+    canon_workers: int = 1,
+    sort_buffer_bytes: int = 256_000_000,
+    sort_tmp_dir: Path | None = None,
+    sort_tmp_max_bytes: int | None = None,
+) -> Generator[str, None, None]:
+    """Out-of-core variant of _generate_rdf_patch_lines() for datasets too large to diff in memory.
+
+    Each dataset is canonicalised one graph at a time, as per _canonical_graphs(), and its N-Quads are sorted with an
+    external merge sort using, for each dataset, at most about sort_buffer_bytes of memory and sort_tmp_max_bytes of
+    temporary files in sort_tmp_dir. Additions & deletions are then found by merge-joining the sorted N-Quads, with
+    additions written to a temporary file until all deletions have been yielded. The patch is the same as
+    _generate_rdf_patch_lines() gives for the canonical datasets."""
+
+    def _lines(d: Dataset, keys: dict | None) -> Generator[str, None, None]:
+        for identifier, triples in _canonical_graphs(d, cache_dir, keys, canon_workers):
+            for s, p, o in triples:
+                yield _nq_statement(s, p, o, identifier)
+
+    yield "TX ."
+    with tempfile.TemporaryDirectory(dir=sort_tmp_dir) as tmp_dir:
+        current = _external_sort(
+            _lines(ds, cache_keys), tmp_dir, sort_buffer_bytes, sort_tmp_max_bytes
+        )
+        if previous_ds is None:
+            for line in current:
+                yield f"A {line}"
+        else:
+            previous = _external_sort(
+                _lines(previous_ds, previous_cache_keys),
+                tmp_dir,
+                sort_buffer_bytes,
+                sort_tmp_max_bytes,
+            )
+            additions = Path(tmp_dir) / "additions.nq"
+            with open(additions, "w", encoding="utf-8") as fh:
+                for operation, line in _merge_join(previous, current):
+                    if operation == "D":
+                        yield f"D {line}"
+                    else:
+                        fh.write(line + "\n")
+            with open(additions, encoding="utf-8") as fh:
+                for line in fh:
+                    yield f"A {line[:-1]}"
+    yield "TC ."
+
+
+def _generate_rdf_patch_body_add(
+    ds: Dataset,
+    cache_dir: Path | None = None,
+    cache_keys: dict | None = None,
+    canon_workers: int = 1,
+    sort_buffer_bytes: int | None = None,
+    sort_tmp_dir: Path | None = None,
+    sort_tmp_max_bytes: int | None = None,
+    chunk_size: int = RDF_PATCH_CHUNK_SIZE,
+) -> Generator[str, None, None]:
     """Generate an add-only RDF patch body from a dataset.
 
+    If sort_buffer_bytes is given, the patch is generated out-of-core, as per _generate_rdf_patch_lines_external().
+
     Yields:
-        Chunks of the RDF patch body.
+        Chunks of the RDF patch body, each a self-contained patch of at most chunk_size bytes.
     """
+    if sort_buffer_bytes is not None:
+        logger.info("Streaming add-only RDF patch body with an external sort")
+        yield from _chunk_rdf_patch_lines(
+            _generate_rdf_patch_lines_external(
+                ds,
+                None,
+                cache_dir,
+                cache_keys,
+                None,
+                canon_workers,
+                sort_buffer_bytes,
+                sort_tmp_dir,
+                sort_tmp_max_bytes,
+            ),
+            chunk_size,
+        )
+        logger.info("Serialization done.")
+        return
+
     logger.info("Canonicalising add-only dataset")
-    return_ds = _generate_canon_dataset(ds)
-    logger.info("Serializing add-only RDF patch body to string")
-    output = return_ds.serialize(format="patch", operation="add")
+    return_ds = _generate_canon_dataset(ds, cache_dir, cache_keys, canon_workers)
+    logger.info("Streaming add-only RDF patch body")
+    yield from _chunk_rdf_patch_lines(_generate_rdf_patch_lines(return_ds), chunk_size)
     logger.info("Serialization done.")
-    yield from _rdf_patch_body_substr(output)
 
 
 def _generate_rdf_patch_body_diff(
-    ds: Dataset, previous_ds: Dataset
+    ds: Dataset,
+    previous_ds: Dataset,
+    cache_dir: Path | None = None,
+    cache_keys: dict | None = None,
+    previous_cache_keys: dict | None = None,
+    canon_workers: int = 1,
+    sort_buffer_bytes: int | None = None,
+    sort_tmp_dir: Path | None = None,
+    sort_tmp_max_bytes: int | None = None,
+    chunk_size: int = RDF_PATCH_CHUNK_SIZE,
 ) -> Generator[str, None, None]:
     """Generate an RDF patch body diff between two datasets.
 
+    If sort_buffer_bytes is given, the diff is computed out-of-core, as per _generate_rdf_patch_lines_external().
+
     Yields:
-        Chunks of the RDF patch body.
+        Chunks of the RDF patch body, each a self-contained patch of at most chunk_size bytes.
     """
+    if sort_buffer_bytes is not None:
+        logger.info("Streaming diff-only RDF patch body with an external sort")
+        yield from _chunk_rdf_patch_lines(
+            _generate_rdf_patch_lines_external(
+                ds,
+                previous_ds,
+                cache_dir,
+                cache_keys,
+                previous_cache_keys,
+                canon_workers,
+                sort_buffer_bytes,
+                sort_tmp_dir,
+                sort_tmp_max_bytes,
+            ),
+            chunk_size,
+        )
+        logger.info("Serialization done.")
+        return
+
     logger.info("Canonicalising diff-only previous dataset")
-    previous_ds = _generate_canon_dataset(previous_ds)
+    previous_ds = _generate_canon_dataset(
+        previous_ds, cache_dir, previous_cache_keys, canon_workers
+    )
     logger.info("Canonicalising diff-only current dataset")
-    ds = _generate_canon_dataset(ds)
-    logger.info("Serializing diff-only RDF patch body to string")
-    output = _generate_rdf_patch_from_datasets(ds, previous_ds)
+    ds = _generate_canon_dataset(ds, cache_dir, cache_keys, canon_workers)
+    logger.info("Streaming diff-only RDF patch body")
+    yield from _chunk_rdf_patch_lines(
+        _generate_rdf_patch_lines(ds, previous_ds), chunk_size
+    )
     logger.info("Serialization done.")
-    yield from _rdf_patch_body_substr(output)
+
+
+def _generate_ahead(
+    items: Generator[str, None, None], max_queued: int = 2
+) -> Generator[str, None, None]:
+    """Yields items in order while the next, up to max_queued of them, are generated in a background thread, so that
+    generating items overlaps with whatever is done with each, such as sending it.
+
+    Exceptions from generating items are raised when the item would have been yielded, and items is closed once done
+    with, whether or not all of it was used."""
+    executor = ThreadPoolExecutor(max_workers=1)
+    try:
+        in_flight = deque(executor.submit(next, items, None) for _ in range(max_queued))
+        while True:
+            item = in_flight.popleft().result()
+            if item is None:
+                return
+            in_flight.append(executor.submit(next, items, None))
+            yield item
+    finally:
+        executor.shutdown(cancel_futures=True)
+        items.close()
 
 
 def sync_rdf_delta(
@@ -233,25 +1042,42 @@ def sync_rdf_delta(
     sparql_endpoint: str,
     http_client: httpx.Client,
     event_client: EventClient,
+    canon_cache_dir: Path | None = None,
+    canon_cache_max_bytes: int = 1_000_000_000,
+    canon_workers: int = 1,
+    sort_buffer_bytes: int | None = None,
+    sort_tmp_dir: Path | None = None,
+    sort_tmp_max_bytes: int | None = None,
+    chunk_size: int = RDF_PATCH_CHUNK_SIZE,
+    max_queued_chunks: int = 2,
 ):
     """Synchronize a Prez Manifest's resources with an event-based system that takes RDF patches.
 
+    The Manifest's content is read as it is in the HEAD commit, so changes not yet committed aren't synced.
+
     Parameters:
         current_working_directory: The current working directory path.
         manifest: The path of the Prez Manifest file to be loaded.
         sparql_endpoint: The URL of the SPARQL Endpoint.
         http_client: The HTTP client to use for making requests.
         event_client: The event client to use for sending events.
+        canon_cache_dir: A directory in which to cache the canonical forms of graphs, keyed by their files' git blob
+            SHAs, so that each version of a file is canonicalised once across runs and branches.
+        canon_cache_max_bytes: The size to which the least recently used entries are evicted from the cache after a
+            sync.
+        canon_workers: The number of processes in which to canonicalise graphs with Blank Nodes.
+        sort_buffer_bytes: If given, the datasets are diffed out-of-core, with an external sort that holds at most
+            about this many bytes of each dataset's statements in memory, for datasets too large to diff in memory.
+        sort_tmp_dir: The directory for the external sort's temporary files, by default the system's.
+        sort_tmp_max_bytes: The most the external sort's temporary files may take, beyond which a ValueError is
+            raised.
+        chunk_size: The most bytes, UTF-8 encoded, of each event's RDF patch. Each event is a self-contained patch, a
+            transaction of whole statements, so any one can be retried.
+        max_queued_chunks: The most chunks generated, in a background thread, ahead of the one being sent.
     """
 
-    # Load the manifest on the latest commit.
-    ds = load(manifest, return_data_type=ReturnDatatype.dataset)
-    system_graph = ds.graph(OLIS.SystemGraph)
-    vg_iri = system_graph.value(predicate=RDF.type, object=OLIS.VirtualGraph)
-    if vg_iri is None:
-        raise ValueError(
-            "Could not find the Virtual Graph instance in the Olis system graph"
-        )
+    manifest = get_manifest_paths_and_graph(manifest)
+    vg_iri = get_catalogue_iri_from_manifest(manifest)
     logger.info(f"Virtual Graph IRI: {vg_iri}")
 
     # Query the SPARQL endpoint and retrieve the git commit hash version from the system graph.
@@ -263,6 +1089,49 @@ def sync_rdf_delta(
     current_commit_hash = repo.head.commit.hexsha
     logger.info(f"Current commit hash: {current_commit_hash}")
 
+    # If the Manifest itself is unchanged since the previous commit, only the graphs of changed files need loading
+    # from either commit. Unchanged graphs are identical and so absent from the patch.
+    changed_paths = None
+    if previous_commit_hash is not None:
+        changed_paths = _changed_paths(repo, previous_commit_hash)
+        manifest_path = _manifest_path_in_repo(repo, manifest)
+        if changed_paths is not None and manifest_path in changed_paths:
+            changed_paths = None
+        logger.info(
+            "Loading all graphs"
+            if changed_paths is None
+            else f"Loading the graphs of {len(changed_paths)} changed files"
+        )
+
+    # Load the manifest on the latest commit, in the background, while the previous commit's is loaded. Both are read
+    # from git's object database, so uncommitted changes in the working tree are never sent, and the commit hash sent
+    # is always that of the content sent.
+    executor = ThreadPoolExecutor(max_workers=1)
+    try:
+        cache_keys = {} if canon_cache_dir is not None else None
+        previous_cache_keys = {} if canon_cache_dir is not None else None
+        # GitPython's object database readers aren't thread safe, so this load has its own Repo
+        current_ds = executor.submit(
+            _load_commit_dataset,
+            Repo(current_working_directory),
+            current_commit_hash,
+            manifest,
+            changed_paths,
+            cache_keys,
+        )
+
+        if previous_commit_hash is not None:
+            logger.info(
+                f"Loading previous manifest dataset from commit: {previous_commit_hash}"
+            )
+            previous_ds = _load_commit_dataset(
+                repo, previous_commit_hash, manifest, changed_paths, previous_cache_keys
+            )
+
+        ds = current_ds.result()
+    finally:
+        executor.shutdown(cancel_futures=True)
+
     if previous_commit_hash is None:
         logger.info(
             "Previous commit hash is None. Adding current commit hash to dataset."
@@ -270,14 +1139,17 @@ def sync_rdf_delta(
         logger.info("Adding commit hash to current manifest dataset")
         _add_commit_hash_to_dataset(current_commit_hash, ds)
         logger.info("Generating RDF patch body chunks for add operation")
-        rdf_patch_body_chunks = _generate_rdf_patch_body_add(ds)
+        rdf_patch_body_chunks = _generate_rdf_patch_body_add(
+            ds,
+            canon_cache_dir,
+            cache_keys,
+            canon_workers,
+            sort_buffer_bytes,
+            sort_tmp_dir,
+            sort_tmp_max_bytes,
+            chunk_size,
+        )
     else:
-        # Check out the previous commit.
-        # Generate the previous manifest dataset.
-        logger.info(f"Checking out previous commit: {previous_commit_hash}")
-        repo.git.checkout(previous_commit_hash)
-        logger.info("Loading previous manifest dataset")
-        previous_ds = load(manifest, return_data_type=ReturnDatatype.dataset)
         logger.info("Adding commit hash to previous manifest dataset")
         _add_commit_hash_to_dataset(previous_commit_hash, previous_ds)
         logger.info("Adding commit hash to current manifest dataset")
@@ -285,9 +1157,25 @@ def sync_rdf_delta(
 
         # Generate an RDF patch between the previous commit dataset and the current commit dataset.
         logger.info("Generating RDF patch body chunks for diff operation")
-        rdf_patch_body_chunks = _generate_rdf_patch_body_diff(ds, previous_ds)
+        rdf_patch_body_chunks = _generate_rdf_patch_body_diff(
+            ds,
+            previous_ds,
+            canon_cache_dir,
+            cache_keys,
+            previous_cache_keys,
+            canon_workers,
+            sort_buffer_bytes,
+            sort_tmp_dir,
+            sort_tmp_max_bytes,
+            chunk_size,
+        )
 
-    # Create events for each chunk.
-    for i, chunk in enumerate(rdf_patch_body_chunks):
+    # Create events for each chunk, in order, while the next chunks are generated.
+    for i, chunk in enumerate(
+        _generate_ahead(rdf_patch_body_chunks, max_queued_chunks)
+    ):
         logger.info(f"Creating event for chunk {i + 1}")
         event_client.create_event(chunk)
+
+    if canon_cache_dir is not None:
+        _evict_canon_cache(canon_cache_dir, canon_cache_max_bytes)
@@ -8,13 +8,16 @@ from enum import Enum
 from pathlib import Path
 
 import httpx
-from kurra.utils import load_graph
 from kurra.labels import get_missing_labels, find_missing_labels
 from rdflib import BNode, Graph, Literal
 from rdflib.namespace import PROF, RDF
 
 from prezmanifest.definednamespaces import MRR, PREZ
-from prezmanifest.utils import denormalise_artifacts, get_manifest_paths_and_graph
+from prezmanifest.utils import (
+    denormalise_artifacts,
+    get_manifest_paths_and_graph,
+    load_artifact_graph,
+)
 
 
 class LabellerOutputTypes(str, Enum):
@@ -46,7 +49,7 @@ def label(
     artifacts = denormalise_artifacts((manifest_path, manifest_root, manifest_graph))
 
     for k, v in artifacts.items():
-            context_graph += load_graph(k)
+            context_graph += load_artifact_graph(k)
 
     # add labels for system IRIs
     context_graph.parse(Path(__file__).parent / "system-labels.ttl")
@@ -14,6 +14,9 @@ Run this script with the -h flag for more help, i.e. ~$ python loader.py -h
 
 import logging
 import sys
+from collections import deque
+from collections.abc import Generator
+from concurrent.futures import ProcessPoolExecutor
 from enum import Enum
 from getpass import getpass
 from pathlib import Path
@@ -22,15 +25,22 @@ import httpx
 from kurra.db.gsp import upload
 from kurra.file import export_quads, make_dataset
 from kurra.utils import load_graph
-from rdflib import DCTERMS, PROF, RDF, SDO, SKOS, Dataset, Graph, URIRef
+from rdflib import DCTERMS, PROF, RDF, SDO, SKOS, Dataset, Graph, Node, URIRef
 
 from prezmanifest.definednamespaces import MRR, OLIS
 from prezmanifest.utils import (
+    BACKGROUND_GRAPH_IRI,
     KNOWN_ENTITY_CLASSES,
     get_catalogue_iri_from_manifest,
+    get_content_hash,
     get_files_from_artifact,
     get_manifest_paths_and_graph,
+    get_rdf_format,
+    get_uncompressed_size,
+    load_rdf_file,
     make_httpx_client,
+    set_content_hashes_sparql,
+    upload_rdf_data,
 )
 
 
@@ -40,6 +50,86 @@ class ReturnDatatype(str, Enum):
     none = None
 
 
+def _parse_resource_file(
+    f: Path, role: URIRef, artifact: Node
+) -> tuple[URIRef | None, Graph | Dataset | None]:
+    """Parses a Resource's file and determines the IRI of the graph it is to be loaded into.
+
+    Any supported RDF format, compressed or not, may be used. Returns a None IRI for quads files, as their graph IRIs
+    are given within them, and None data for files not in a recognised RDF format."""
+    rdf_format = get_rdf_format(f)
+    if rdf_format is None:
+        return None, None
+
+    try:
+        data = load_rdf_file(f)
+    except Exception as e:
+        raise ValueError(f"Could not load file {f}. Error is {e}") from e
+
+    if isinstance(data, Dataset):
+        return None, data
+
+    resource_iri = None
+    if role == MRR.ResourceData:
+        resource_iri = data.value(subject=artifact, predicate=SDO.mainEntity)
+        if resource_iri is None:
+            for entity_class in KNOWN_ENTITY_CLASSES:
+                v = data.value(predicate=RDF.type, object=entity_class)
+                if v is not None:
+                    resource_iri = v
+
+    if role in [
+        MRR.CompleteCatalogueAndResourceLabels,
+        MRR.IncompleteCatalogueAndResourceLabels,
+    ]:
+        resource_iri = URIRef(BACKGROUND_GRAPH_IRI)
+
+    if resource_iri is None:
+        raise ValueError(f"Could not determine Resource IRI for file {f}")
+
+    return resource_iri, data
+
+
+def _parse_resource_file_to_bytes(
+    f: Path, role: URIRef, artifact: Node
+) -> tuple[URIRef | None, bytes | None]:
+    """Worker process variant of _parse_resource_file() that returns a compact N-Triples or N-Quads payload"""
+    resource_iri, data = _parse_resource_file(f, role, artifact)
+    if data is None:
+        return resource_iri, None
+
+    return resource_iri, data.serialize(
+        format="nt" if resource_iri is not None else "nquads", encoding="utf-8"
+    )
+
+
+def _parse_resource_files(
+    jobs: list[tuple[Path, URIRef, Node]], parse_workers: int = 1
+) -> Generator[tuple[Path, URIRef | None, Graph | Dataset | bytes | None]]:
+    """Parses Resource files, given as (file, role, artifact) jobs, yielding (file, IRI, data) in job order.
+
+    With more than one parse worker, files are parsed in a process pool with at most 2 files in flight per worker so
+    that parsing is never too far ahead of exporting."""
+    if parse_workers <= 1:
+        for f, role, artifact in jobs:
+            yield f, *_parse_resource_file(f, role, artifact)
+        return
+
+    with ProcessPoolExecutor(max_workers=parse_workers) as executor:
+        in_flight = deque()
+        for f, role, artifact in jobs:
+            in_flight.append(
+                (f, executor.submit(_parse_resource_file_to_bytes, f, role, artifact))
+            )
+            if len(in_flight) >= parse_workers * 2:
+                f_done, future = in_flight.popleft()
+                yield f_done, *future.result()
+
+        while in_flight:
+            f_done, future = in_flight.popleft()
+            yield f_done, *future.result()
+
+
 def load(
     manifest: Path | tuple[Path, Path, Graph],
     sparql_endpoint: str = None,
@@ -48,10 +138,17 @@ def load(
     timeout: int = 60,
     destination_file: Path = None,
     return_data_type: ReturnDatatype = ReturnDatatype.none,
+    parse_workers: int = 1,
+    graph_sources: dict | None = None,
 ) -> None | Graph | Dataset:
     """Loads a catalogue of data from a prezmanifest file, whose content are valid according to the Prez Manifest Model
     (https://kurrawong.github.io/prez.dev/manifest/) either into a specified quads file in the Trig format, or into a
-    given SPARQL Endpoint."""
+    given SPARQL Endpoint.
+
+    If parse_workers is greater than 1, Resource files are parsed by a pool of that many worker processes which return
+    N-Triples / N-Quads payloads to this process for export while the next files are parsed.
+
+    If graph_sources, a dict, is given, it is filled with the files each graph is loaded from, keyed by graph IRI."""
 
     # validate and load
     manifest_path, manifest_root, manifest_graph = get_manifest_paths_and_graph(
@@ -105,7 +202,7 @@ def load(
         http_client = None
 
     def _export(
-        data: Graph | Dataset,
+        data: Graph | Dataset | bytes,
         iri,
         http_client: httpx.Client | None,
         sparql_endpoint,
@@ -121,26 +218,28 @@ def load(
 
             if destination_file is not None:
                 export_quads(data, destination_file)
-            elif sparql_endpoint is not None:
+            else:
                 for g in data.graphs():
                     if g.identifier != URIRef("urn:x-rdflib:default"):
                         _export(
                             data=g,
                             iri=g.identifier,
                             http_client=http_client,
+                            sparql_endpoint=sparql_endpoint,
                             destination_file=None,
-                            return_data_type=None,
+                            return_data_type=return_data_type,
                         )
-            else:
-                if return_data_type == "Dataset":
-                    return data
-                elif return_data_type == "Graph":
-                    gx = Graph()
-                    for g in data.graphs():
-                        if g.identifier != URIRef("urn:x-rdflib:default"):
-                            for s, p, o in g.triples((None, None, None)):
-                                gx.add((s, p, o))
-                    return gx
+
+        elif type(data) is bytes:
+            # an N-Triples payload from a parse worker, only sent to a SPARQL Endpoint unparsed
+            logging.info(f"exporting {iri} to SPARQL Endpoint {sparql_endpoint}")
+            upload_rdf_data(
+                sparql_endpoint,
+                data,
+                iri,
+                append=append,
+                http_client=http_client,
+            )
 
         elif type(data) is Graph:
             if iri is None:
@@ -189,6 +288,8 @@ def load(
         )
 
     vg = Graph()
+    # content hashes of the graphs loaded into a SPARQL Endpoint, recorded in its System Graph for syncing
+    content_hashes = {}
 
     for s, o in manifest_graph.subject_objects(PROF.hasResource):
         for role in manifest_graph.objects(o, PROF.hasRole):
@@ -198,6 +299,10 @@ def load(
                     # load the Catalogue, determine the Virtual Graph & Catalogue IRIs
                     # and fail if we can't see a Catalogue object
                     catalogue_graph = load_graph(manifest_root / artifact)
+                    if graph_sources is not None:
+                        graph_sources.setdefault(catalogue_iri, []).append(
+                            manifest_root / artifact
+                        )
 
                     if vg_iri is None:
                         raise ValueError(
@@ -222,11 +327,16 @@ def load(
                         destination_file=destination_file,
                         return_data_type=return_data_type,
                     )
+                    if sparql_endpoint is not None:
+                        content_hashes[str(catalogue_iri)] = get_content_hash(
+                            catalogue_graph
+                        )
 
     # non-catalogue resources
+    # The data files & background - must be processed after Catalogue
+    jobs = []
     for s, o in manifest_graph.subject_objects(PROF.hasResource):
         for role in manifest_graph.objects(o, PROF.hasRole):
-            # The data files & background - must be processed after Catalogue
             if role in [
                 MRR.CompleteCatalogueAndResourceLabels,
                 MRR.IncompleteCatalogueAndResourceLabels,
@@ -236,79 +346,279 @@ def load(
                     for f in get_files_from_artifact(
                         (manifest_path, manifest_root, manifest_graph), artifact
                     ):
-                        if str(f.name).endswith(".ttl"):
-                            try:
-                                fg = Graph().parse(f)
-                            except Exception as e:
-                                raise ValueError(
-                                    f"Could not load file {f}. Error is {e}"
-                                )
-
-                            # fg.bind("rdf", RDF)
-
-                            if role == MRR.ResourceData:
-                                resource_iri = fg.value(
-                                    subject=artifact, predicate=SDO.mainEntity
-                                )
-                                if resource_iri is None:
-                                    for entity_class in KNOWN_ENTITY_CLASSES:
-                                        v = fg.value(
-                                            predicate=RDF.type, object=entity_class
-                                        )
-                                        if v is not None:
-                                            resource_iri = v
-
-                            if role in [
-                                MRR.CompleteCatalogueAndResourceLabels,
-                                MRR.IncompleteCatalogueAndResourceLabels,
-                            ]:
-                                resource_iri = URIRef("http://background")
-
-                            if resource_iri is None:
-                                raise ValueError(
-                                    f"Could not determine Resource IRI for file {f}"
-                                )
-
-                            vg.add((vg_iri, OLIS.isAliasFor, resource_iri))
-
-                            # export one Resource
-                            _export(
-                                data=fg,
-                                iri=resource_iri,
-                                http_client=http_client,
-                                sparql_endpoint=sparql_endpoint,
-                                destination_file=destination_file,
-                                return_data_type=return_data_type,
-                            )
-                        elif str(f.name).endswith(".trig"):
-                            d = Dataset()
-                            d.parse(f)
-                            for g in d.graphs():
-                                if g.identifier != URIRef("urn:x-rdflib:default"):
-                                    vg.add((vg_iri, OLIS.isAliasFor, g.identifier))
-                            _export(
-                                data=d,
-                                iri=None,
-                                http_client=http_client,
-                                sparql_endpoint=sparql_endpoint,
-                                destination_file=destination_file,
-                                return_data_type=return_data_type,
-                            )
-
-        # export the System Graph
+                        jobs.append((f, role, artifact))
+
+    # all label files are merged into the one background graph, exported after all other Resources
+    background = None
+    for f, resource_iri, data in _parse_resource_files(jobs, parse_workers):
+        if data is None:
+            continue
+
+        # payloads from worker processes are N-Triples (graphs) or N-Quads (datasets)
+        # which can be sent to a SPARQL Endpoint as is but must be parsed for any other destination
+        if isinstance(data, bytes):
+            if resource_iri is None:
+                data = Dataset().parse(data=data, format="nquads")
+            elif sparql_endpoint is None or resource_iri == URIRef(
+                BACKGROUND_GRAPH_IRI
+            ):
+                data = Graph().parse(data=data, format="nt")
+
+        if graph_sources is not None:
+            for iri in (
+                [resource_iri]
+                if resource_iri is not None
+                else [
+                    g.identifier
+                    for g in data.graphs()
+                    if g.identifier != URIRef("urn:x-rdflib:default")
+                ]
+            ):
+                graph_sources.setdefault(iri, []).append(f)
+
+        if resource_iri == URIRef(BACKGROUND_GRAPH_IRI):
+            if background is None:
+                background = data
+            else:
+                background += data
+            continue
+
+        if resource_iri is not None:
+            vg.add((vg_iri, OLIS.isAliasFor, resource_iri))
+            if sparql_endpoint is not None:
+                content_hashes[str(resource_iri)] = get_content_hash(data)
+        else:
+            for g in data.graphs():
+                if g.identifier != URIRef("urn:x-rdflib:default"):
+                    vg.add((vg_iri, OLIS.isAliasFor, g.identifier))
+
+        # export one Resource
         _export(
-            data=vg,
-            iri=OLIS.SystemGraph,
+            data=data,
+            iri=resource_iri,
             http_client=http_client,
             sparql_endpoint=sparql_endpoint,
             destination_file=destination_file,
             return_data_type=return_data_type,
-            append=True,
         )
 
+    if background is not None:
+        vg.add((vg_iri, OLIS.isAliasFor, URIRef(BACKGROUND_GRAPH_IRI)))
+        if sparql_endpoint is not None:
+            content_hashes[BACKGROUND_GRAPH_IRI] = get_content_hash(background)
+
+        _export(
+            data=background,
+            iri=URIRef(BACKGROUND_GRAPH_IRI),
+            http_client=http_client,
+            sparql_endpoint=sparql_endpoint,
+            destination_file=destination_file,
+            return_data_type=return_data_type,
+        )
+
+    # export the System Graph
+    _export(
+        data=vg,
+        iri=OLIS.SystemGraph,
+        http_client=http_client,
+        sparql_endpoint=sparql_endpoint,
+        destination_file=destination_file,
+        return_data_type=return_data_type,
+        append=True,
+    )
+    if sparql_endpoint is not None:
+        set_content_hashes_sparql(content_hashes, sparql_endpoint, http_client)
+
     if return_data_type == ReturnDatatype.dataset:
         return dataset_holder
     elif return_data_type == ReturnDatatype.graph:
         return graph_holder
     else:  # return_data_type is None:
         pass  # return nothing
+
+
+DEFAULT_THROUGHPUT_PROFILE = {
+    # sustained upload speed to the SPARQL Endpoint
+    "upload_bytes_per_second": 5_000_000,
+    # per-process RDF parsing speed
+    "parse_triples_per_second": 50_000,
+    # round trip overhead of each request to the SPARQL Endpoint
+    "request_latency_seconds": 0.1,
+    # assumed size ratio of decompressed to compressed content where it can't be read from the file
+    "compression_ratio": 5.0,
+    # average size of a triple, per format, for estimating triple counts without parsing
+    "bytes_per_triple": {
+        "turtle": 50,
+        "trig": 55,
+        "nt": 110,
+        "nquads": 130,
+        "json-ld": 150,
+    },
+}
+
+
+def plan(
+    manifest: Path | tuple[Path, Path, Graph],
+    profile: dict | None = None,
+    parse: bool = True,
+    parse_workers: int = 1,
+) -> dict:
+    """Plans the load of a Manifest's content into a SPARQL Endpoint without contacting it.
+
+    Args:
+        manifest: the PrezManifest manifest to plan the load of
+        profile: throughput figures to estimate the load time with, overriding those in DEFAULT_THROUGHPUT_PROFILE
+        parse: whether to parse the catalogue and Resource files to determine their graph IRIs and exact triple
+            counts. If False, only file sizes are read: graph IRIs are only known if given in the Manifest and triple
+            counts are estimated from the files' sizes
+        parse_workers: the number of parse processes the load will be run with
+
+    Returns:
+        a dictionary with a "graphs" list of each graph to be written - its IRI, role, source files, bytes, triple
+        count, whether that count is estimated and request count - and a "totals" dictionary also containing the
+        estimated time, in seconds
+    """
+    p = {
+        **DEFAULT_THROUGHPUT_PROFILE,
+        **(profile if profile is not None else {}),
+    }
+    bytes_per_triple = {
+        **DEFAULT_THROUGHPUT_PROFILE["bytes_per_triple"],
+        **p["bytes_per_triple"],
+    }
+
+    manifest_path, manifest_root, manifest_graph = get_manifest_paths_and_graph(
+        manifest
+    )
+
+    graphs = {}
+
+    def _add(iri, role, f, size, triples, estimated, requests):
+        g = graphs.setdefault(
+            str(iri),
+            {
+                "graph": str(iri),
+                "role": str(role).split("/")[-1],
+                "files": [],
+                "bytes": 0,
+                "triples": 0,
+                "triples_estimated": False,
+                "requests": 0,
+            },
+        )
+        if f is not None:
+            g["files"].append(str(f))
+        g["bytes"] += size
+        g["triples"] += triples
+        g["triples_estimated"] = g["triples_estimated"] or estimated
+        # all label files are merged into one background graph upload
+        if str(iri) == BACKGROUND_GRAPH_IRI:
+            g["requests"] = requests
+        else:
+            g["requests"] += requests
+
+    # finding the catalogue's IRI means parsing it
+    catalogue_iri = None
+    if parse:
+        catalogue_iri = URIRef(
+            str(
+                get_catalogue_iri_from_manifest(
+                    (manifest_path, manifest_root, manifest_graph)
+                )
+            )
+            + "-catalogue"
+        )
+
+    def _estimated_triples(f: Path, size: int) -> int:
+        return size // bytes_per_triple[get_rdf_format(f) or "turtle"]
+
+    jobs = []
+    for o in manifest_graph.objects(None, PROF.hasResource):
+        for role in manifest_graph.objects(o, PROF.hasRole):
+            if role == MRR.CatalogueData:
+                for artifact in manifest_graph.objects(o, PROF.hasArtifact):
+                    f = manifest_root / artifact
+                    size = f.stat().st_size
+                    if parse:
+                        _add(catalogue_iri, role, f, size, len(load_graph(f)), False, 1)
+                    else:
+                        _add(
+                            f"? ({f.name})",
+                            role,
+                            f,
+                            size,
+                            _estimated_triples(f, size),
+                            True,
+                            1,
+                        )
+            elif role in [
+                MRR.CompleteCatalogueAndResourceLabels,
+                MRR.IncompleteCatalogueAndResourceLabels,
+                MRR.ResourceData,
+            ]:
+                for artifact in manifest_graph.objects(o, PROF.hasArtifact):
+                    for f in get_files_from_artifact(
+                        (manifest_path, manifest_root, manifest_graph), artifact
+                    ):
+                        if get_rdf_format(f) is not None:
+                            jobs.append((f, role, artifact))
+
+    if parse:
+        roles = {f: role for f, role, artifact in jobs}
+        for f, resource_iri, data in _parse_resource_files(jobs, parse_workers):
+            role = roles[f]
+            size = get_uncompressed_size(f, p["compression_ratio"])
+            if isinstance(data, bytes):
+                if resource_iri is None:
+                    data = Dataset().parse(data=data, format="nquads")
+                else:
+                    data = Graph().parse(data=data, format="nt")
+
+            if resource_iri is not None:
+                _add(resource_iri, role, f, size, len(data), False, 1)
+            else:
+                named_graphs = [
+                    g
+                    for g in data.graphs()
+                    if g.identifier != URIRef("urn:x-rdflib:default")
+                ]
+                for g in named_graphs:
+                    _add(
+                        g.identifier,
+                        role,
+                        f,
+                        size // max(len(named_graphs), 1),
+                        len(g),
+                        False,
+                        1,
+                    )
+    else:
+        for f, role, artifact in jobs:
+            size = get_uncompressed_size(f, p["compression_ratio"])
+
+            if role == MRR.ResourceData:
+                iri = manifest_graph.value(subject=artifact, predicate=SDO.mainEntity)
+                if iri is None:
+                    iri = f"? ({f.name})"
+            else:
+                iri = URIRef(BACKGROUND_GRAPH_IRI)
+
+            _add(iri, role, f, size, _estimated_triples(f, size), True, 1)
+
+    # the System Graph upload and the recording of the graphs' content hashes in it
+    _add(OLIS.SystemGraph, "SystemGraph", None, 0, 0, False, 2)
+
+    totals = {
+        "graphs": len(graphs),
+        "bytes": sum(g["bytes"] for g in graphs.values()),
+        "triples": sum(g["triples"] for g in graphs.values()),
+        "requests": sum(g["requests"] for g in graphs.values()),
+    }
+    totals["seconds"] = round(
+        totals["requests"] * p["request_latency_seconds"]
+        + totals["bytes"] / p["upload_bytes_per_second"]
+        + totals["triples"] / (p["parse_triples_per_second"] * max(parse_workers, 1)),
+        1,
+    )
+
+    return {"graphs": list(graphs.values()), "totals": totals}
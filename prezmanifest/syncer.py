@@ -1,23 +1,51 @@
+import datetime
+import json
+import time
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from mailbox import MMDF
 from pathlib import Path
 
 import httpx
-from kurra.db.gsp import clear, upload, delete
 from kurra.sparql import query
 from kurra.utils import load_graph
-from rdflib import Graph, URIRef, BNode, Literal
-from rdflib.namespace import DCAT, PROF, RDF, SDO
+from rdflib import BNode, Graph, Literal, Node, URIRef
+from rdflib.namespace import DCAT, DCTERMS, PROF, RDF, SDO
+from rdflib.util import from_n3
 
 import prezmanifest.utils
-from prezmanifest.definednamespaces import MRR
+from prezmanifest.definednamespaces import MRR, OLIS
+from prezmanifest.loader import DEFAULT_THROUGHPUT_PROFILE
 from prezmanifest.utils import (
+    BACKGROUND_GRAPH_IRI,
+    QUADS_FORMATS,
     VersionIndicatorComparison,
     absolutise_path,
+    add_artifacts_to_manifest_graph,
+    compare_version_indicators,
+    count_statements,
+    count_triples_sparql,
     denormalise_artifacts,
+    download_remote_artifacts,
+    get_content_hash,
+    get_content_hash_local,
     get_manifest_paths_and_graph,
-    store_remote_artifact_locally,
+    get_rdf_format,
+    get_remote_graph,
+    get_sync_marker_sparql,
+    get_uncompressed_size,
+    get_version_indicators_local,
+    get_version_indicators_sparql_batch,
+    load_rdf_file_as_graph,
+    merge_graphs,
+    open_rdf_file,
+    replace_graphs_sparql,
+    set_content_hashes_sparql,
+    update_graph_by_diff_sparql,
     update_local_artifact,
-    which_is_more_recent,
+    upload_rdf_data,
+    upload_rdf_file,
 )
 
 
@@ -29,6 +57,13 @@ def sync(
     update_local: bool = True,
     add_remote: bool = True,
     add_local: bool = True,
+    concurrency: int = 1,
+    transaction_size: int = 1,
+    diff_update: bool = False,
+    diff_threshold: float = 0.2,
+    download_batch_size: int = 100,
+    state_file: Path | None = None,
+    indicators_cache: dict | None = None,
 ) -> dict:
     """Syncronises a set of resources in files or storage locations - from - described by a Manifest with a SPARQL Endpoint
     - to.
@@ -41,11 +76,573 @@ def sync(
         update_local: whether to update the from artifacts with newer to ones
         add_remote: whether to add artifacts to the to location with newer from ones
         add_local: whether to add artifacts to the from location with newer to ones
+        concurrency: the number of uploads & downloads to run at once. Manifest & catalogue changes are always written
+            once, after all of them are complete
+        transaction_size: the number of remote graphs to replace per SPARQL Update transaction. If 1, each graph is
+            replaced by a Graph Store Protocol PUT
+        diff_update: whether to update remote graphs by sending only the triples that differ from the local artifact,
+            rather than replacing them
+        diff_threshold: the fraction of an artifact's triples that may differ for diff_update to be used. Graphs with
+            larger differences, or containing Blank Nodes, are replaced
+        download_batch_size: the number of remote graphs to add locally per action
+        state_file: a JSON file in which to keep the remote state found, and left, by this sync. If no graphs have been
+            loaded or synced to the SPARQL Endpoint since, the next sync reads the remote state from it rather than
+            querying for it. A snapshot of each artifact as last synced is also kept, in a directory next to it, so that
+            artifacts changed both locally and remotely since can be merged, if their changes don't overlap, or else
+            reported as conflicts
+        indicators_cache: a dict, kept between syncs of the same Manifest, in which to cache the Version Indicators
+            read from local artifact files, so that only changed files are read again
 
     Returns:
-        a dictionary of the state of syncronisation, per artifact
+        a dictionary of the state of syncronisation, per artifact, including the "duration", in seconds, of any
+        action taken. Artifacts whose upload the SPARQL Endpoint rejected have the direction "failed" and its "error",
+        as does the background graph, keyed by its IRI, if its upload was rejected
     """
 
+    discovered = _discover(
+        manifest, sparql_endpoint, http_client, state_file, indicators_cache
+    )
+    sync_status = discovered["sync_status"]
+    manifest_path = discovered["manifest_path"]
+    manifest_root = discovered["manifest_root"]
+    manifest_graph = discovered["manifest_graph"]
+    artifacts = discovered["artifacts"]
+    remote_indicators = discovered["remote_indicators"]
+    remote_parts = discovered["remote_parts"]
+    base_hashes = discovered["base_hashes"]
+    cat_iri = discovered["cat_iri"]
+    cat_artifact_path = discovered["cat_artifact_path"]
+    marker = discovered["marker"]
+
+    # plan the actions to take, as plan_sync() lists them, then run those on artifacts, concurrently if asked to
+    planned = _plan(discovered, update_remote, update_local, add_remote, add_local)
+    local_indicators = {str(k): v for k, v in artifacts.items()}
+    actions = {}
+    for a in planned:
+        if a["kind"] != "artifact":
+            continue
+        k = a["artifact"]
+        v = sync_status[k]
+
+        if v["direction"] == "upload" and diff_update:
+            actions[k] = partial(
+                update_graph_by_diff_sparql,
+                sparql_endpoint,
+                Path(k),
+                v["main_entity"],
+                http_client,
+                diff_threshold,
+            )
+
+        # a PUT replaces any existing graph in one request
+        elif v["direction"] in ["upload", "add-remotely"]:
+            actions[k] = partial(
+                upload_rdf_file,
+                sparql_endpoint,
+                Path(k),
+                v["main_entity"],
+                http_client=http_client,
+            )
+
+        # run in batches, below
+        elif v["direction"] == "add-locally":
+            actions[k] = None
+
+        elif v["direction"] == "merge":
+            actions[k] = partial(
+                _merge_artifact,
+                Path(k),
+                _snapshot_path(state_file, base_hashes[k]),
+                sparql_endpoint,
+                v["main_entity"],
+                http_client,
+            )
+
+        elif v["direction"] == "download":
+            actions[k] = partial(
+                update_local_artifact,
+                (manifest_path, manifest_root, manifest_graph),
+                Path(k),
+                sparql_endpoint,
+                v["main_entity"],
+                http_client,
+            )
+
+    # group remote graph replacements into transactions, if asked to
+    to_run = actions
+    if transaction_size > 1:
+        replacements = [
+            k
+            for k in actions
+            if sync_status[k]["direction"] == "add-remotely"
+            or (sync_status[k]["direction"] == "upload" and not diff_update)
+        ]
+        to_run = {k: a for k, a in actions.items() if k not in replacements}
+        for i in range(0, len(replacements), transaction_size):
+            batch = tuple(replacements[i : i + transaction_size])
+            to_run[batch] = partial(
+                replace_graphs_sparql,
+                {str(sync_status[k]["main_entity"]): Path(k) for k in batch},
+                sparql_endpoint,
+                http_client,
+            )
+
+    # fetch remote graphs to add locally many per action
+    additions = [k for k in actions if sync_status[k]["direction"] == "add-locally"]
+    to_run = {k: a for k, a in to_run.items() if k not in additions}
+    for i in range(0, len(additions), download_batch_size):
+        batch = tuple(additions[i : i + download_batch_size])
+        to_run[batch] = partial(
+            download_remote_artifacts,
+            manifest_root,
+            sparql_endpoint,
+            [str(sync_status[k]["main_entity"]) for k in batch],
+            http_client,
+        )
+
+    results = _run_actions(to_run, sync_status, concurrency)
+
+    # actions that raised an error, and uploads the SPARQL Endpoint rejected, have failed, so their content hashes
+    # aren't recorded and the next sync retries them
+    failed = {}
+    for key, result in results.items():
+        batch = key if isinstance(key, tuple) else (key,)
+        if isinstance(result, Exception):
+            failed.update(dict.fromkeys(batch, str(result)))
+        elif sync_status[batch[0]]["direction"] in ["upload", "add-remotely"]:
+            status, message = result
+            if status is not True:
+                failed.update(dict.fromkeys(batch, f"{status}: {message}"))
+
+    for batch, artifact_paths in list(results.items()):
+        if (
+            isinstance(batch, tuple)
+            and batch[0] in additions
+            and batch[0] not in failed
+        ):
+            for k in batch:
+                results[k] = artifact_paths[str(sync_status[k]["main_entity"])]
+
+    # merges not made are conflicts
+    for k in actions:
+        if sync_status[k]["direction"] == "merge" and k not in failed:
+            if isinstance(results[k], list):
+                sync_status[k]["direction"] = "conflict"
+                sync_status[k]["conflicts"] = [[str(s), str(p)] for s, p in results[k]]
+            elif results[k][0] is not True:
+                failed[k] = f"{results[k][0]}: {results[k][1]}"
+    for k, error in failed.items():
+        sync_status[k]["direction"] = "failed"
+        sync_status[k]["error"] = error
+    actions = {
+        k: a
+        for k, a in actions.items()
+        if sync_status[k]["direction"] not in ["conflict", "failed"]
+    }
+    # the catalogue is only updated if any of the artifacts added remotely were
+    update_remote_catalogue = any(a["kind"] == "catalogue" for a in planned) and any(
+        sync_status[k]["direction"] == "add-remotely" for k in actions
+    )
+
+    # record the content hash of each graph now the same locally & remotely
+    content_hashes = {}
+    for k in actions:
+        if sync_status[k]["direction"] in ["upload", "add-remotely"]:
+            content_hash = get_content_hash_local(
+                Path(k), local_indicators[k], discovered["indicators_cache"]
+            )
+        elif sync_status[k]["direction"] == "add-locally":
+            content_hash = get_content_hash(
+                load_rdf_file_as_graph(manifest_root / results[k])
+            )
+        else:  # download or merge
+            content_hash = get_content_hash(load_rdf_file_as_graph(Path(k)))
+        if content_hash is not None:
+            content_hashes[str(sync_status[k]["main_entity"])] = content_hash
+
+    # the background graph, of all label artifacts merged
+    background_error = None
+    for a in planned:
+        if a["kind"] == "background":
+            status, message = upload_rdf_data(
+                sparql_endpoint,
+                a["graph"].serialize(format="nt", encoding="utf-8"),
+                BACKGROUND_GRAPH_IRI,
+                http_client=http_client,
+            )
+            if status is True:
+                content_hashes[BACKGROUND_GRAPH_IRI] = a["content_hash"]
+            else:
+                background_error = f"{status}: {message}"
+
+    # serialise all Manifest & catalogue changes into one write each
+    added_locally = [
+        (results[k], sync_status[k]["main_entity"])
+        for k in actions
+        if sync_status[k]["direction"] == "add-locally"
+    ]
+    if len(added_locally) > 0:
+        updated_local_manifest = add_artifacts_to_manifest_graph(
+            manifest_graph, added_locally
+        )
+        updated_local_manifest.bind("mrr", "https://prez.dev/ManifestResourceRoles")
+        updated_local_manifest.serialize(destination=manifest_path, format="longturtle")
+
+        cat = load_graph(cat_artifact_path)
+        for _, main_entity in added_locally:
+            cat.add((cat_iri, SDO.hasPart, URIRef(main_entity)))
+        cat.serialize(destination=cat_artifact_path, format="longturtle")
+
+    if update_remote_catalogue:
+        status, message = upload_rdf_file(
+            sparql_endpoint,
+            cat_artifact_path,
+            cat_iri,
+            http_client=http_client,
+        )
+        if status is True:
+            content_hashes[str(cat_iri)] = get_content_hash(
+                load_rdf_file_as_graph(cat_artifact_path)
+            )
+        else:
+            content_hashes.pop(str(cat_iri), None)
+            update_remote_catalogue = False
+            for v in sync_status.values():
+                if v["main_entity"] == cat_iri:
+                    v["direction"] = "failed"
+                    v["error"] = f"{status}: {message}"
+
+    set_content_hashes_sparql(content_hashes, sparql_endpoint, http_client)
+
+    if state_file is not None:
+        # bring the remote state up to date with what this sync wrote
+        for k in actions:
+            me = str(sync_status[k]["main_entity"])
+            if sync_status[k]["direction"] in ["upload", "add-remotely"]:
+                remote_indicators[me] = {
+                    **remote_indicators[me],
+                    **{i: local_indicators[k].get(i) for i in _VERSION_INDICATORS},
+                    "known": True,
+                }
+            elif sync_status[k]["direction"] in ["add-locally", "merge"]:
+                indicators = {"main_entity": URIRef(me)}
+                get_version_indicators_local(
+                    (manifest_path, manifest_root, manifest_graph),
+                    (
+                        manifest_root / results[k]
+                        if sync_status[k]["direction"] == "add-locally"
+                        else Path(k)
+                    ),
+                    indicators,
+                )
+                remote_indicators[me] = {
+                    "catalogue_known": False,
+                    **remote_indicators.get(me, {}),
+                    **{i: indicators.get(i) for i in _VERSION_INDICATORS},
+                    "main_entity": URIRef(me),
+                    "known": True,
+                }
+        for g, content_hash in content_hashes.items():
+            remote_indicators[g]["content_hash"] = content_hash
+        if update_remote_catalogue:
+            cat = load_graph(cat_artifact_path)
+            remote_parts = [
+                str(o)
+                for p in [SDO.hasPart, DCTERMS.hasPart]
+                for o in cat.objects(cat_iri, p)
+            ]
+        if len(content_hashes) > 0:
+            marker = get_sync_marker_sparql(sparql_endpoint, http_client)
+
+        # snapshot each artifact now the same locally & remotely, as the base for later three-way comparisons
+        artifact_states = {}
+        for k, v in sync_status.items():
+            me = str(v["main_entity"])
+            if v["direction"] == "add-locally":
+                if k not in actions:
+                    continue
+                path = manifest_root / results[k]
+            else:
+                path = Path(k)
+            local_hash = content_hashes.get(
+                me, local_indicators.get(k, {}).get("content_hash")
+            )
+            base_hash = base_hashes.get(str(path))
+            if local_hash is not None and local_hash == remote_indicators.get(
+                me, {}
+            ).get("content_hash"):
+                base_hash = local_hash
+                snapshot = _snapshot_path(state_file, base_hash)
+                if not snapshot.is_file():
+                    snapshot.parent.mkdir(exist_ok=True)
+                    with open_rdf_file(snapshot, "wb") as f:
+                        f.write(
+                            load_rdf_file_as_graph(path).serialize(
+                                format="nt", encoding="utf-8"
+                            )
+                        )
+            artifact_states[str(path)] = {
+                "main_entity": me,
+                "base_hash": base_hash,
+            }
+        snapshot_dir = _snapshot_path(state_file, "").parent
+        if snapshot_dir.is_dir():
+            bases = {v["base_hash"] for v in artifact_states.values()}
+            for snapshot in snapshot_dir.glob("*.nt.gz"):
+                if snapshot.name.removesuffix(".nt.gz") not in bases:
+                    snapshot.unlink()
+
+        _write_sync_state(
+            state_file,
+            {
+                "sparql_endpoint": sparql_endpoint,
+                "marker": marker,
+                "synced": datetime.datetime.now(datetime.UTC).isoformat(),
+                "artifacts": artifact_states,
+                "local": discovered["indicators_cache"],
+                "remote": remote_indicators,
+                "remote_parts": remote_parts,
+            },
+        )
+
+    # the background graph has no artifact of its own to report its failure against
+    if background_error is not None:
+        sync_status[BACKGROUND_GRAPH_IRI] = {
+            "main_entity": URIRef(BACKGROUND_GRAPH_IRI),
+            "direction": "failed",
+            "sync": True,
+            "error": background_error,
+        }
+
+    return sync_status
+
+
+def plan_sync(
+    manifest: Path | tuple[Path, Path, Graph],
+    sparql_endpoint: str | None = None,
+    http_client: httpx.Client = httpx.Client(),
+    update_remote: bool = True,
+    update_local: bool = True,
+    add_remote: bool = True,
+    add_local: bool = True,
+    transaction_size: int = 1,
+    diff_update: bool = False,
+    download_batch_size: int = 100,
+    state_file: Path | None = None,
+    profile: dict | None = None,
+) -> dict:
+    """Plans a sync of a Manifest with a SPARQL Endpoint by working out what sync(), given the same arguments, would
+    do, without writing anything locally or remotely.
+
+    Args:
+        manifest: the PrezManifest manifest describing the 'from' resources
+        sparql_endpoint: a SPARQL endpoint URL to sync resources to
+        http_client: an httpx client to use for making requests
+        update_remote, update_local, add_remote, add_local, transaction_size, diff_update, download_batch_size &
+            state_file: as per sync()
+        profile: throughput figures to estimate the sync time with, overriding those in the loader's
+            DEFAULT_THROUGHPUT_PROFILE
+
+    Returns:
+        a dictionary with an "actions" list of each graph that would be transferred, as sync() plans them - its kind,
+        artifact, Main Entity, direction, bytes, triple count, whether that count is estimated and request count - and
+        a "totals" dictionary also containing the estimated time, in seconds
+    """
+    p = {
+        **DEFAULT_THROUGHPUT_PROFILE,
+        **(profile if profile is not None else {}),
+    }
+    bytes_per_triple = {
+        **DEFAULT_THROUGHPUT_PROFILE["bytes_per_triple"],
+        **p["bytes_per_triple"],
+    }
+
+    def _local_size(f: Path) -> tuple[int, int, bool]:
+        rdf_format = get_rdf_format(f)
+        size = get_uncompressed_size(f, p["compression_ratio"])
+        if rdf_format in ["nt", "nquads"]:
+            return size, count_statements(f), False
+        return size, size // bytes_per_triple[rdf_format], True
+
+    discovered = _discover(manifest, sparql_endpoint, http_client, state_file)
+    planned = _plan(discovered, update_remote, update_local, add_remote, add_local)
+
+    # remote graphs are only counted, in one query, not fetched
+    remote_triples = count_triples_sparql(
+        [
+            a["main_entity"]
+            for a in planned
+            if a["kind"] == "artifact"
+            and a["direction"] in ["download", "add-locally", "merge"]
+        ],
+        sparql_endpoint,
+        http_client,
+    )
+
+    actions = []
+    replacements = 0
+    for a in planned:
+        action = {
+            "kind": a["kind"],
+            "artifact": a["artifact"],
+            "main_entity": a["main_entity"],
+            "direction": a["direction"],
+            "bytes": 0,
+            "triples": 0,
+            "triples_estimated": False,
+            "requests": 1,
+        }
+        if a["kind"] == "background":
+            action["bytes"] = sum(
+                Path(f).stat().st_size for f in discovered["label_files"]
+            )
+            action["triples"] = len(a["graph"])
+        elif a["kind"] == "catalogue":
+            size, triples, estimated = _local_size(Path(a["artifact"]))
+            action["bytes"] = size
+            action["triples"] = triples
+            action["triples_estimated"] = estimated
+        # the content hashes recorded in the System Graph, then re-reading its modified date for the state file
+        elif a["kind"] == "system":
+            action["requests"] = 1 if state_file is None else 2
+        else:
+            me = a["main_entity"]
+            if a["direction"] in ["download", "add-locally", "merge"]:
+                action["triples"] = remote_triples[me]
+                action["bytes"] = remote_triples[me] * bytes_per_triple["nt"]
+            if a["direction"] in ["upload", "add-remotely", "merge"]:
+                size, triples, estimated = _local_size(Path(a["artifact"]))
+                action["bytes"] += size
+                action["triples"] += triples
+                action["triples_estimated"] = estimated
+
+            # GET then Update, or PUT
+            if a["direction"] == "merge" or (
+                a["direction"] == "upload" and diff_update
+            ):
+                action["requests"] = 2
+            # grouped into transactions
+            elif a["direction"] in ["upload", "add-remotely"] and transaction_size > 1:
+                action["requests"] = 1 if replacements % transaction_size == 0 else 0
+                replacements += 1
+        actions.append(action)
+
+    totals = {
+        "actions": len(actions),
+        "bytes": sum(a["bytes"] for a in actions),
+        "triples": sum(a["triples"] for a in actions),
+        "requests": sum(a["requests"] for a in actions),
+    }
+    totals["seconds"] = round(
+        totals["requests"] * p["request_latency_seconds"]
+        + totals["bytes"] / p["upload_bytes_per_second"]
+        + totals["triples"] / p["parse_triples_per_second"],
+        1,
+    )
+
+    return {"actions": actions, "totals": totals}
+
+
+def _is_acted_on(
+    status: dict,
+    update_remote: bool,
+    update_local: bool,
+    add_remote: bool,
+    add_local: bool,
+) -> bool:
+    """Whether a sync, with the given permissions, acts on an artifact with the given sync status"""
+    if not status["sync"]:
+        return False
+    return {
+        "upload": update_remote,
+        "add-remotely": add_remote,
+        "download": update_local,
+        "add-locally": add_local,
+        "merge": update_local and update_remote,
+    }.get(status["direction"], False)
+
+
+def _plan(
+    discovered: dict,
+    update_remote: bool,
+    update_local: bool,
+    add_remote: bool,
+    add_local: bool,
+) -> list[dict]:
+    """Works out the actions a sync, with the given permissions, takes on what _discover() found: one for each artifact
+    acted on, then the upload of the background graph, if its content has changed, the catalogue, if artifacts are
+    added remotely, and the content hashes recorded in the System Graph, if anything is synced.
+
+    Each action is a dict of its "kind" - artifact, background, catalogue or system - its "artifact" path, or None,
+    "main_entity" and "direction". The background graph's also has the merged "graph" of all label artifacts and its
+    "content_hash"."""
+    actions = [
+        {
+            "kind": "artifact",
+            "artifact": k,
+            "main_entity": str(v["main_entity"]),
+            "direction": v["direction"],
+        }
+        for k, v in discovered["sync_status"].items()
+        if _is_acted_on(v, update_remote, update_local, add_remote, add_local)
+    ]
+
+    # all label artifacts are merged into the one background graph, only uploaded if its content has changed
+    label_files = discovered["label_files"]
+    if len(label_files) > 0 and (update_remote or add_remote):
+        background = Graph()
+        for f in label_files:
+            background += load_rdf_file_as_graph(Path(f))
+        content_hash = get_content_hash(background)
+        if (
+            content_hash
+            != discovered["remote_indicators"][BACKGROUND_GRAPH_IRI]["content_hash"]
+        ):
+            actions.append(
+                {
+                    "kind": "background",
+                    "artifact": None,
+                    "main_entity": BACKGROUND_GRAPH_IRI,
+                    "direction": "upload",
+                    "graph": background,
+                    "content_hash": content_hash,
+                }
+            )
+
+    if any(a["direction"] == "add-remotely" for a in actions):
+        actions.append(
+            {
+                "kind": "catalogue",
+                "artifact": str(discovered["cat_artifact_path"]),
+                "main_entity": str(discovered["cat_iri"]),
+                "direction": "upload",
+            }
+        )
+
+    if len(actions) > 0:
+        actions.append(
+            {
+                "kind": "system",
+                "artifact": None,
+                "main_entity": str(OLIS.SystemGraph),
+                "direction": "upload",
+            }
+        )
+
+    return actions
+
+
+def _discover(
+    manifest: Path | tuple[Path, Path, Graph],
+    sparql_endpoint: str,
+    http_client: httpx.Client,
+    state_file: Path | None = None,
+    indicators_cache: dict | None = None,
+) -> dict:
+    """Works out the sync direction of each artifact of a Manifest, and any remote-only ones, without writing anything.
+
+    Returns the sync status of each artifact, as "sync_status", along with the local & remote state it was worked out
+    from, for sync() to act on"""
     # list all from resources
     # find all matching to resources
     sync_status = {}
@@ -54,9 +651,58 @@ def sync(
         manifest
     )
 
+    # the state recorded by a previous sync: the remote state is still current if no graphs have been loaded or synced
+    # since, and the Version Indicators read from local artifact files are for those unchanged since
+    marker = None
+    state = None
+    if state_file is not None:
+        marker = get_sync_marker_sparql(sparql_endpoint, http_client)
+        state = _read_sync_state(state_file, sparql_endpoint, marker)
+        if indicators_cache is None:
+            indicators_cache = {}
+        if state is not None:
+            for key, indicators in state["local"].items():
+                indicators_cache.setdefault(key, indicators)
+
     # For each Artifact in the Manifest
-    artifacts = denormalise_artifacts((manifest_path, manifest_root, manifest_graph))
+    artifacts = denormalise_artifacts(
+        (manifest_path, manifest_root, manifest_graph), indicators_cache
+    )
     local_entities = [v["main_entity"] for k, v in artifacts.items()]
+    label_files = [
+        k
+        for k, v in artifacts.items()
+        if v["role"]
+        in [
+            MRR.IncompleteCatalogueAndResourceLabels,
+            MRR.CompleteCatalogueAndResourceLabels,
+        ]
+    ]
+
+    remote_entities = [
+        str(v["main_entity"])
+        for v in artifacts.values()
+        if v["role"] in [MRR.ResourceData, MRR.CatalogueData]
+    ] + ([BACKGROUND_GRAPH_IRI] if len(label_files) > 0 else [])
+
+    if (
+        state is not None
+        and state["remote"] is not None
+        and all(me in state["remote"] for me in remote_entities)
+    ):
+        remote_indicators = {me: state["remote"][me] for me in remote_entities}
+        remote_parts = state["remote_parts"]
+    else:
+        # get the remote state of all Main Entities, and the background graph, in one batch
+        remote_indicators = get_version_indicators_sparql_batch(
+            remote_entities, sparql_endpoint, http_client
+        )
+        remote_parts = None
+
+    # the content hash of each artifact when it was last the same locally & remotely, for three-way comparison
+    base_hashes = {}
+    if state is not None:
+        base_hashes = {k: v.get("base_hash") for k, v in state["artifacts"].items()}
 
     cat_iri = None
     cat_artifact_path = None
@@ -68,32 +714,32 @@ def sync(
                 cat_artifact_path = absolutise_path(k, manifest_root)
 
             # See if each is known remotely (via Main Entity Graph IRI)
-            known = query(
-                sparql_endpoint,
-                "ASK {GRAPH <xxx> {?s ?p ?o}}".replace("xxx", str(v["main_entity"])),
-                http_client=http_client,
-                return_format="python",
-                return_bindings_only=True,
-            )
+            remote = remote_indicators[str(v["main_entity"])]
+            known = remote["known"]
             # If not known by graph IRI, just check if it's the catalogue (+ "-catalogue" to IRI)
             if not known and v["role"] == MRR.CatalogueData:
-                known = query(
-                    sparql_endpoint,
-                    "ASK {GRAPH <xxx> {?s ?p ?o}}".replace(
-                        "xxx", str(v["main_entity"] + "-catalogue")
-                    ),
-                    http_client=http_client,
-                    return_format="python",
-                    return_bindings_only=True,
-                )
+                known = remote["catalogue_known"]
 
-            # If known, compare it
-            if known:
-                replace = which_is_more_recent(
-                    v,
-                    sparql_endpoint,
-                    http_client,
+            # If known, compare it, with its content as last synced if we know that, else by Version Indicators. Its
+            # content hash is only worked out if there's a remote one to compare it with
+            if known and remote.get("content_hash") is not None:
+                get_content_hash_local(k, v, indicators_cache)
+            base_hash = base_hashes.get(str(k))
+            if known and None not in [
+                base_hash,
+                v.get("content_hash"),
+                remote.get("content_hash"),
+            ]:
+                direction = _compare_three_way(
+                    v["content_hash"], base_hash, remote["content_hash"]
                 )
+                if (
+                    direction == "merge"
+                    and not _snapshot_path(state_file, base_hash).is_file()
+                ):
+                    direction = "conflict"
+            elif known:
+                replace = compare_version_indicators(v, remote)
                 if replace == VersionIndicatorComparison.First:
                     direction = "upload"
                 elif replace == VersionIndicatorComparison.Second:
@@ -110,37 +756,33 @@ def sync(
                 "direction": direction,
                 "sync": v["sync"],
             }
-        if v["role"] in [MRR.IncompleteCatalogueAndResourceLabels, MRR.CompleteCatalogueAndResourceLabels]:
-            clear(sparql_endpoint, "http://background", http_client)
-            upload(
-                sparql_endpoint,
-                Path(k),
-                "http://background",
-                False,
-                http_client=http_client,
-            )
 
     # Check for things at remote not known in local
-    q = """
-        PREFIX dcterms: <http://purl.org/dc/terms/>
-        PREFIX schema: <https://schema.org/>
-    
-        SELECT ?p
-        WHERE {
-            GRAPH ?g {
-                <xxx> schema:hasPart|dcterms:hasPart ?p
+    if remote_parts is None:
+        q = """
+            PREFIX dcterms: <http://purl.org/dc/terms/>
+            PREFIX schema: <https://schema.org/>
+
+            SELECT ?p
+            WHERE {
+                GRAPH ?g {
+                    <xxx> schema:hasPart|dcterms:hasPart ?p
+                }
             }
-        }
-        """.replace("xxx", str(cat_iri))
+            """.replace("xxx", str(cat_iri))
+        remote_parts = [
+            str(x["p"])
+            for x in query(
+                sparql_endpoint,
+                q,
+                http_client=http_client,
+                return_format="python",
+                return_bindings_only=True,
+            )
+        ]
 
-    for x in query(
-        sparql_endpoint,
-        q,
-        http_client=http_client,
-        return_format="python",
-        return_bindings_only=True,
-    ):
-        remote_entity = x["p"]
+    for p in remote_parts:
+        remote_entity = URIRef(p)
         if remote_entity not in local_entities:
             sync_status[str(remote_entity)] = {
                 "main_entity": URIRef(remote_entity),
@@ -148,68 +790,200 @@ def sync(
                 "sync": True,
             }
 
-    update_remote_catalogue = False
-    for k, v in sync_status.items():
-        if v["sync"]:
-            if update_remote and v["direction"] == "upload":
-                clear(sparql_endpoint, v["main_entity"], http_client)
-                upload(
-                    sparql_endpoint,
-                    Path(k),
-                    v["main_entity"],
-                    False,
-                    http_client=http_client,
-                )
+    return {
+        "sync_status": sync_status,
+        "manifest_path": manifest_path,
+        "manifest_root": manifest_root,
+        "manifest_graph": manifest_graph,
+        "artifacts": artifacts,
+        "label_files": label_files,
+        "remote_indicators": remote_indicators,
+        "remote_parts": remote_parts,
+        "base_hashes": base_hashes,
+        "cat_iri": cat_iri,
+        "cat_artifact_path": cat_artifact_path,
+        "marker": marker,
+        "indicators_cache": indicators_cache,
+    }
 
-            if add_remote and v["direction"] == "add-remotely":
-                # no need to clear() as this asset doesn't exist remotely
-                upload(
-                    sparql_endpoint,
-                    Path(k),
-                    v["main_entity"],
-                    False,
-                    http_client=http_client,
-                )
-                update_remote_catalogue = True
 
-            if add_local and v["direction"] == "add-locally":
-                updated_local_manifest = store_remote_artifact_locally(
-                    (manifest_path, manifest_root, manifest_graph),
-                    sparql_endpoint,
-                    v["main_entity"],
-                    http_client,
-                )
+def _compare_three_way(local_hash: str, base_hash: str, remote_hash: str) -> str:
+    """Works out the sync direction for an artifact from its local & remote content hashes and that of its content when
+    last synced, the base"""
+    if local_hash == remote_hash:
+        return "same"
+    elif remote_hash == base_hash:
+        return "upload"
+    elif local_hash == base_hash:
+        return "download"
+    else:  # changed on both sides
+        return "merge"
 
-                updated_local_manifest.bind(
-                    "mrr", "https://prez.dev/ManifestResourceRoles"
-                )
-                updated_local_manifest.serialize(
-                    destination=manifest_path, format="longturtle"
-                )
-                cat = load_graph(cat_artifact_path)
-                cat.add((cat_iri, SDO.hasPart, URIRef(v["main_entity"])))
-                cat.serialize(destination=cat_artifact_path, format="longturtle")
 
-            if update_local and v["direction"] == "download":
-                update_local_artifact(
-                    (manifest_path, manifest_root, manifest_graph),
-                    Path(k),
-                    sparql_endpoint,
-                    v["main_entity"],
-                    http_client,
-                )
+def _snapshot_path(state_file: Path, content_hash: str) -> Path:
+    return Path(state_file).with_suffix(".snapshots") / f"{content_hash}.nt.gz"
 
-    if update_remote_catalogue:
-        delete(sparql_endpoint, cat_iri, http_client=http_client)
-        upload(
-            sparql_endpoint,
-            cat_artifact_path,
-            cat_iri,
-            False,
-            http_client=http_client,
+
+def _merge_artifact(
+    artifact_path: Path,
+    snapshot_path: Path,
+    sparql_endpoint: str,
+    graph_iri: str,
+    http_client: httpx.Client,
+) -> list | tuple[bool | int, str | None]:
+    """Merges the local & remote changes made to an artifact since its snapshot, writing the merged content to both.
+
+    Returns the result of uploading the merged content, as per upload_rdf_file(), if merged, else the list of
+    (subject, predicate) pairs whose values were changed on both sides"""
+    rdf_format = get_rdf_format(artifact_path)
+    if rdf_format in QUADS_FORMATS:
+        return []
+
+    merged, conflicts = merge_graphs(
+        load_rdf_file_as_graph(snapshot_path),
+        load_rdf_file_as_graph(artifact_path),
+        get_remote_graph(sparql_endpoint, graph_iri, http_client),
+    )
+    if merged is None:
+        return conflicts
+
+    with open_rdf_file(artifact_path, "wb") as f:
+        f.write(
+            merged.serialize(
+                format="longturtle" if rdf_format == "turtle" else rdf_format,
+                encoding="utf-8",
+            )
         )
+    return upload_rdf_file(
+        sparql_endpoint, artifact_path, graph_iri, http_client=http_client
+    )
 
-    return sync_status
+
+_VERSION_INDICATORS = [
+    "modified_date",
+    "version_info",
+    "version_iri",
+    "file_size",
+    "content_hash",
+]
+
+
+def _local_indicator_from_n3(v: str):
+    """Reads a local Version Indicator stored as N3, keeping IRIs as URIRefs, as denormalise_artifacts() gives them"""
+    term = from_n3(v)
+    return term.toPython() if isinstance(term, Literal) else term
+
+
+def _read_sync_state(
+    state_file: Path, sparql_endpoint: str, marker: str | None
+) -> dict | None:
+    """Reads a sync state file, returning None if there isn't one, or if it was made for another SPARQL Endpoint.
+
+    Its local state, the Version Indicators read from each artifact file, is returned keyed by the file's path,
+    modification time & size, as in denormalise_artifacts()' indicators_cache. Its remote state is set to None if it
+    was recorded before the endpoint's graphs were last changed, as indicated by the marker"""
+    if not Path(state_file).is_file():
+        return None
+
+    state = json.loads(Path(state_file).read_text())
+    if state.get("sparql_endpoint") != sparql_endpoint:
+        return None
+
+    state["local"] = {
+        (path, f["mtime_ns"], f["size"]): {
+            k: _local_indicator_from_n3(v) if isinstance(v, str) else v
+            for k, v in f["indicators"].items()
+        }
+        for path, f in state.get("local", {}).items()
+    }
+
+    if marker is None or state.get("marker") != marker:
+        state["remote"] = None
+        return state
+
+    state["remote"] = {
+        me: {
+            k: from_n3(v).toPython() if isinstance(v, str) else v
+            for k, v in indicators.items()
+        }
+        for me, indicators in state["remote"].items()
+    }
+
+    return state
+
+
+def _write_sync_state(state_file: Path, state: dict) -> None:
+    """Writes a sync state file, with local & remote state values stored as N3 so that their types are kept.
+
+    Of the local state, only the Version Indicators of files unchanged since they were read are kept"""
+    local = {}
+    for (path, mtime_ns, size), indicators in state["local"].items():
+        if not Path(path).is_file():
+            continue
+        stat = Path(path).stat()
+        if (stat.st_mtime_ns, stat.st_size) != (mtime_ns, size):
+            continue
+        local[path] = {
+            "mtime_ns": mtime_ns,
+            "size": size,
+            "indicators": {
+                k: (v if isinstance(v, Node) else Literal(v)).n3()
+                if v is not None
+                else v
+                for k, v in indicators.items()
+            },
+        }
+    state["local"] = local
+    state["remote"] = {
+        me: {
+            k: (v if isinstance(v, Node) else Literal(v)).n3()
+            if v is not None and not isinstance(v, bool)
+            else v
+            for k, v in indicators.items()
+        }
+        for me, indicators in state["remote"].items()
+    }
+    Path(state_file).write_text(json.dumps(state, indent=4))
+
+
+def _timed(action: Callable):
+    """Runs action, returning its result, or the exception it raised, and the time it took"""
+    start = time.perf_counter()
+    try:
+        result = action()
+    except Exception as e:
+        result = e
+    return result, time.perf_counter() - start
+
+
+def _run_actions(actions: dict, sync_status: dict, concurrency: int = 1) -> dict:
+    """Runs each of the given sync actions, keyed by artifact, or a tuple of artifacts for grouped actions, using up to
+    concurrency threads.
+
+    Records the time each action took, in seconds, as "duration" in its artifacts' sync_status entries and returns
+    each action's result, keyed as the actions are. An action that raises an exception doesn't stop the others and its
+    result is the exception."""
+    if concurrency < 1:
+        raise ValueError("concurrency must be 1 or more")
+
+    results = {}
+    durations = {}
+    if concurrency == 1 or len(actions) < 2:
+        for k, action in actions.items():
+            results[k], durations[k] = _timed(action)
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = {
+                k: executor.submit(_timed, action) for k, action in actions.items()
+            }
+            for k, future in futures.items():
+                results[k], durations[k] = future.result()
+
+    for k, duration in durations.items():
+        for artifact in k if isinstance(k, tuple) else (k,):
+            sync_status[artifact]["duration"] = duration
+
+    return results
 
 
 def make_catalogue(
@@ -1,16 +1,26 @@
+import bz2
 import datetime
+import gzip
+import hashlib
+import io
+import lzma
+import re
 from collections.abc import Generator
 from enum import Enum
 from pathlib import Path
+from typing import BinaryIO
 
 import httpx
 from kurra.file import load_graph
 from kurra.sparql import query
+from kurra.utils import GspType, make_system_specific_sparql_endpoint
 from rdflib import BNode, Dataset, Graph, Literal, Node, URIRef
+from rdflib.compare import to_canonical_graph
 from rdflib.namespace import DCAT, OWL, PROF, RDF, SDO, SH, SKOS
+from rdflib.plugins.parsers.ntriples import unquote, uriquote
 
 import prezmanifest
-from prezmanifest.definednamespaces import MRR, PREZ
+from prezmanifest.definednamespaces import MRR, MVT, OLIS, PREZ
 
 KNOWN_PROFILES = {
     URIRef("http://www.opengis.net/def/geosparql"): {
@@ -39,6 +49,8 @@ KNOWN_PROFILES = {
     },
 }
 
+BACKGROUND_GRAPH_IRI = "http://background"
+
 KNOWN_ENTITY_CLASSES = [
     SKOS.ConceptScheme,
     OWL.Ontology,
@@ -53,6 +65,39 @@ KNOWN_ENTITY_CLASSES = [
 ]
 
 
+RDF_FILE_FORMATS = {
+    ".ttl": "turtle",
+    ".trig": "trig",
+    ".nt": "nt",
+    ".nq": "nquads",
+    ".jsonld": "json-ld",
+}
+
+RDF_MEDIA_TYPES = {
+    "turtle": "text/turtle",
+    "trig": "application/trig",
+    "nt": "application/n-triples",
+    "nquads": "application/n-quads",
+    "json-ld": "application/ld+json",
+}
+
+QUADS_FORMATS = ["trig", "nquads"]
+
+COMPRESSION_SUFFIXES = [".gz", ".bz2", ".xz", ".zst"]
+
+# a single N-Triples / N-Quads statement, with escapes left in place
+_NT_IRI = r"<[^>]*>"
+_NT_BNODE = r"_:[A-Za-z0-9_:](?:[-A-Za-z0-9_:.]*[-A-Za-z0-9_:])?"
+_NT_LITERAL = r'"(?:[^"\\]|\\.)*"(?:@[a-zA-Z]+(?:-[a-zA-Z0-9]+)*|\^\^<[^>]*>)?'
+_NT_LINE = re.compile(
+    rf"^\s*({_NT_IRI}|{_NT_BNODE})\s*({_NT_IRI})\s*({_NT_IRI}|{_NT_BNODE}|{_NT_LITERAL})"
+    rf"\s*({_NT_IRI}|{_NT_BNODE})?\s*\.\s*(?:#.*)?$"
+)
+_NT_LITERAL_PARTS = re.compile(
+    r'^"((?:[^"\\]|\\.)*)"(?:@([a-zA-Z]+(?:-[a-zA-Z0-9]+)*)|\^\^<([^>]*)>)?$'
+)
+
+
 def path_or_url(s: str) -> Path | str:
     """Converts a string into a Path, preserving http(s)://..."""
     if s.startswith("http") and "://" in str(s):
@@ -114,24 +159,227 @@ def get_files_from_artifact(
         raise TypeError(f"Unsupported artifact type: {type(artifact)}")
 
 
+def get_compression(file: Path) -> str | None:
+    """Returns the compression suffix - .gz, .bz2, .xz or .zst - of a file, if it has one"""
+    suffix = Path(file).suffix.lower()
+    return suffix if suffix in COMPRESSION_SUFFIXES else None
+
+
+def open_rdf_file(file: Path, mode: str = "rb") -> BinaryIO:
+    """Opens a file for binary reading or writing, (de)compressing it on the fly according to its suffix"""
+    compression = get_compression(file)
+    if compression == ".gz":
+        return gzip.open(file, mode)
+    elif compression == ".bz2":
+        return bz2.open(file, mode)
+    elif compression == ".xz":
+        return lzma.open(file, mode)
+    elif compression == ".zst":
+        try:
+            import zstandard
+        except ImportError as e:
+            raise ValueError(
+                f"The file {file} is Zstandard compressed but the zstandard Python package is not installed. "
+                f"Install prezmanifest[zstd] to use it."
+            ) from e
+        return zstandard.open(file, mode)
+    else:
+        return open(file, mode)
+
+
+def get_rdf_format(file: Path) -> str | None:
+    """Returns the RDFLib format name for an RDF file, or None if it is not recognised as RDF.
+
+    The format is determined by the file's extension, ignoring any compression suffix, so 'data.nt.gz' is N-Triples.
+    Only files without an extension, such as 'data' or 'data.gz', have their format sniffed from the start of their
+    content. Files with any other extension, such as '.json', are not RDF."""
+    file = Path(file)
+    name = file.name.lower()
+    if get_compression(file) is not None:
+        name = name[: name.rfind(".")]
+    suffix = name[name.rfind(".") :] if "." in name else ""
+
+    if suffix in RDF_FILE_FORMATS:
+        return RDF_FILE_FORMATS[suffix]
+    elif suffix != "":
+        return None
+
+    if not file.is_file():
+        return None
+
+    try:
+        with open_rdf_file(file) as f:
+            head = f.read(4096).decode("utf-8", errors="ignore").lstrip()
+    except (OSError, EOFError, ValueError, lzma.LZMAError):
+        return None
+
+    if head.startswith(("{", "[")):
+        return "json-ld"
+    elif re.match(r"(?i)^(@prefix|@base|prefix|base)\b", head):
+        return "trig" if re.search(r"(?im)^\s*(graph\s+)?\S+\s*\{", head) else "turtle"
+    else:
+        for line in head.splitlines():
+            if line.strip() == "" or line.startswith("#"):
+                continue
+            m = _NT_LINE.match(line)
+            if m is None:
+                return None
+            return "nquads" if m.group(4) is not None else "nt"
+
+    return None
+
+
+def _parse_line_oriented(
+    stream: BinaryIO,
+    target: Graph | Dataset,
+    batch_size: int = 10000,
+    preserve_bnode_ids: bool = False,
+) -> None:
+    """Parses N-Triples or N-Quads from a binary stream into a Graph or Dataset, line by line.
+
+    This is a faster, streaming, alternative to RDFLib's parsers for these formats: each line is matched with a single
+    regular expression and parsed triples are added to the target in batches. Blank Nodes are given new IDs unless
+    preserve_bnode_ids is set, as it is for re-reading canonicalized data."""
+    iris = {}
+    bnodes = {}
+    graphs = {}
+
+    def _term(s: str):
+        if s[0] == "<":
+            iri = iris.get(s)
+            if iri is None:
+                iri = URIRef(uriquote(unquote(s[1:-1]) if "\\" in s else s[1:-1]))
+                iris[s] = iri
+            return iri
+        elif s[0] == "_":
+            bnode = bnodes.get(s)
+            if bnode is None:
+                bnode = BNode(s[2:]) if preserve_bnode_ids else BNode()
+                bnodes[s] = bnode
+            return bnode
+        else:
+            lexical, lang, datatype = _NT_LITERAL_PARTS.match(s).groups()
+            return Literal(
+                unquote(lexical) if "\\" in lexical else lexical,
+                lang=lang,
+                datatype=_term(f"<{datatype}>") if datatype is not None else None,
+            )
+
+    def _graph(s: str | None) -> Graph:
+        if not isinstance(target, Dataset):
+            return target
+        g = graphs.get(s)
+        if g is None:
+            g = target.default_graph if s is None else target.graph(_term(s))
+            graphs[s] = g
+        return g
+
+    batch = []
+    for line_number, line in enumerate(io.TextIOWrapper(stream, encoding="utf-8"), 1):
+        m = _NT_LINE.match(line)
+        if m is None:
+            if line.strip() == "" or line.lstrip().startswith("#"):
+                continue
+            raise ValueError(
+                f"Invalid N-Triples/N-Quads statement on line {line_number}: {line.strip()}"
+            )
+        s, p, o, g = m.groups()
+        batch.append((_term(s), _term(p), _term(o), _graph(g)))
+        if len(batch) >= batch_size:
+            target.addN(batch)
+            batch = []
+    if batch:
+        target.addN(batch)
+
+
+def get_uncompressed_size(file: Path, compression_ratio: float = 5.0) -> int:
+    """Returns the size, in bytes, of a file's content once decompressed.
+
+    This is exact for uncompressed files, read from the size trailer of gzip files (for files under 4 GB) and estimated
+    using the given compression_ratio for other compressed files."""
+    file = Path(file)
+    size = file.stat().st_size
+    compression = get_compression(file)
+    if compression is None:
+        return size
+    elif compression == ".gz" and size >= 18:
+        with open(file, "rb") as f:
+            f.seek(-4, 2)
+            isize = int.from_bytes(f.read(4), "little")
+        if isize >= size:
+            return isize
+
+    return int(size * compression_ratio)
+
+
+def count_statements(file: Path) -> int:
+    """Counts the statements in an N-Triples or N-Quads file, compressed or not, without parsing them"""
+    n = 0
+    with open_rdf_file(file) as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith(b"#"):
+                n += 1
+    return n
+
+
+def load_rdf_file(file: Path) -> Graph | Dataset:
+    """Loads an RDF file of any supported format, compressed or not, as a Graph, or as a Dataset for quads formats"""
+    rdf_format = get_rdf_format(file)
+    if rdf_format is None:
+        raise ValueError(f"The file {file} is not in a recognised RDF format")
+
+    data = Dataset() if rdf_format in QUADS_FORMATS else Graph()
+
+    with open_rdf_file(file) as f:
+        if rdf_format in ["nt", "nquads"]:
+            _parse_line_oriented(f, data)
+        else:
+            data.parse(f, format=rdf_format)
+
+    return data
+
+
+def load_rdf_file_as_graph(file: Path) -> Graph:
+    """Loads an RDF file of any supported format as a single Graph, merging all graphs of quads formats"""
+    data = load_rdf_file(file)
+    if isinstance(data, Dataset):
+        g = Graph()
+        g.addN((s, p, o, g) for s, p, o, _ in data.quads())
+        return g
+    return data
+
+
+def load_artifact_graph(artifact: Path | str) -> Graph:
+    """Loads an artifact as a Graph with kurra's load_graph(), which also takes URLs & RDF data strings and uses any
+    pickle cache of a file, except for N-Triples, N-Quads and compressed files, which are loaded with
+    load_rdf_file_as_graph()"""
+    if isinstance(artifact, Path) and (
+        get_compression(artifact) is not None
+        or get_rdf_format(artifact) in ["nt", "nquads"]
+    ):
+        return load_rdf_file_as_graph(artifact)
+    return load_graph(artifact)
+
+
 def get_identifier_from_file(file: Path) -> list[URIRef]:
     """Returns a list if RDFLib graph identifier (URIRefs) from a triples or quads file
     for all KNOWN_ENTITY_CLASSES objects"""
-    if file.name.endswith(".ttl"):
-        g = Graph().parse(file)
+    rdf_format = get_rdf_format(file)
+    if rdf_format is None:
+        return []
+    elif rdf_format in QUADS_FORMATS:
+        gs = []
+        for g in load_rdf_file(file).graphs():
+            if g.identifier != URIRef("urn:x-rdflib:default"):
+                gs.append(g.identifier)
+        return gs
+    else:
+        g = load_rdf_file(file)
         for entity_class in KNOWN_ENTITY_CLASSES:
             v = g.value(predicate=RDF.type, object=entity_class)
             if v is not None:
                 return [v]
-    elif file.name.endswith(".trig"):
-        gs = []
-        d = Dataset()
-        d.parse(file, format="trig")
-        for g in d.graphs():
-            gs.append(g.identifier)
-        return gs
-    else:
-        return []
 
 
 def get_manifest_paths_and_graph(
@@ -220,6 +468,330 @@ def make_httpx_client(
     return httpx.Client(auth=auth, timeout=timeout)
 
 
+def upload_rdf_data(
+    sparql_endpoint: str,
+    data: bytes | Generator[bytes],
+    graph_iri: str,
+    content_type: str = "application/n-triples",
+    append: bool = False,
+    http_client: httpx.Client | None = None,
+) -> tuple[bool | int, str | None]:
+    """Sends already serialized RDF data to a graph in a SPARQL Endpoint using the Graph Store Protocol.
+
+    Unlike kurra's upload(), the data is not parsed before sending. Like it, the graph is replaced by a PUT unless
+    append is True, in which case the data is POSTed."""
+    close_http_client = False
+    if http_client is None:
+        http_client = httpx.Client()
+        close_http_client = True
+
+    r = http_client.request(
+        "POST" if append else "PUT",
+        make_system_specific_sparql_endpoint(
+            sparql_endpoint, gsp_query_type=GspType.post if append else GspType.put
+        ),
+        params={"graph": str(graph_iri)},
+        headers={"Content-Type": content_type},
+        content=data,
+    )
+
+    if close_http_client:
+        http_client.close()
+
+    if r.is_success:
+        return True, None
+    else:
+        return r.status_code, r.text
+
+
+def upload_rdf_file(
+    sparql_endpoint: str,
+    file: Path,
+    graph_iri: str,
+    append: bool = False,
+    http_client: httpx.Client | None = None,
+) -> tuple[bool | int, str | None]:
+    """Uploads an RDF file of any supported format, compressed or not, to a graph in a SPARQL Endpoint.
+
+    Triples files are decompressed and streamed to the endpoint as is, without parsing. Quads files have all their
+    graphs merged into the one target graph."""
+    rdf_format = get_rdf_format(file)
+    if rdf_format is None:
+        raise ValueError(f"The file {file} is not in a recognised RDF format")
+
+    if rdf_format in QUADS_FORMATS:
+        return upload_rdf_data(
+            sparql_endpoint,
+            load_rdf_file_as_graph(file).serialize(format="nt", encoding="utf-8"),
+            graph_iri,
+            append=append,
+            http_client=http_client,
+        )
+
+    def _chunks():
+        with open_rdf_file(file) as f:
+            while chunk := f.read(1024 * 1024):
+                yield chunk
+
+    return upload_rdf_data(
+        sparql_endpoint,
+        _chunks(),
+        graph_iri,
+        content_type=RDF_MEDIA_TYPES[rdf_format],
+        append=append,
+        http_client=http_client,
+    )
+
+
+def get_content_hash(data: Graph | bytes) -> str:
+    """Returns a SHA-256 hash of the content of an RDF graph, given as a Graph or as N-Triples bytes.
+
+    The hash is of the graph's sorted N-Triples lines so it doesn't depend on serialization or statement order. Graphs
+    containing Blank Nodes are canonicalized first which is much slower, so is only done when needed."""
+    if isinstance(data, bytes):
+        if b"_:" not in data:
+            lines = data.decode("utf-8").splitlines()
+        else:
+            data = Graph().parse(data=data, format="nt")
+
+    if isinstance(data, Graph):
+        if any(isinstance(term, BNode) for triple in data for term in triple):
+            data = to_canonical_graph(data)
+        lines = data.serialize(format="nt").splitlines()
+
+    h = hashlib.sha256()
+    for line in sorted(line for line in lines if line.strip() != ""):
+        h.update(line.encode("utf-8"))
+        h.update(b"\n")
+
+    return h.hexdigest()
+
+
+def set_content_hashes_sparql(
+    content_hashes: dict,
+    sparql_endpoint: str,
+    http_client: httpx.Client | None = None,
+) -> None:
+    """Records the content hash of each of the given graphs, a dict of graph IRI to hash, in the Olis System Graph of
+    the given SPARQL Endpoint, replacing any previously recorded hashes for those graphs, in one SPARQL Update.
+
+    The System Graph's modified date is also updated, as a marker that the endpoint's graphs have changed"""
+    if len(content_hashes) == 0:
+        return
+
+    graphs = " ".join(f"<{g}>" for g in content_hashes)
+    inserts = "\n".join(
+        f'<{g}> schema:version [ schema:additionalType mvt:ContentHash ; schema:value "{h}" ] .'
+        for g, h in content_hashes.items()
+    )
+    q = f"""
+        PREFIX mvt: <{MVT._NS}>
+        PREFIX schema: <https://schema.org/>
+
+        DELETE {{
+            GRAPH <{OLIS.SystemGraph}> {{
+                ?g schema:version ?v .
+                ?v ?p ?o .
+            }}
+        }}
+        WHERE {{
+            GRAPH <{OLIS.SystemGraph}> {{
+                VALUES ?g {{ {graphs} }}
+                ?g schema:version ?v .
+                ?v schema:additionalType mvt:ContentHash ;
+                    ?p ?o .
+            }}
+        }} ;
+        INSERT DATA {{
+            GRAPH <{OLIS.SystemGraph}> {{
+                {inserts}
+            }}
+        }} ;
+        DELETE WHERE {{
+            GRAPH <{OLIS.SystemGraph}> {{
+                <{OLIS.SystemGraph}> schema:dateModified ?m
+            }}
+        }} ;
+        INSERT DATA {{
+            GRAPH <{OLIS.SystemGraph}> {{
+                <{OLIS.SystemGraph}> schema:dateModified "{datetime.datetime.now(datetime.UTC).isoformat()}"^^<http://www.w3.org/2001/XMLSchema#dateTime>
+            }}
+        }}
+        """
+    send_sparql_update(sparql_endpoint, q, http_client)
+
+
+def get_sync_marker_sparql(
+    sparql_endpoint: str,
+    http_client: httpx.Client | None = None,
+) -> str | None:
+    """Gets the modified date of the Olis System Graph of the given SPARQL Endpoint, which changes whenever graphs are
+    loaded or synced, or None if it has none"""
+    q = f"""
+        PREFIX schema: <https://schema.org/>
+
+        SELECT ?m
+        WHERE {{
+            GRAPH <{OLIS.SystemGraph}> {{
+                <{OLIS.SystemGraph}> schema:dateModified ?m
+            }}
+        }}
+        """
+    for r in query(
+        sparql_endpoint,
+        q,
+        http_client=http_client,
+        return_format="python",
+        return_bindings_only=True,
+    ):
+        return str(r["m"])
+
+    return None
+
+
+def send_sparql_update(
+    sparql_endpoint: str,
+    update: str | bytes | Generator[bytes],
+    http_client: httpx.Client | None = None,
+) -> tuple[bool | int, str | None]:
+    """Sends a SPARQL Update to a SPARQL Endpoint without parsing it first, as kurra's query() does, which is slow for
+    Updates carrying lots of data"""
+    close_http_client = False
+    if http_client is None:
+        http_client = httpx.Client()
+        close_http_client = True
+
+    # GraphDB takes Updates at a separate endpoint
+    if "/repositories/" in sparql_endpoint and not sparql_endpoint.endswith(
+        "/statements"
+    ):
+        sparql_endpoint += "/statements"
+
+    r = http_client.post(
+        sparql_endpoint,
+        headers={"Content-Type": "application/sparql-update"},
+        content=update.encode("utf-8") if isinstance(update, str) else update,
+    )
+
+    if close_http_client:
+        http_client.close()
+
+    if r.is_success:
+        return True, None
+    else:
+        return r.status_code, r.text
+
+
+def replace_graphs_sparql(
+    graphs: dict,
+    sparql_endpoint: str,
+    http_client: httpx.Client | None = None,
+) -> tuple[bool | int, str | None]:
+    """Replaces the content of each of the given graphs, a dict of graph IRI to RDF file, in a single SPARQL Update
+    request, so that readers never see any of them empty or only some of them updated"""
+
+    def _operations() -> Generator[bytes]:
+        for i, (graph_iri, file) in enumerate(graphs.items()):
+            if i > 0:
+                yield b" ;\n"
+            yield f"DROP SILENT GRAPH <{graph_iri}> ;\nINSERT DATA {{ GRAPH <{graph_iri}> {{\n".encode()
+            yield load_rdf_file_as_graph(Path(file)).serialize(
+                format="nt", encoding="utf-8"
+            )
+            yield b"} }"
+
+    return send_sparql_update(sparql_endpoint, _operations(), http_client)
+
+
+def get_remote_graph(
+    sparql_endpoint: str,
+    graph_iri: str,
+    http_client: httpx.Client | None = None,
+) -> Graph:
+    """Gets the content of a graph in a SPARQL Endpoint using the Graph Store Protocol, as N-Triples"""
+    close_http_client = False
+    if http_client is None:
+        http_client = httpx.Client()
+        close_http_client = True
+
+    r = http_client.get(
+        make_system_specific_sparql_endpoint(
+            sparql_endpoint, gsp_query_type=GspType.get
+        ),
+        params={"graph": str(graph_iri)},
+        headers={"Accept": "application/n-triples"},
+    )
+
+    if close_http_client:
+        http_client.close()
+
+    if not r.is_success:
+        raise ValueError(
+            f"Could not get graph {graph_iri} from {sparql_endpoint}. Error is {r.status_code}: {r.text}"
+        )
+
+    g = Graph(identifier=URIRef(graph_iri))
+    _parse_line_oriented(io.BytesIO(r.content), g)
+
+    return g
+
+
+def update_graph_by_diff_sparql(
+    sparql_endpoint: str,
+    file: Path,
+    graph_iri: str,
+    http_client: httpx.Client | None = None,
+    max_diff_ratio: float = 0.2,
+    chunk_size: int = 10000,
+) -> tuple[bool | int, str | None]:
+    """Updates a graph in a SPARQL Endpoint to match the content of an RDF file by sending only the triples that differ,
+    as DELETE DATA / INSERT DATA operations of up to chunk_size triples each, in one SPARQL Update request.
+
+    Falls back to replacing the whole graph if the difference is more than max_diff_ratio of the file's triples or if
+    either graph contains Blank Nodes, which can't be matched between the two. Returns (True, None) if the graph was
+    updated, or replaced, else the endpoint's error status code & message."""
+    local = load_rdf_file_as_graph(Path(file))
+    remote = get_remote_graph(sparql_endpoint, graph_iri, http_client)
+
+    def _has_bnodes(g: Graph) -> bool:
+        return any(isinstance(term, BNode) for triple in g for term in triple)
+
+    if _has_bnodes(local) or _has_bnodes(remote):
+        return upload_rdf_file(
+            sparql_endpoint, file, graph_iri, http_client=http_client
+        )
+
+    local_triples = set(local)
+    remote_triples = set(remote)
+    to_delete = remote_triples - local_triples
+    to_insert = local_triples - remote_triples
+
+    if len(to_delete) + len(to_insert) > max_diff_ratio * max(len(local_triples), 1):
+        return upload_rdf_file(
+            sparql_endpoint, file, graph_iri, http_client=http_client
+        )
+
+    if len(to_delete) + len(to_insert) == 0:
+        return True, None
+
+    def _operations() -> Generator[bytes]:
+        first = True
+        for operation, triples in [("DELETE", to_delete), ("INSERT", to_insert)]:
+            triples = sorted(triples)
+            for i in range(0, len(triples), chunk_size):
+                if not first:
+                    yield b" ;\n"
+                first = False
+                yield f"{operation} DATA {{ GRAPH <{graph_iri}> {{\n".encode()
+                yield "".join(
+                    f"{s.n3()} {p.n3()} {o.n3()} .\n"
+                    for s, p, o in triples[i : i + chunk_size]
+                ).encode("utf-8")
+                yield b"} }"
+
+    return send_sparql_update(sparql_endpoint, _operations(), http_client)
+
+
 def get_artifact_main_entity_iri(
     artifact: Path,
     manifest: Path | tuple[Path, Path, Graph],
@@ -285,7 +857,11 @@ def get_artifact_main_entity_iri(
         return URIRef(r["iri"])
 
     # load the artifact graph
-    g = artifact_graph if artifact_graph is not None else load_graph(artifact_path_abs)
+    g = (
+        artifact_graph
+        if artifact_graph is not None
+        else load_artifact_graph(artifact_path_abs)
+    )
 
     # check artifact graph load
     if not isinstance(g, Graph):
@@ -373,7 +949,7 @@ def get_version_indicators_local(
         manifest
     )
     artifact_path = absolutise_path(artifact, manifest_root)
-    artifact_graph = load_graph(artifact_path)
+    artifact_graph = load_artifact_graph(artifact_path)
 
     # if we aren't given a Main Entity, let's look for one using the Main Entity Classes
     if version_indicators.get("main_entity") is None:
@@ -427,6 +1003,28 @@ def get_version_indicators_local(
     return
 
 
+def get_content_hash_local(
+    artifact: Path, version_indicators: dict, indicators_cache: dict | None = None
+) -> str | None:
+    """Returns the content hash of a local artifact file, as per get_content_hash(), or None if there's no such file.
+
+    The hash is only worked out if the artifact's Version Indicators, as per denormalise_artifacts(), don't already hold
+    it, and is then added to them and to their entry in the indicators_cache, if given, so the file is hashed at most
+    once while it's unchanged."""
+    artifact = Path(artifact)
+    if version_indicators.get("content_hash") is None and artifact.is_file():
+        version_indicators["content_hash"] = get_content_hash(
+            load_rdf_file_as_graph(artifact)
+        )
+        if indicators_cache is not None:
+            key = _indicators_cache_key(artifact)
+            if key in indicators_cache:
+                indicators_cache[key]["content_hash"] = version_indicators[
+                    "content_hash"
+                ]
+    return version_indicators.get("content_hash")
+
+
 def get_version_indicators_sparql(
     main_entity: str,
     sparql_endpoint: str,
@@ -467,6 +1065,7 @@ def get_version_indicators_sparql(
     
                 OPTIONAL {{
                     ?me owl:versionInfo|schema:version ?v .
+                    FILTER(!isBlank(?v))
                 }}
             }}
         }}
@@ -494,6 +1093,189 @@ def get_version_indicators_sparql(
     return indicators
 
 
+def get_version_indicators_sparql_batch(
+    main_entities: list[str],
+    sparql_endpoint: str,
+    http_client: httpx.Client | None = None,
+    page_size: int = 200,
+) -> dict:
+    """Gets the remote state of many Main Entities from a SPARQL Endpoint with one query per page_size entities.
+
+    Returns a dict, keyed by Main Entity IRI (str), of the same Version Indicators get_version_indicators_sparql()
+    returns, plus any Content Hash recorded for it in the System Graph, "known", whether a graph with the Main Entity's
+    IRI exists, and "catalogue_known", whether a graph with the Main Entity's IRI + "-catalogue" exists.
+
+    Version Indicators are read from those two graphs only, with values from the Main Entity's graph preferred."""
+    if not sparql_endpoint.startswith("http") and "://" in str(sparql_endpoint):
+        raise ValueError(
+            f"The sparql_endpoint you have supplied does not look valid: {sparql_endpoint}"
+        )
+
+    main_entities = list(dict.fromkeys(str(me) for me in main_entities))
+    indicators = {
+        me: {
+            "modified_date": None,
+            "version_info": None,
+            "version_iri": None,
+            "file_size": None,
+            "content_hash": None,
+            "main_entity": URIRef(me),
+            "known": False,
+            "catalogue_known": False,
+        }
+        for me in main_entities
+    }
+    keys = {
+        "md": "modified_date",
+        "vi": "version_iri",
+        "v": "version_info",
+        "h": "content_hash",
+    }
+
+    for i in range(0, len(main_entities), page_size):
+        values = "\n                    ".join(
+            f"(<{me}> <{me}>) (<{me}> <{me}-catalogue>)"
+            for me in main_entities[i : i + page_size]
+        )
+        q = f"""
+            PREFIX dcterms: <http://purl.org/dc/terms/>
+            PREFIX mvt: <{MVT._NS}>
+            PREFIX owl: <http://www.w3.org/2002/07/owl#>
+            PREFIX schema: <https://schema.org/>
+
+            SELECT ?me ?id ?known ?md ?vi ?v ?h
+            WHERE {{
+                VALUES (?me ?id) {{
+                    {values}
+                }}
+                BIND(EXISTS {{ GRAPH ?id {{ ?s ?p ?o }} }} AS ?known)
+
+                # one OPTIONAL per predicate, not property path alternatives, as some stores drop rows for
+                # unmatched OPTIONAL alternatives
+                OPTIONAL {{
+                    GRAPH ?id {{ ?me dcterms:modified ?md }}
+                }}
+
+                OPTIONAL {{
+                    GRAPH ?id {{ ?me schema:dateModified ?md }}
+                }}
+
+                OPTIONAL {{
+                    GRAPH ?id {{ ?me owl:versionIRI ?vi }}
+                }}
+
+                OPTIONAL {{
+                    GRAPH ?id {{ ?me owl:versionInfo ?v }}
+                }}
+
+                OPTIONAL {{
+                    GRAPH ?id {{ ?me schema:version ?v }}
+                    FILTER(!isBlank(?v))
+                }}
+
+                OPTIONAL {{
+                    GRAPH <{OLIS.SystemGraph}> {{
+                        ?id schema:version [ schema:additionalType mvt:ContentHash ; schema:value ?h ]
+                    }}
+                }}
+            }}
+            """
+        for r in query(
+            sparql_endpoint,
+            q,
+            http_client=http_client,
+            return_format="python",
+            return_bindings_only=True,
+        ):
+            me = indicators[str(r["me"])]
+            is_me_graph = str(r["id"]) == str(r["me"])
+            if r.get("known") is True:
+                me["known" if is_me_graph else "catalogue_known"] = True
+            for var, key in keys.items():
+                if r.get(var) is not None and (is_me_graph or me[key] is None):
+                    me[key] = r[var]
+
+    return indicators
+
+
+def count_triples_sparql(
+    graph_iris: list[str],
+    sparql_endpoint: str,
+    http_client: httpx.Client | None = None,
+) -> dict[str, int]:
+    """Counts the triples in each of the given graphs in a SPARQL Endpoint with a single query, returning a dict of
+    graph IRI to count, with 0 for graphs that don't exist"""
+    counts = {str(g): 0 for g in graph_iris}
+    if len(counts) == 0:
+        return counts
+
+    q = f"""
+        SELECT ?g (COUNT(*) AS ?n)
+        WHERE {{
+            VALUES ?g {{ {" ".join(f"<{g}>" for g in counts)} }}
+            GRAPH ?g {{
+                ?s ?p ?o
+            }}
+        }}
+        GROUP BY ?g
+        """
+    for r in query(
+        sparql_endpoint,
+        q,
+        http_client=http_client,
+        return_format="python",
+        return_bindings_only=True,
+    ):
+        counts[str(r["g"])] = int(r["n"])
+
+    return counts
+
+
+def merge_graphs(
+    base: Graph, local: Graph, remote: Graph
+) -> tuple[Graph | None, list[tuple[Node, Node]]]:
+    """Merges the changes made to a base graph in its local and remote copies, triple by triple.
+
+    Returns the merged graph and an empty list, or None and a list of the (subject, predicate) pairs whose values both
+    copies changed, differently. Graphs with Blank Nodes can't be merged, as Blank Nodes can't be matched between the
+    copies, so None and an empty list is returned for them"""
+    for g in [base, local, remote]:
+        if any(isinstance(term, BNode) for triple in g for term in triple):
+            return None, []
+
+    base_triples = set(base)
+    local_triples = set(local)
+    remote_triples = set(remote)
+
+    def _changes(triples: set) -> dict:
+        changes = {}
+        for t in triples - base_triples:
+            changes.setdefault((t[0], t[1]), (set(), set()))[0].add(t)
+        for t in base_triples - triples:
+            changes.setdefault((t[0], t[1]), (set(), set()))[1].add(t)
+        return changes
+
+    local_changes = _changes(local_triples)
+    remote_changes = _changes(remote_triples)
+    conflicts = sorted(
+        sp
+        for sp in local_changes.keys() & remote_changes.keys()
+        if local_changes[sp] != remote_changes[sp]
+    )
+    if len(conflicts) > 0:
+        return None, conflicts
+
+    merged = Graph()
+    for t in (base_triples & local_triples & remote_triples) | (
+        (local_triples | remote_triples) - base_triples
+    ):
+        merged.add(t)
+    for prefix, namespace in local.namespaces():
+        merged.bind(prefix, namespace, override=False)
+
+    return merged, []
+
+
 class VersionIndicatorComparison(Enum):
     First = "first"
     Second = "second"
@@ -502,7 +1284,20 @@ class VersionIndicatorComparison(Enum):
 
 
 def compare_version_indicators(first: dict, second: dict) -> VersionIndicatorComparison:
-    """Compares Modified Date, Version IRI & Version info for each and returns latest"""
+    """Compares Modified Date, Version IRI & Version info for each and returns latest
+
+    If both have the same Content Hash, their content is identical so the first is never said to be more recent, but
+    the second still may be if its other indicators show it to have been updated since the hash was recorded"""
+    if first.get("content_hash") and first.get("content_hash") == second.get(
+        "content_hash"
+    ):
+        c = compare_version_indicators(
+            {k: v for k, v in first.items() if k != "content_hash"},
+            {k: v for k, v in second.items() if k != "content_hash"},
+        )
+        if c == VersionIndicatorComparison.Second:
+            return c
+        return VersionIndicatorComparison.Neither
 
     """Even weighted aggregate score for each version indicator"""
     first_score = 0
@@ -575,9 +1370,22 @@ def which_is_more_recent(
     return compare_version_indicators(version_indicators, remote)
 
 
-def denormalise_artifacts(manifest: Path | tuple[Path, Path, Graph]) -> dict:
+def _indicators_cache_key(file: Path) -> tuple[str, int, int]:
+    stat = file.stat()
+    return str(file), stat.st_mtime_ns, stat.st_size
+
+
+def denormalise_artifacts(
+    manifest: Path | tuple[Path, Path, Graph], indicators_cache: dict | None = None
+) -> dict:
     """Extracts all the artifacts from a Manifest.
 
+    If given, indicators_cache, a dict kept between calls for the same Manifest, holds the Version Indicators read from
+    each artifact file, keyed by its path, modification time & size, so that unchanged files aren't read again.
+
+    Content hashes, which are slow to work out for large files, aren't, and are None unless cached. Use
+    get_content_hash_local() for those needed.
+
     Returns a dict of:
 
     Artifact path,
@@ -713,6 +1521,7 @@ def denormalise_artifacts(manifest: Path | tuple[Path, Path, Graph]) -> dict:
                 "version_iri": vi,
                 "version_info": v,
                 "file_size": None,
+                "content_hash": None,
                 "conformance_claim": cc,
                 "additional_type": atype,
                 "sync": sync,
@@ -721,9 +1530,27 @@ def denormalise_artifacts(manifest: Path | tuple[Path, Path, Graph]) -> dict:
     # get Version Indicators info only for Resources with certain Roles
     for k, v in artifacts_info.items():
         if v["role"] in [MRR.CatalogueData, MRR.ResourceData]:
+            key = None
+            if indicators_cache is not None and Path(k).is_file():
+                key = _indicators_cache_key(Path(k))
+                if key in indicators_cache:
+                    v.update(indicators_cache[key])
+                    continue
             get_version_indicators_local(
                 (manifest_path, manifest_root, manifest_graph), k, v
             )
+            if key is not None:
+                indicators_cache[key] = {
+                    i: v.get(i)
+                    for i in [
+                        "main_entity",
+                        "modified_date",
+                        "version_iri",
+                        "version_info",
+                        "file_size",
+                        "content_hash",
+                    ]
+                }
 
     return artifacts_info
 
@@ -735,32 +1562,58 @@ def artifact_file_name_from_graph_id(graph_id: str) -> str:
     return s + ".ttl"
 
 
-def store_remote_artifact_locally(
-    manifest: Path | tuple[Path, Path, Graph],
+def download_remote_artifacts(
+    manifest_root: Path,
+    sparql_endpoint: str,
+    graph_ids: list[str],
+    http_client: httpx.Client | None = None,
+) -> dict[str, str]:
+    """Writes many remote graphs to local files, within manifest_root, each named for its graph's IRI, streaming each
+    to disk with download_graph_to_file(), over the one HTTP client.
+
+    Returns the path of each file, relative to manifest_root, keyed by graph IRI"""
+    close_http_client = False
+    if http_client is None:
+        http_client = httpx.Client()
+        close_http_client = True
+
+    try:
+        return {
+            str(g): download_remote_artifact(
+                manifest_root, sparql_endpoint, str(g), http_client
+            )
+            for g in graph_ids
+        }
+    finally:
+        if close_http_client:
+            http_client.close()
+
+
+def download_remote_artifact(
+    manifest_root: Path,
     sparql_endpoint: str,
     graph_id: str,
     http_client: httpx.Client | None = None,
-) -> Graph:
-    """Writes a remote graph to a local file and registers that file as a Resource in the given Manifest.
+) -> str:
+    """Writes a remote graph to a local file, within manifest_root, named for the graph's IRI.
 
-    Only the Resource Role ResourceData is supported."""
-    manifest_path, manifest_root, manifest_graph = get_manifest_paths_and_graph(
-        manifest
-    )
-    q = """
-        CONSTRUCT {
-            ?s ?p ?o
-        }
-        WHERE {
-            GRAPH <xxx> {
-                ?s ?p ?o
-            }
-        }
-        """.replace("xxx", graph_id)
-    r = query(sparql_endpoint, q, http_client=http_client, return_format="python")
+    Returns the path of the file, relative to manifest_root"""
     artifact_path = str(artifact_file_name_from_graph_id(graph_id))
-    r.serialize(destination=manifest_root / artifact_path, format="longturtle")
+    download_graph_to_file(
+        sparql_endpoint, graph_id, manifest_root / artifact_path, http_client
+    )
+
+    return artifact_path
+
 
+def add_artifacts_to_manifest_graph(
+    manifest_graph: Graph,
+    artifacts: list[tuple[str, str]],
+) -> Graph:
+    """Returns a copy of the given Manifest graph with the given artifacts, (path, graph IRI) pairs, registered in its
+    ResourceData Resource.
+
+    Only the Resource Role ResourceData is supported."""
     new_manifest_graph = Graph()
     new_manifest_graph += manifest_graph
 
@@ -770,16 +1623,17 @@ def store_remote_artifact_locally(
             if (r, PROF.hasRole, MRR.ResourceData) in new_manifest_graph:
                 new_r = r
 
-        a = BNode()
-        new_manifest_graph.add(
-            (
-                a,
-                SDO.contentLocation,
-                Literal(artifact_path),  # relative to manifest_root
+        for artifact_path, graph_id in artifacts:
+            a = BNode()
+            new_manifest_graph.add(
+                (
+                    a,
+                    SDO.contentLocation,
+                    Literal(artifact_path),  # relative to manifest_root
+                )
             )
-        )
-        new_manifest_graph.add((a, SDO.mainEntity, URIRef(graph_id)))
-        new_manifest_graph.add((new_r, PROF.hasArtifact, a))
+            new_manifest_graph.add((a, SDO.mainEntity, URIRef(graph_id)))
+            new_manifest_graph.add((new_r, PROF.hasArtifact, a))
         new_manifest_graph.add(
             (new_r, PROF.hasRole, MRR.ResourceData)  # only one supported for now
         )
@@ -788,28 +1642,135 @@ def store_remote_artifact_locally(
     return new_manifest_graph
 
 
-def update_local_artifact(
+def add_artifact_to_manifest_graph(
+    manifest_graph: Graph,
+    artifact_path: str,
+    graph_id: str,
+) -> Graph:
+    """Returns a copy of the given Manifest graph with the given artifact registered in its ResourceData Resource.
+
+    Only the Resource Role ResourceData is supported."""
+    return add_artifacts_to_manifest_graph(manifest_graph, [(artifact_path, graph_id)])
+
+
+def store_remote_artifact_locally(
     manifest: Path | tuple[Path, Path, Graph],
-    artifact_path: Path,
     sparql_endpoint: str,
     graph_id: str,
     http_client: httpx.Client | None = None,
-):
+) -> Graph:
+    """Writes a remote graph to a local file and registers that file as a Resource in the given Manifest.
+
+    Only the Resource Role ResourceData is supported."""
     manifest_path, manifest_root, manifest_graph = get_manifest_paths_and_graph(
         manifest
     )
-    q = """
-        CONSTRUCT {
-            ?s ?p ?o
-        }
-        WHERE {
-            GRAPH <xxx> {
-                ?s ?p ?o
-            }
-        }
-        """.replace("xxx", graph_id)
-    r = query(sparql_endpoint, q, http_client=http_client, return_format="python")
-    r.serialize(destination=artifact_path, format="longturtle")
+    artifact_path = download_remote_artifact(
+        manifest_root, sparql_endpoint, graph_id, http_client
+    )
+
+    return add_artifact_to_manifest_graph(manifest_graph, artifact_path, graph_id)
+
+
+def download_graph_to_file(
+    sparql_endpoint: str,
+    graph_iri: str,
+    file: Path,
+    http_client: httpx.Client | None = None,
+    pretty_max_bytes: int = 50 * 1024 * 1024,
+) -> None:
+    """Downloads a remote graph to a file of any supported format, compressed or not, using the Graph Store Protocol.
+
+    The graph is fetched as N-Triples and streamed to disk as it arrives, so N-Triples, N-Quads and Turtle files,
+    of which N-Triples is a subset, never need the whole graph in memory. Turtle files of up to pretty_max_bytes of
+    N-Triples are then pretty-printed as longturtle. Other formats must be serialised from a parsed graph."""
+    file = Path(file)
+    rdf_format = get_rdf_format(file)
+    if rdf_format is None:
+        raise ValueError(f"The file {file} is not in a recognised RDF format")
+
+    close_http_client = False
+    if http_client is None:
+        http_client = httpx.Client()
+        close_http_client = True
+
+    # write to a temporary file, with the same suffixes, so a failed download doesn't leave a partial artifact
+    part = file.with_name(f".part-{file.name}")
+    size = 0
+    try:
+        with http_client.stream(
+            "GET",
+            make_system_specific_sparql_endpoint(
+                sparql_endpoint, gsp_query_type=GspType.get
+            ),
+            params={"graph": str(graph_iri)},
+            headers={"Accept": "application/n-triples"},
+        ) as r:
+            if not r.is_success:
+                r.read()
+                raise ValueError(
+                    f"Could not get graph {graph_iri} from {sparql_endpoint}. Error is {r.status_code}: {r.text}"
+                )
+            with open_rdf_file(part, "wb") as f:
+                rest = b""
+                for chunk in r.iter_bytes():
+                    size += len(chunk)
+                    if rdf_format != "nquads":
+                        f.write(chunk)
+                        continue
+                    # add the graph IRI to each complete statement
+                    lines = (rest + chunk).split(b"\n")
+                    rest = lines.pop()
+                    f.writelines(
+                        _triple_line_to_quad(line, graph_iri) for line in lines
+                    )
+                if rdf_format == "nquads":
+                    f.write(_triple_line_to_quad(rest, graph_iri))
+    except BaseException:
+        part.unlink(missing_ok=True)
+        raise
+    finally:
+        if close_http_client:
+            http_client.close()
+
+    if rdf_format not in ["nt", "nquads", "turtle"] or (
+        rdf_format == "turtle" and size <= pretty_max_bytes
+    ):
+        g = Graph()
+        with open_rdf_file(part) as f:
+            _parse_line_oriented(f, g)
+        if rdf_format in QUADS_FORMATS:
+            d = Dataset()
+            dg = d.graph(URIRef(graph_iri))
+            dg.addN((s, p, o, dg) for s, p, o in g)
+            g = d
+        with open_rdf_file(part, "wb") as f:
+            f.write(
+                g.serialize(
+                    format="longturtle" if rdf_format == "turtle" else rdf_format,
+                    encoding="utf-8",
+                )
+            )
+
+    part.replace(file)
+
+
+def _triple_line_to_quad(line: bytes, graph_iri: str) -> bytes:
+    line = line.strip()
+    if not line or line.startswith(b"#"):
+        return b""
+    return line[:-1].rstrip() + f" <{graph_iri}> .\n".encode()
+
+
+def update_local_artifact(
+    manifest: Path | tuple[Path, Path, Graph],
+    artifact_path: Path,
+    sparql_endpoint: str,
+    graph_id: str,
+    http_client: httpx.Client | None = None,
+):
+    """Replaces the content of a local artifact with that of its remote graph, streaming it to disk"""
+    download_graph_to_file(sparql_endpoint, graph_id, artifact_path, http_client)
 
 
 def get_background_graph(manifest: Path | tuple[Path, Path, Graph]) -> Graph:
@@ -837,8 +1798,8 @@ def get_background_graph(manifest: Path | tuple[Path, Path, Graph]) -> Graph:
                                 f"The artifact {file} in Manifest {manifest} is not a file"
                             )
 
-                        if str(file.name).endswith(".ttl"):
-                            background_graph += load_graph(file)
+                        if get_rdf_format(file) is not None:
+                            background_graph += load_artifact_graph(file)
 
     return background_graph
 
@@ -15,7 +15,11 @@ from pyparsing import Literal
 from rdflib import BNode, Graph, URIRef
 from rdflib.namespace import DCTERMS, PROF, SDO
 
-from prezmanifest.utils import get_background_graph, get_files_from_artifact
+from prezmanifest.utils import (
+    get_background_graph,
+    get_files_from_artifact,
+    load_artifact_graph,
+)
 
 
 class ManifestValidationError(Exception):
@@ -128,7 +132,7 @@ def validate(manifest: Path) -> Graph:
 
                 if validator is not None:
                     try:
-                        data_graph = load_graph(manifest_root / file)
+                        data_graph = load_artifact_graph(manifest_root / file)
                     except SyntaxError as e:
                         raise SyntaxError(f"Failed to load {file}: {e}")
 
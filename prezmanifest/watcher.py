@@ -0,0 +1,247 @@
+"""
+Keeps a SPARQL Endpoint up to date with a Manifest's content by watching its files and syncing, or loading, on change.
+
+Files are watched by polling their modification times & sizes, which works on any filesystem, including network and
+container-mounted ones where inotify events aren't delivered.
+"""
+
+import logging
+import threading
+import time
+from collections.abc import Callable, Iterable
+from pathlib import Path
+
+import httpx
+from rdflib import Graph
+
+from prezmanifest.loader import load
+from prezmanifest.syncer import _snapshot_path, sync
+from prezmanifest.utils import (
+    absolutise_path,
+    artifact_file_name_from_graph_id,
+    get_catalogue_iri_from_manifest,
+    get_manifest_paths_and_graph,
+    get_rdf_format,
+    make_httpx_client,
+)
+
+
+def _is_watched(file: Path, root: Path) -> bool:
+    """Whether file is under root and neither it nor any directory it's in, below root, is hidden"""
+    try:
+        parts = file.relative_to(root).parts
+    except ValueError:
+        return False
+    return not any(part.startswith(".") for part in parts)
+
+
+def _snapshot(root: Path) -> dict:
+    """Returns the modification time & size of each file under root, ignoring hidden files & directories"""
+    files = {}
+    for f in root.rglob("*"):
+        if not _is_watched(f, root):
+            continue
+        try:
+            stat = f.stat()
+        except FileNotFoundError:
+            continue
+        if f.is_file():
+            files[f] = (stat.st_mtime_ns, stat.st_size)
+    return files
+
+
+def _stat(file: Path) -> tuple[int, int]:
+    stat = file.stat()
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _affects_manifest(changed: set[Path], manifest_path: Path) -> bool:
+    """Whether any of the changed files is the Manifest or an RDF file, and so may be one of its artifacts"""
+    return any(f == manifest_path or get_rdf_format(f) is not None for f in changed)
+
+
+def _written_by_sync(
+    sync_status: dict,
+    manifest: tuple[Path, Path, Graph],
+    state_file: Path | None = None,
+) -> set[Path]:
+    """The local files a sync, with the given result, wrote: the artifacts it downloaded, merged or added locally, the
+    Manifest & catalogue it added any to, and its state file & snapshots"""
+    manifest_path, manifest_root, _ = manifest
+    written = set()
+    for k, v in sync_status.items():
+        if v["direction"] in ["download", "merge"]:
+            written.add(Path(absolutise_path(k, manifest_root)))
+        elif v["direction"] == "add-locally":
+            written.add(manifest_root / artifact_file_name_from_graph_id(k))
+    if any(v["direction"] == "add-locally" for v in sync_status.values()):
+        cat_iri = get_catalogue_iri_from_manifest(manifest)
+        written.add(manifest_path)
+        written |= {
+            Path(absolutise_path(k, manifest_root))
+            for k, v in sync_status.items()
+            if v["main_entity"] == cat_iri and v["direction"] != "add-locally"
+        }
+    if state_file is not None:
+        written |= {Path(state_file), _snapshot_path(state_file, "").parent}
+    return written
+
+
+def watch(
+    root: Path,
+    on_change: Callable[[set[Path]], Iterable[Path] | None],
+    interval: float = 1.0,
+    debounce: float = 0.5,
+    stop: threading.Event | None = None,
+    initial: bool = False,
+) -> None:
+    """Calls on_change with the set of files added, changed or removed under root, once no more changes have been seen
+    for debounce seconds, polling every interval seconds until stop is set. If initial is set, on_change is first
+    called with an empty set, as soon as watching starts.
+
+    on_change may return the files, or directories, it wrote itself, and changes to those are not reported. Any other
+    changes made while on_change runs are, once it returns. If on_change raises an exception, it is logged, with the
+    changed files, and watching continues."""
+    if stop is None:
+        stop = threading.Event()
+
+    root = Path(root).resolve()
+    last = _snapshot(root)
+
+    def _act(changed: set[Path]):
+        try:
+            written = on_change(changed)
+        except Exception:
+            logging.exception(
+                f"Could not act on changes to {', '.join(sorted(str(f) for f in changed))}"
+                if len(changed) > 0
+                else f"Could not act on the files in {root}"
+            )
+            return
+        if written is None:
+            return
+        written = [Path(w).resolve() for w in written]
+        current = _snapshot(root)
+        for f in current.keys() | last.keys():
+            if any(f == w or w in f.parents for w in written):
+                if f in current:
+                    last[f] = current[f]
+                else:
+                    del last[f]
+
+    if initial:
+        _act(set())
+
+    changed = set()
+    last_change = None
+    while not stop.wait(interval if last_change is None else min(interval, debounce)):
+        current = _snapshot(root)
+        diff = {
+            f for f in current.keys() | last.keys() if current.get(f) != last.get(f)
+        }
+        last = current
+        if len(diff) > 0:
+            changed |= diff
+            last_change = time.monotonic()
+        elif last_change is not None and time.monotonic() - last_change >= debounce:
+            _act(changed)
+            changed = set()
+            last_change = None
+
+
+def watch_sync(
+    manifest: Path,
+    sparql_endpoint: str,
+    http_client: httpx.Client | None = None,
+    on_sync: Callable[[dict], None] | None = None,
+    interval: float = 1.0,
+    debounce: float = 0.5,
+    stop: threading.Event | None = None,
+    **sync_args,
+) -> None:
+    """Syncs a Manifest with a SPARQL Endpoint and then again each time its files change, until stop is set.
+
+    The validated Manifest and the Version Indicators of unchanged artifacts are kept between syncs, so a change to one
+    artifact only reads and pushes that artifact. The Manifest is validated again only when it changes, including when
+    a sync adds artifacts to it. Changes to files that are neither the Manifest nor RDF are ignored. Any sync_args are
+    passed to sync(), and on_sync is called with each sync's result. Changes the syncs make themselves aren't synced
+    again, but any other changes made during a sync are."""
+    if http_client is None:
+        http_client = httpx.Client()
+    manifest_path = Path(manifest).resolve()
+    context = {}
+
+    def _sync(changed: set[Path]):
+        if len(changed) > 0 and not _affects_manifest(changed, manifest_path):
+            return None
+        manifest_stat = _stat(manifest_path)
+        if context.get("manifest_stat") != manifest_stat:
+            context["manifest"] = get_manifest_paths_and_graph(manifest_path)
+            context["indicators_cache"] = {}
+            context["manifest_stat"] = manifest_stat
+        r = sync(
+            context["manifest"],
+            sparql_endpoint,
+            http_client,
+            indicators_cache=context["indicators_cache"],
+            **sync_args,
+        )
+        if on_sync is not None:
+            on_sync(r)
+        return _written_by_sync(r, context["manifest"], sync_args.get("state_file"))
+
+    watch(manifest_path.parent, _sync, interval, debounce, stop, initial=True)
+
+
+def watch_load(
+    manifest: Path,
+    sparql_endpoint: str,
+    sparql_username: str | None = None,
+    sparql_password: str | None = None,
+    timeout: int = 60,
+    parse_workers: int = 1,
+    on_load: Callable[[dict | None], None] | None = None,
+    interval: float = 1.0,
+    debounce: float = 0.5,
+    stop: threading.Event | None = None,
+) -> None:
+    """Loads a Manifest into a SPARQL Endpoint and then keeps it up to date as its files change, until stop is set.
+
+    The whole Manifest is loaded again only when the Manifest file itself changes. Otherwise, changed artifacts are
+    pushed with a sync that never updates local files, so only they are uploaded. Changes to files that are neither
+    the Manifest nor RDF are ignored. on_load is called after each, with the sync's result, or None for full loads.
+    parse_workers is passed to load()."""
+    manifest_path = Path(manifest).resolve()
+    http_client = make_httpx_client(sparql_username, sparql_password, timeout)
+    context = {}
+
+    def _load(changed: set[Path]):
+        if len(changed) > 0 and not _affects_manifest(changed, manifest_path):
+            return
+        manifest_stat = _stat(manifest_path)
+        if context.get("manifest_stat") != manifest_stat:
+            context["manifest"] = get_manifest_paths_and_graph(manifest_path)
+            context["indicators_cache"] = {}
+            load(
+                context["manifest"],
+                sparql_endpoint=sparql_endpoint,
+                sparql_username=sparql_username,
+                sparql_password=sparql_password,
+                timeout=timeout,
+                parse_workers=parse_workers,
+            )
+            context["manifest_stat"] = manifest_stat
+            r = None
+        else:
+            r = sync(
+                context["manifest"],
+                sparql_endpoint,
+                http_client,
+                update_local=False,
+                add_local=False,
+                indicators_cache=context["indicators_cache"],
+            )
+        if on_load is not None:
+            on_load(r)
+
+    watch(manifest_path.parent, _load, interval, debounce, stop, initial=True)
@@ -1,14 +1,17 @@
+import gzip
+import shutil
 import warnings
 from pathlib import Path
 
 import httpx
 import pytest
-from kurra.db.gsp import upload, delete
+from kurra.db.gsp import delete, upload
 from kurra.sparql import query
-from rdflib import Dataset, URIRef
+from kurra.utils import load_graph
+from rdflib import Dataset, Graph, URIRef
 from typer.testing import CliRunner
 
-from prezmanifest.loader import ReturnDatatype, load
+from prezmanifest.loader import ReturnDatatype, load, plan
 
 runner = CliRunner()
 
@@ -266,3 +269,134 @@ def test_load_returns_dataset():
 #     count = int(r[0]["count"])
 #
 #     assert count == 5
+
+
+def test_load_parse_workers():
+    manifest = Path(__file__).parent / "demo-vocabs" / "manifest-mainEntity.ttl"
+    manifest_tuple = (manifest, manifest.parent.resolve(), load_graph(manifest))
+
+    ds_serial = load(manifest_tuple, return_data_type=ReturnDatatype.dataset)
+    ds_pooled = load(
+        manifest_tuple, return_data_type=ReturnDatatype.dataset, parse_workers=2
+    )
+
+    assert len(ds_pooled) == len(ds_serial)
+    assert sorted(g.identifier for g in ds_pooled.graphs()) == sorted(
+        g.identifier for g in ds_serial.graphs()
+    )
+
+
+def test_load_compressed_and_line_oriented_artifacts(tmp_path):
+    demo = Path(__file__).parent / "demo-vocabs"
+    shutil.copy(demo / "catalogue.ttl", tmp_path / "catalogue.ttl")
+    (tmp_path / "vocabs").mkdir()
+    (tmp_path / "vocabs" / "image-test.nt.gz").write_bytes(
+        gzip.compress(
+            Graph()
+            .parse(demo / "vocabs" / "image-test.ttl")
+            .serialize(format="nt", encoding="utf-8")
+        )
+    )
+    d = Dataset()
+    d.graph(URIRef("https://example.com/demo-vocabs/language-test")).parse(
+        demo / "vocabs" / "language-test.ttl"
+    )
+    d.serialize(tmp_path / "vocabs" / "language-test.nq", format="nquads")
+    manifest = tmp_path / "manifest.ttl"
+    manifest.write_text(
+        """
+        PREFIX mrr: <https://prez.dev/ManifestResourceRoles/>
+        PREFIX prez: <https://prez.dev/>
+        PREFIX prof: <http://www.w3.org/ns/dx/prof/>
+
+        []
+            a prez:Manifest ;
+            prof:hasResource
+                [
+                    prof:hasArtifact "catalogue.ttl" ;
+                    prof:hasRole mrr:CatalogueData ;
+                ] ,
+                [
+                    prof:hasArtifact "vocabs/*" ;
+                    prof:hasRole mrr:ResourceData ;
+                ] ;
+        .
+        """
+    )
+
+    ds = load(
+        (manifest, tmp_path, load_graph(manifest)),
+        return_data_type=ReturnDatatype.dataset,
+    )
+
+    graph_ids = [x.identifier for x in ds.graphs()]
+    assert URIRef("https://example.com/demo-vocabs/image-test") in graph_ids
+    assert URIRef("https://example.com/demo-vocabs/language-test") in graph_ids
+
+
+def test_load_merges_label_files(tmp_path):
+    demo = Path(__file__).parent / "demo-vocabs"
+    shutil.copy(demo / "catalogue.ttl", tmp_path / "catalogue.ttl")
+    (tmp_path / "labels").mkdir()
+    (tmp_path / "labels" / "a.ttl").write_text(
+        '<http://example.com/a> <http://www.w3.org/2000/01/rdf-schema#label> "A" .'
+    )
+    (tmp_path / "labels" / "b.ttl").write_text(
+        '<http://example.com/b> <http://www.w3.org/2000/01/rdf-schema#label> "B" .'
+    )
+    manifest = tmp_path / "manifest.ttl"
+    manifest.write_text(
+        """
+        PREFIX mrr: <https://prez.dev/ManifestResourceRoles/>
+        PREFIX prez: <https://prez.dev/>
+        PREFIX prof: <http://www.w3.org/ns/dx/prof/>
+
+        []
+            a prez:Manifest ;
+            prof:hasResource
+                [
+                    prof:hasArtifact "catalogue.ttl" ;
+                    prof:hasRole mrr:CatalogueData ;
+                ] ,
+                [
+                    prof:hasArtifact "labels/*.ttl" ;
+                    prof:hasRole mrr:IncompleteCatalogueAndResourceLabels ;
+                ] ;
+        .
+        """
+    )
+    manifest_tuple = (manifest, tmp_path, load_graph(manifest))
+
+    ds = load(manifest_tuple, return_data_type=ReturnDatatype.dataset)
+    assert len(ds.graph(URIRef("http://background"))) == 2
+
+    graphs = {g["graph"]: g for g in plan(manifest_tuple)["graphs"]}
+    assert len(graphs["http://background"]["files"]) == 2
+    assert graphs["http://background"]["requests"] == 1
+
+
+def test_plan():
+    manifest = Path(__file__).parent / "demo-vocabs" / "manifest.ttl"
+    manifest_tuple = (manifest, manifest.parent.resolve(), load_graph(manifest))
+
+    p = plan(manifest_tuple)
+    graphs = {g["graph"]: g for g in p["graphs"]}
+
+    assert (
+        graphs["https://example.com/demo-vocabs-catalogue"]["role"] == "CatalogueData"
+    )
+    assert graphs["https://example.com/demo-vocabs/image-test"]["triples"] == 29
+    assert not graphs["https://example.com/demo-vocabs/image-test"]["triples_estimated"]
+    assert "http://background" in graphs
+    assert "https://olis.dev/SystemGraph" in graphs
+    # including the System Graph upload and its content hashes update
+    assert graphs["https://olis.dev/SystemGraph"]["requests"] == 2
+    assert p["totals"]["requests"] == 6
+
+    # without parsing, triple counts are estimated and time is estimated from the profile
+    p2 = plan(manifest_tuple, {"upload_bytes_per_second": 1000}, parse=False)
+    assert p2["totals"]["bytes"] == p["totals"]["bytes"]
+    assert p2["totals"]["seconds"] > p["totals"]["seconds"]
+    assert all(
+        g["triples_estimated"] for g in p2["graphs"] if g["role"] != "SystemGraph"
+    )
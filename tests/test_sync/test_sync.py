@@ -8,7 +8,7 @@ from kurra.sparql import query
 from typer.testing import CliRunner
 
 from prezmanifest.loader import load
-from prezmanifest.syncer import sync, make_catalogue
+from prezmanifest.syncer import make_catalogue, plan_sync, sync
 from prezmanifest.utils import artifact_file_name_from_graph_id
 from rdflib import URIRef, RDF, SDO, Graph
 from rdflib.compare import isomorphic
@@ -82,6 +82,200 @@ def test_sync(sparql_endpoint):
         f.unlink()
 
 
+def test_sync_concurrency(sparql_endpoint):
+    MANIFEST_FILE_LOCAL = Path(__file__).parent / "local/manifest.ttl"
+    MANIFEST_FILE_REMOTE = Path(__file__).parent / "remote/manifest.ttl"
+    MANIFEST_ROOT = Path(__file__).parent / "local"
+
+    # make copies of files that will be overwritten
+    shutil.copy(MANIFEST_FILE_LOCAL, MANIFEST_FILE_LOCAL.with_suffix(".ttx"))
+    shutil.copy(MANIFEST_ROOT / "catalogue.ttl", MANIFEST_ROOT / "catalogue.ttx")
+    shutil.copy(MANIFEST_ROOT / "artifact6.ttl", MANIFEST_ROOT / "artifact6.ttx")
+
+    # ensure the SPARQL store's clear
+    query(sparql_endpoint, "DROP ALL")
+
+    # load it with remote data
+    load(MANIFEST_FILE_REMOTE, sparql_endpoint)
+
+    a = sync(MANIFEST_FILE_LOCAL, sparql_endpoint, concurrency=4, transaction_size=2)
+
+    # actions taken are timed, others aren't
+    assert "duration" in a[str(MANIFEST_ROOT / "artifact4.ttl")]
+    assert "duration" in a[str(MANIFEST_ROOT / "artifact5.ttl")]
+    assert "duration" in a[str(MANIFEST_ROOT / "artifact6.ttl")]
+    assert "duration" in a["http://example.com/dataset/8"]
+    assert "duration" not in a[str(MANIFEST_ROOT / "artifacts/artifact1.ttl")]
+
+    # run sync again, performing no actions to just get updated status
+    a = sync(
+        MANIFEST_FILE_LOCAL, sparql_endpoint, httpx.Client(), False, False, False, False
+    )
+
+    for k, v in a.items():
+        assert v["direction"] == "same", k
+
+    # tidy up
+    shutil.move(MANIFEST_ROOT / "manifest.ttx", MANIFEST_FILE_LOCAL)
+    shutil.move(MANIFEST_ROOT / "catalogue.ttx", MANIFEST_ROOT / "catalogue.ttl")
+    shutil.move(MANIFEST_ROOT / "artifact6.ttx", MANIFEST_ROOT / "artifact6.ttl")
+    for f in MANIFEST_ROOT.glob("http--*.ttl"):
+        f.unlink()
+
+
+def test_sync_state_file(sparql_endpoint, tmp_path, monkeypatch):
+    MANIFEST_FILE_LOCAL = Path(__file__).parent / "local/manifest.ttl"
+    MANIFEST_FILE_REMOTE = Path(__file__).parent / "remote/manifest.ttl"
+    MANIFEST_ROOT = Path(__file__).parent / "local"
+    STATE_FILE = tmp_path / "sync-state.json"
+
+    # make copies of files that will be overwritten
+    shutil.copy(MANIFEST_FILE_LOCAL, MANIFEST_FILE_LOCAL.with_suffix(".ttx"))
+    shutil.copy(MANIFEST_ROOT / "catalogue.ttl", MANIFEST_ROOT / "catalogue.ttx")
+    shutil.copy(MANIFEST_ROOT / "artifact6.ttl", MANIFEST_ROOT / "artifact6.ttx")
+
+    # ensure the SPARQL store's clear
+    query(sparql_endpoint, "DROP ALL")
+
+    # load it with remote data
+    load(MANIFEST_FILE_REMOTE, sparql_endpoint)
+
+    sync(MANIFEST_FILE_LOCAL, sparql_endpoint, state_file=STATE_FILE)
+    assert STATE_FILE.is_file()
+
+    # with nothing changed since, only the System Graph's modified date is queried and only the artifact files the
+    # sync wrote are read again
+    reads = []
+    get_version_indicators_local = prezmanifest.utils.get_version_indicators_local
+    monkeypatch.setattr(
+        prezmanifest.utils,
+        "get_version_indicators_local",
+        lambda m, a, vi: (
+            reads.append(Path(a).name) or get_version_indicators_local(m, a, vi)
+        ),
+    )
+    requests = []
+    c = httpx.Client(event_hooks={"request": [requests.append]})
+    a = sync(MANIFEST_FILE_LOCAL, sparql_endpoint, c, state_file=STATE_FILE)
+    assert len(requests) == 1
+    assert "artifact4.ttl" not in reads
+    for k, v in a.items():
+        assert v["direction"] == "same", k
+
+    # a load changes the remote, so the state is no longer used
+    load(MANIFEST_FILE_REMOTE, sparql_endpoint)
+    requests.clear()
+    a = sync(
+        MANIFEST_FILE_LOCAL,
+        sparql_endpoint,
+        c,
+        False,
+        False,
+        False,
+        False,
+        state_file=STATE_FILE,
+    )
+    assert len(requests) > 1
+    # artifact4 is unchanged locally since the last sync, so the reloaded remote content is downloaded
+    assert a[str(MANIFEST_ROOT / "artifact4.ttl")]["direction"] == "download"
+
+    # tidy up
+    shutil.move(MANIFEST_ROOT / "manifest.ttx", MANIFEST_FILE_LOCAL)
+    shutil.move(MANIFEST_ROOT / "catalogue.ttx", MANIFEST_ROOT / "catalogue.ttl")
+    shutil.move(MANIFEST_ROOT / "artifact6.ttx", MANIFEST_ROOT / "artifact6.ttl")
+    for f in MANIFEST_ROOT.glob("http--*.ttl"):
+        f.unlink()
+
+
+class _RejectingTransport(httpx.HTTPTransport):
+    """Rejects the replacement, or download, of some graphs, passing all other requests on"""
+
+    def __init__(self, graph_iris: list[str]):
+        super().__init__()
+        self.graph_iris = graph_iris
+
+    def handle_request(self, request):
+        if (
+            request.method in ["GET", "PUT"]
+            and request.url.params.get("graph") in self.graph_iris
+        ):
+            return httpx.Response(500, text="Rejected")
+        return super().handle_request(request)
+
+
+def test_sync_failed_upload(sparql_endpoint):
+    MANIFEST_FILE_LOCAL = Path(__file__).parent / "local/manifest.ttl"
+    MANIFEST_FILE_REMOTE = Path(__file__).parent / "remote/manifest.ttl"
+    MANIFEST_ROOT = Path(__file__).parent / "local"
+
+    # make copies of files that will be overwritten
+    shutil.copy(MANIFEST_FILE_LOCAL, MANIFEST_FILE_LOCAL.with_suffix(".ttx"))
+    shutil.copy(MANIFEST_ROOT / "catalogue.ttl", MANIFEST_ROOT / "catalogue.ttx")
+    shutil.copy(MANIFEST_ROOT / "artifact6.ttl", MANIFEST_ROOT / "artifact6.ttx")
+
+    # ensure the SPARQL store's clear
+    query(sparql_endpoint, "DROP ALL")
+
+    # load it with remote data
+    load(MANIFEST_FILE_REMOTE, sparql_endpoint)
+
+    # a rejected upload, and a download that raises an error, fail without stopping the sync
+    transport = _RejectingTransport(
+        ["http://example.com/dataset/2", "http://example.com/dataset/6"]
+    )
+    a = sync(MANIFEST_FILE_LOCAL, sparql_endpoint, httpx.Client(transport=transport))
+    assert a[str(MANIFEST_ROOT / "artifacts/artifact2.ttl")]["direction"] == "failed"
+    assert a[str(MANIFEST_ROOT / "artifacts/artifact2.ttl")]["error"] == "500: Rejected"
+    assert a[str(MANIFEST_ROOT / "artifacts/artifact3.ttl")]["direction"] == "upload"
+    assert a[str(MANIFEST_ROOT / "artifact6.ttl")]["direction"] == "failed"
+    assert "Rejected" in a[str(MANIFEST_ROOT / "artifact6.ttl")]["error"]
+    assert a["http://example.com/dataset/8"]["direction"] == "add-locally"
+
+    # the failed upload's content hash isn't recorded, so it's retried
+    a = sync(
+        MANIFEST_FILE_LOCAL, sparql_endpoint, httpx.Client(), False, False, False, False
+    )
+    assert a[str(MANIFEST_ROOT / "artifacts/artifact2.ttl")]["direction"] == "upload"
+    assert a[str(MANIFEST_ROOT / "artifacts/artifact3.ttl")]["direction"] == "same"
+
+    # tidy up
+    shutil.move(MANIFEST_ROOT / "manifest.ttx", MANIFEST_FILE_LOCAL)
+    shutil.move(MANIFEST_ROOT / "catalogue.ttx", MANIFEST_ROOT / "catalogue.ttl")
+    shutil.move(MANIFEST_ROOT / "artifact6.ttx", MANIFEST_ROOT / "artifact6.ttl")
+    for f in MANIFEST_ROOT.glob("http--*.ttl"):
+        f.unlink()
+
+
+def test_plan_sync(sparql_endpoint):
+    MANIFEST_FILE_LOCAL = Path(__file__).parent / "local/manifest.ttl"
+    MANIFEST_FILE_REMOTE = Path(__file__).parent / "remote/manifest.ttl"
+    MANIFEST_ROOT = Path(__file__).parent / "local"
+
+    # ensure the SPARQL store's clear
+    query(sparql_endpoint, "DROP ALL")
+
+    # load it with remote data
+    load(MANIFEST_FILE_REMOTE, sparql_endpoint)
+
+    manifest_before = MANIFEST_FILE_LOCAL.read_text()
+    p = plan_sync(MANIFEST_FILE_LOCAL, sparql_endpoint)
+
+    # nothing is written
+    assert MANIFEST_FILE_LOCAL.read_text() == manifest_before
+    assert len(list(MANIFEST_ROOT.glob("http--*.ttl"))) == 0
+
+    actions = {a["main_entity"]: a for a in p["actions"]}
+    assert actions["http://example.com/dataset/4"]["direction"] == "upload"
+    assert actions["http://example.com/dataset/5"]["direction"] == "add-remotely"
+    assert actions["http://example.com/dataset/6"]["direction"] == "download"
+    assert actions["http://example.com/dataset/8"]["direction"] == "add-locally"
+    assert actions["http://example.com/dataset/8"]["triples"] > 0
+    assert "http://example.com/dataset/1" not in actions
+    # artifact5 is added remotely, so the catalogue is uploaded too, as sync() plans it
+    assert [a["kind"] for a in p["actions"]][-2:] == ["catalogue", "system"]
+    assert p["totals"]["requests"] == sum(a["requests"] for a in p["actions"])
+
+
 def test_sync_cli(sparql_endpoint):
     MANIFEST_FILE_REMOTE = Path(__file__).parent / "remote/manifest.ttl"
 
@@ -0,0 +1,109 @@
+"""Tests for the Azure Service Bus event client, against in-memory stand-ins for Service Bus."""
+
+import pytest
+from azure.servicebus import ServiceBusMessageBatch
+from azure.servicebus.exceptions import MessageSizeExceededError
+
+from prezmanifest.event.asb_client import (
+    AsyncServiceBusTransport,
+    AzureServiceBusEventClient,
+)
+
+
+class _Batch(ServiceBusMessageBatch):
+    def __init__(self, max_size_in_bytes: int):
+        super().__init__(max_size_in_bytes=max_size_in_bytes)
+        self.messages = []
+
+    def add_message(self, message):
+        super().add_message(message)
+        self.messages.append(message)
+
+
+class InMemoryTransport:
+    def __init__(self, max_size_in_bytes: int = 4000):
+        self.max_size_in_bytes = max_size_in_bytes
+        self.sent = []
+        self.batches_created = 0
+        self.closed = False
+
+    def create_message_batch(self):
+        self.batches_created += 1
+        return _Batch(self.max_size_in_bytes)
+
+    def send_messages(self, message):
+        assert not self.closed
+        self.sent.append([str(m) for m in message.messages])
+
+    def close(self):
+        self.closed = True
+
+
+class InMemoryAsyncClient:
+    def __init__(self):
+        self.transport = InMemoryTransport()
+
+    def get_topic_sender(self, topic: str):
+        transport = self.transport
+
+        class _Sender:
+            async def create_message_batch(self):
+                return transport.create_message_batch()
+
+            async def send_messages(self, message):
+                transport.send_messages(message)
+
+            async def close(self):
+                transport.close()
+
+        return _Sender()
+
+    async def close(self):
+        pass
+
+
+def _client(transport) -> AzureServiceBusEventClient:
+    return AzureServiceBusEventClient(
+        "", "topic", "subscription", "session", transport=transport
+    )
+
+
+def test_events_are_batched_in_order():
+    transport = InMemoryTransport()
+    payloads = [f"TX .\nA <urn:s{i}> <urn:p> {'x' * 500} .\nTC ." for i in range(20)]
+
+    with _client(transport) as client:
+        for payload in payloads:
+            client.create_event(payload)
+        # nothing is sent until a batch is full
+        assert len(transport.sent) < transport.batches_created
+
+    assert transport.closed
+    assert len(transport.sent) > 1
+    assert all(len(batch) > 1 for batch in transport.sent[:-1])
+    assert [m for batch in transport.sent for m in batch] == payloads
+
+
+def test_event_too_large_for_a_batch():
+    transport = InMemoryTransport(max_size_in_bytes=1000)
+
+    with pytest.raises(MessageSizeExceededError), _client(transport) as client:
+        client.create_event("small")
+        client.create_event("x" * 2000)
+
+    # the events before are still sent
+    assert transport.sent == [["small"]]
+    assert transport.closed
+
+
+def test_events_are_sent_asynchronously():
+    async_client = InMemoryAsyncClient()
+    payloads = [f"event {i} " + "x" * 1000 for i in range(20)]
+
+    with _client(AsyncServiceBusTransport(async_client, "topic")) as client:
+        for payload in payloads:
+            client.create_event(payload)
+
+    assert async_client.transport.closed
+    assert len(async_client.transport.sent) > 1
+    assert [m for batch in async_client.transport.sent for m in batch] == payloads
@@ -1,6 +1,13 @@
 from rdflib import RDF, SDO, SKOS, BNode, Dataset, Literal, Namespace
 
-from prezmanifest.event.syncer import _generate_rdf_patch_body_diff
+from prezmanifest.event.syncer import (
+    CANON_MIN_PARALLEL_COMPONENTS,
+    _batch_components,
+    _evict_canon_cache,
+    _generate_canon_dataset,
+    _generate_rdf_patch_body_diff,
+    _split_bnode_components,
+)
 
 EX = Namespace("https://example.com/")
 
@@ -321,3 +328,86 @@ def test_blank_node_identity_preservation():
 
     # Should be empty (no additions or deletions)
     assert body == "", f"Expected empty patch body but got: {body}"
+
+
+def test_canon_cache(tmp_path):
+    """Test that cached canonical forms are reused, keep their blank node identifiers, and are evicted."""
+    ds = Dataset()
+    g = ds.graph(EX.graph1)
+    version = BNode()
+    g.add((EX.resource, SDO.version, version))
+    g.add((version, SDO.value, Literal("v1")))
+    keys = {EX.graph1: "ab" * 32}
+
+    canon_ds = _generate_canon_dataset(ds, tmp_path, keys)
+    assert len(list(tmp_path.glob("*/*.nt.gz"))) == 1
+
+    # a hit is read from the cache, not canonicalised again, so another graph with
+    # the same key gives the cached form
+    other_ds = Dataset()
+    other_ds.graph(EX.graph1).add((EX.other, SDO.value, Literal("v2")))
+    cached_ds = _generate_canon_dataset(other_ds, tmp_path, keys)
+    assert set(cached_ds.quads()) == set(canon_ds.quads())
+
+    _evict_canon_cache(tmp_path, 0)
+    assert len(list(tmp_path.glob("*/*.nt.gz"))) == 0
+
+
+def test_canonicalise_bnode_components():
+    """Test that only Blank Node components are canonicalised, separately, and that none are lost."""
+    ds = Dataset()
+    g = ds.graph(EX.graph1)
+    g.add((EX.resource, SDO.name, Literal("no blank nodes")))
+    # two connected blank nodes
+    outer = BNode()
+    inner = BNode()
+    g.add((EX.resource, EX.metadata, outer))
+    g.add((outer, EX.version, inner))
+    g.add((inner, SDO.value, Literal("v1")))
+    # two isomorphic components
+    for _ in range(2):
+        b = BNode()
+        g.add((EX.other, SDO.version, b))
+        g.add((b, SDO.value, Literal("same")))
+
+    ground, components = _split_bnode_components(g)
+    assert ground == [(EX.resource, SDO.name, Literal("no blank nodes"))]
+    assert sorted(len(c) for c in components) == [2, 2, 3]
+
+    canon_ds = _generate_canon_dataset(ds)
+    assert len(canon_ds.graph(EX.graph1)) == len(g)
+    assert set(_generate_canon_dataset(ds, canon_workers=2).quads()) == set(
+        canon_ds.quads()
+    )
+
+    # graphs of many components are canonicalised in batches, in worker processes, as they are in-process
+    ds3 = Dataset()
+    g3 = ds3.graph(EX.graph3)
+    for i in range(CANON_MIN_PARALLEL_COMPONENTS * 3):
+        b = BNode()
+        g3.add((EX[f"resource{i}"], SDO.version, b))
+        for j in range(i % 4 + 1):
+            g3.add((b, SDO.value, Literal(f"{i} {j}")))
+    assert set(_generate_canon_dataset(ds3, canon_workers=2).quads()) == set(
+        _generate_canon_dataset(ds3).quads()
+    )
+
+    # graphs without Blank Nodes are copied as they are
+    ds2 = Dataset()
+    ds2.graph(EX.graph2).add((EX.resource, SDO.name, Literal("no blank nodes")))
+    assert set(_generate_canon_dataset(ds2).quads()) == set(ds2.quads())
+
+
+def test_batch_components():
+    """Test that components are batched with roughly equal triple counts, each once."""
+    components = [[None] * n for n in [10, 1, 1, 4, 5, 1, 2]]
+
+    batches = _batch_components(components, 3)
+
+    assert sorted(c for batch in batches for c in batch) == list(range(7))
+    assert sorted(sum(len(components[c]) for c in batch) for batch in batches) == [
+        7,
+        7,
+        10,
+    ]
+    assert len(_batch_components(components[:2], 3)) == 2
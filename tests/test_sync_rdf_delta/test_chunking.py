@@ -1,8 +1,15 @@
 """Tests for RDF patch chunking functionality in the event syncer."""
 
+import threading
+
+import pytest
 from rdflib import RDF, Dataset, Literal, Namespace
 
+from prezmanifest.definednamespaces import OLIS
 from prezmanifest.event.syncer import (
+    _add_commit_hash_to_dataset,
+    _chunk_rdf_patch_lines,
+    _generate_ahead,
     _generate_rdf_patch_body_add,
     _generate_rdf_patch_body_diff,
     _rdf_patch_body_substr,
@@ -14,6 +21,21 @@ EX = Namespace("https://example.com/")
 CHUNK_SIZE = 838860  # 0.8 MB in bytes
 
 
+def _size(chunk: str) -> int:
+    return len(chunk.encode("utf-8"))
+
+
+def _statements(chunks: list[str]) -> list[str]:
+    """The statements of chunks, each of which must be a self-contained transaction."""
+    statements = []
+    for chunk in chunks:
+        lines = chunk.split("\n")
+        assert lines[0] == "TX ."
+        assert lines[-1] == "TC ."
+        statements.extend(lines[1:-1])
+    return statements
+
+
 def test_small_patch_single_chunk():
     """Test that a small RDF patch yields a single chunk."""
     # Create a simple RDF patch string
@@ -26,13 +48,13 @@ def test_small_patch_single_chunk():
 
 
 def test_empty_patch_body():
-    """Test that a patch with only TX and TC markers yields a single empty-ish chunk."""
-    patch = "TX .TC ."
+    """Test that a patch with only TX and TC markers yields a single empty transaction."""
+    patch = "TX .\nTC ."
 
     chunks = list(_rdf_patch_body_substr(patch))
 
     assert len(chunks) == 1
-    assert chunks[0] == "TX .TC ."
+    assert chunks[0] == "TX .\nTC ."
 
 
 def test_large_patch_multiple_chunks():
@@ -57,16 +79,12 @@ def test_large_patch_multiple_chunks():
 
     # Each chunk (except possibly the last) should be around CHUNK_SIZE
     for chunk in chunks[:-1]:
-        assert len(chunk) <= CHUNK_SIZE
+        assert _size(chunk) <= CHUNK_SIZE
         # Should be reasonably close to CHUNK_SIZE (allowing for newline breaks)
-        assert len(chunk) > CHUNK_SIZE * 0.8
+        assert _size(chunk) > CHUNK_SIZE * 0.8
 
-    # Verify that all chunks combined equal the original body
-    combined = "".join(chunks)
-    tx_pos = patch.find("TX .")
-    tc_pos = patch.find("TC .") + len("TC .")
-    expected_body = patch[tx_pos:tc_pos]
-    assert combined == expected_body
+    # Verify that all chunks' statements, in order, are the original body's
+    assert _statements(chunks) == triples.split("\n")
 
 
 def test_chunk_breaks_on_newlines():
@@ -84,55 +102,61 @@ def test_chunk_breaks_on_newlines():
 
     chunks = list(_rdf_patch_body_substr(patch))
 
-    # All chunks except the last should end with a newline
-    # (because we're breaking on newline boundaries)
-    for chunk in chunks[:-1]:
-        # The chunk should end with a newline character or be at the exact boundary
-        assert chunk.endswith("\n") or len(chunk) == CHUNK_SIZE
+    # All chunks should be whole statements in a transaction of their own
+    assert _statements(chunks) == lines
 
 
 def test_patch_exactly_at_chunk_boundary():
-    """Test behavior when patch body is exactly CHUNK_SIZE bytes."""
-    # Create a body exactly CHUNK_SIZE bytes
-    body_content = "A" * (CHUNK_SIZE - len("TX .") - len("TC ."))
-    patch = f"TX .{body_content}TC ."
+    """Test behavior when a chunk would be exactly CHUNK_SIZE bytes."""
+    # Create a statement that makes a transaction of exactly CHUNK_SIZE bytes
+    statement = "A" * (CHUNK_SIZE - len("TX .\n\nTC ."))
+    patch = f"TX .\n{statement}\nTC ."
 
     chunks = list(_rdf_patch_body_substr(patch))
 
-    # Should yield a single chunk since the body is exactly at the boundary
-    assert len(chunks) == 1
+    # Should yield a single chunk since it's exactly at the boundary
+    assert chunks == [patch]
+    assert _size(chunks[0]) == CHUNK_SIZE
 
 
 def test_patch_just_over_chunk_boundary():
-    """Test behavior when patch body is just over CHUNK_SIZE bytes."""
-    # Create a body just over CHUNK_SIZE
-    body_content = "A" * (CHUNK_SIZE + 100)
-    patch = f"TX .{body_content}TC ."
+    """Test behavior when the patch body is just over CHUNK_SIZE bytes."""
+    statement = "A" * (CHUNK_SIZE - len("TX .\n\nTC ."))
+    patch = f"TX .\n{statement}\nA .\nTC ."
 
     chunks = list(_rdf_patch_body_substr(patch))
 
     # Should yield two chunks
     assert len(chunks) == 2
-    # First chunk should be close to CHUNK_SIZE
-    assert len(chunks[0]) <= CHUNK_SIZE
-    # Second chunk should be small
-    assert len(chunks[1]) < 200
+    # First chunk should be exactly CHUNK_SIZE
+    assert _size(chunks[0]) == CHUNK_SIZE
+    # Second chunk should be the remaining statement
+    assert chunks[1] == "TX .\nA .\nTC ."
 
 
-def test_no_newlines_near_boundary():
-    """Test that chunking still works when there are no newlines near the boundary."""
-    # Create a large continuous string with no newlines
-    body_content = "A" * (CHUNK_SIZE * 2 + 1000)
-    patch = f"TX .{body_content}TC ."
+def test_statement_larger_than_chunk():
+    """Test that a statement too large for a chunk of its own is not split."""
+    patch = f"TX .\n{'A' * (CHUNK_SIZE * 2 + 1000)}\nTC ."
 
-    chunks = list(_rdf_patch_body_substr(patch))
+    with pytest.raises(ValueError):
+        list(_rdf_patch_body_substr(patch))
 
-    # Should yield multiple chunks
-    assert len(chunks) >= 2
 
-    # Each chunk should be at most CHUNK_SIZE (since there are no newlines to break on)
+def test_chunks_are_sized_in_bytes():
+    """Test that chunks are sized by their UTF-8 encoding, not their characters."""
+    # 10 characters but 14 bytes each
+    lines = ["TX ."] + [f"A {i:02} 日本語" for i in range(10)] + ["TC ."]
+
+    chunks = list(_chunk_rdf_patch_lines(lines, chunk_size=50))
+
     for chunk in chunks:
-        assert len(chunk) <= CHUNK_SIZE
+        assert _size(chunk) <= 50
+    assert len(chunks) == 5
+    assert _statements(chunks) == lines[1:-1]
+
+    # fits by characters but not by bytes
+    with pytest.raises(ValueError):
+        list(_chunk_rdf_patch_lines(["A " + "é" * 30], chunk_size=50))
 
 
 def test_generate_rdf_patch_body_add_returns_generator():
@@ -215,12 +239,10 @@ def test_large_dataset_yields_multiple_chunks():
 
     # Verify all chunks are within size limits
     for chunk in chunks:
-        assert len(chunk) <= CHUNK_SIZE * 1.1  # Allow small overflow for newline breaks
+        assert _size(chunk) <= CHUNK_SIZE
 
-    # Verify combined chunks form valid patch structure
-    combined = "".join(chunks)
-    assert combined.startswith("TX .")
-    assert combined.endswith("TC .")
+    # Verify each chunk is a valid patch of its own
+    assert len(_statements(chunks)) == num_triples
 
 
 def test_chunk_preserves_patch_integrity():
@@ -250,9 +272,9 @@ def test_chunk_preserves_patch_integrity():
     # Should contain both additions and deletions
     assert "\nA " in combined or "\nD " in combined
 
-    # Count the transaction markers - should have exactly one TX and one TC
-    assert combined.count("TX .") == 1
-    assert combined.count("TC .") == 1
+    # Count the transaction markers - should have exactly one TX and one TC per chunk
+    assert combined.count("TX .") == len(chunks)
+    assert combined.count("TC .") == len(chunks)
 
 
 def test_chunk_size_calculation():
@@ -278,12 +300,8 @@ def test_very_large_patch_many_chunks():
     assert len(chunks) >= 5
     assert len(chunks) <= 8  # Allow some variance due to newline breaking
 
-    # Verify total size matches
-    total_size = sum(len(chunk) for chunk in chunks)
-    expected_body_size = len(
-        patch[patch.find("TX .") : patch.find("TC .") + len("TC .")]
-    )
-    assert total_size == expected_body_size
+    # Verify all statements are kept
+    assert len(_statements(chunks)) == num_lines
 
 
 def test_patch_with_unicode_characters():
@@ -296,11 +314,89 @@ def test_patch_with_unicode_characters():
     for i in range(100):
         g.add((EX[f"subject{i}"], EX.label, Literal(f"日本語テキスト {i} émojis 🎉🎊")))
 
-    chunks = list(_generate_rdf_patch_body_add(ds))
+    chunks = list(_generate_rdf_patch_body_add(ds, chunk_size=2000))
 
-    # Should successfully chunk without errors
-    assert len(chunks) >= 1
+    # Should successfully chunk without errors, by bytes
+    assert len(chunks) > 1
+    for chunk in chunks:
+        assert _size(chunk) <= 2000
+    assert len(_statements(chunks)) == 100
 
     # Verify unicode is preserved
     combined = "".join(chunks)
     assert "日本語" in combined or "\\u" in combined  # Either raw or escaped unicode
+
+
+def test_system_graph_statements_are_in_the_last_chunk():
+    """Test that the commit hash in the Olis System Graph is only sent once all other chunks are, as each chunk is
+    committed on its own."""
+    previous_ds = Dataset()
+    previous_ds.graph(OLIS.SystemGraph).add((EX.vg, RDF.type, OLIS.VirtualGraph))
+    _add_commit_hash_to_dataset("abc", previous_ds)
+
+    ds = Dataset()
+    ds.graph(OLIS.SystemGraph).add((EX.vg, RDF.type, OLIS.VirtualGraph))
+    _add_commit_hash_to_dataset("def", ds)
+    g = ds.graph(EX.graph1)
+    for i in range(100):
+        g.add((EX[f"subject{i}"], EX.label, Literal(f"value {i}")))
+
+    for chunks in (
+        list(_generate_rdf_patch_body_add(ds, chunk_size=2000)),
+        list(_generate_rdf_patch_body_diff(ds, previous_ds, chunk_size=2000)),
+    ):
+        assert len(chunks) > 1
+        for chunk in chunks:
+            assert _size(chunk) <= 2000
+        assert str(OLIS.SystemGraph) not in "".join(chunks[:-1])
+        assert '"def"' in chunks[-1]
+
+    statements = _statements(
+        list(_generate_rdf_patch_body_diff(ds, previous_ds, chunk_size=2000))
+    )
+    deletions = [s for s in statements if s.startswith("D ")]
+    assert len(deletions) == 1 and '"abc"' in deletions[0]
+    assert len([s for s in statements if s.startswith("A ")]) == 101
+
+
+def test_system_graph_statements_larger_than_chunk():
+    """Test that the System Graph statements must fit in one chunk together."""
+    lines = [f'A <urn:s> <urn:p> "{i}" <{OLIS.SystemGraph}> .' for i in range(100)]
+
+    with pytest.raises(ValueError):
+        list(_chunk_rdf_patch_lines(lines, 1000))
+
+
+def test_chunks_are_generated_ahead_of_sending():
+    """Test that chunks are generated in the background while each is used, and are yielded in order."""
+    generated_ahead = threading.Event()
+    closed = threading.Event()
+
+    def _chunks():
+        try:
+            for i in range(10):
+                if i == 2:
+                    generated_ahead.set()
+                yield f"chunk {i}"
+        finally:
+            closed.set()
+
+    chunks = _generate_ahead(_chunks(), max_queued=2)
+    assert next(chunks) == "chunk 0"
+    # the next chunks are generated without waiting for the first to be used
+    assert generated_ahead.wait(5)
+    assert list(chunks) == [f"chunk {i}" for i in range(1, 10)]
+    assert closed.is_set()
+
+
+def test_chunk_generation_errors_are_raised_in_order():
+    """Test that an error generating a chunk is raised after the chunks before it are yielded."""
+
+    def _chunks():
+        yield "chunk 0"
+        raise ValueError("failed")
+
+    chunks = _generate_ahead(_chunks())
+    assert next(chunks) == "chunk 0"
+    with pytest.raises(ValueError):
+        next(chunks)
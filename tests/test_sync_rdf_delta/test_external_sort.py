@@ -0,0 +1,81 @@
+"""Tests for the out-of-core, external sort, dataset diff in the event syncer."""
+
+import pytest
+from rdflib import SDO, BNode, Dataset, Literal, Namespace
+
+from prezmanifest.event.syncer import (
+    _external_sort,
+    _generate_rdf_patch_body_add,
+    _generate_rdf_patch_body_diff,
+    _merge_join,
+)
+
+EX = Namespace("https://example.com/")
+
+
+def test_external_sort(tmp_path):
+    lines = [f"line {i % 500:04}" for i in range(2000)]
+
+    # small enough to spill many runs to disk
+    assert list(_external_sort(lines, tmp_path, 1000)) == sorted(set(lines))
+    # the run files are removed once merged
+    assert list(tmp_path.iterdir()) == []
+
+    # large enough to sort in memory
+    assert list(_external_sort(lines, tmp_path, 10**9)) == sorted(set(lines))
+
+    # the run files are removed however sorting ends
+    with pytest.raises(ValueError):
+        list(_external_sort(lines, tmp_path, 1000, tmp_max_bytes=1000))
+    assert list(tmp_path.iterdir()) == []
+    sorted_lines = _external_sort(lines, tmp_path, 1000)
+    next(sorted_lines)
+    sorted_lines.close()
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_merge_join():
+    previous = ["a", "b", "d", "f"]
+    current = ["b", "c", "d", "e", "g"]
+    assert list(_merge_join(previous, current)) == [
+        ("D", "a"),
+        ("A", "c"),
+        ("A", "e"),
+        ("D", "f"),
+        ("A", "g"),
+    ]
+    assert list(_merge_join([], ["a"])) == [("A", "a")]
+    assert list(_merge_join(["a"], [])) == [("D", "a")]
+
+
+def test_external_sort_diff_matches_in_memory_diff(tmp_path):
+    ds1 = Dataset()
+    g1 = ds1.graph(EX.graph1)
+    for i in range(1000):
+        g1.add((EX[f"s{i}"], EX.p, Literal(f"value {i}")))
+    version1 = BNode()
+    g1.add((EX.resource, SDO.version, version1))
+    g1.add((version1, SDO.value, Literal("v1")))
+
+    ds2 = Dataset()
+    g2 = ds2.graph(EX.graph1)
+    for i in range(500, 1500):
+        g2.add((EX[f"s{i}"], EX.p, Literal(f"value {i}")))
+    version2 = BNode()
+    g2.add((EX.resource, SDO.version, version2))
+    g2.add((version2, SDO.value, Literal("v2")))
+    ds2.graph(EX.graph2).add((EX.s, EX.p, EX.o))
+
+    in_memory = "".join(_generate_rdf_patch_body_diff(ds2, ds1))
+    external = "".join(
+        _generate_rdf_patch_body_diff(
+            ds2, ds1, sort_buffer_bytes=10_000, sort_tmp_dir=tmp_path
+        )
+    )
+    assert external == in_memory
+    assert external.count("\nD ") == 501
+    assert external.count("\nA ") == 502
+
+    assert "".join(
+        _generate_rdf_patch_body_add(ds2, sort_buffer_bytes=10_000)
+    ) == "".join(_generate_rdf_patch_body_add(ds2))
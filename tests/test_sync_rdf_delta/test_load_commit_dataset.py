@@ -0,0 +1,154 @@
+import shutil
+from pathlib import Path
+
+import httpx
+from git import Repo
+from rdflib import URIRef
+
+from prezmanifest.definednamespaces import OLIS
+from prezmanifest.event.syncer import (
+    _changed_paths,
+    _load_commit_dataset,
+    _resolve_manifest_files_in_tree,
+    sync_rdf_delta,
+)
+
+DEMO_VOCABS = Path(__file__).parent.parent / "demo-vocabs"
+
+
+def _make_repo(tmp_path: Path) -> tuple[Repo, str]:
+    """Makes a repo with a Manifest in data/ and two commits, the second of which removes a vocab. Returns the repo and
+    the first commit's hash."""
+    data = tmp_path / "data"
+    shutil.copytree(DEMO_VOCABS / "vocabs", data / "vocabs")
+    shutil.copytree(DEMO_VOCABS / "_background", data / "_background")
+    shutil.copy(DEMO_VOCABS / "catalogue.ttl", data / "catalogue.ttl")
+    (data / "manifest.ttl").write_text(
+        """
+        PREFIX mrr: <https://prez.dev/ManifestResourceRoles/>
+        PREFIX prez: <https://prez.dev/>
+        PREFIX prof: <http://www.w3.org/ns/dx/prof/>
+
+        []
+            a prez:Manifest ;
+            prof:hasResource
+                [
+                    prof:hasArtifact "catalogue.ttl" ;
+                    prof:hasRole mrr:CatalogueData ;
+                ] ,
+                [
+                    prof:hasArtifact "vocabs/*.ttl" ;
+                    prof:hasRole mrr:ResourceData ;
+                ] ,
+                [
+                    prof:hasArtifact "_background/labels.ttl" ;
+                    prof:hasRole mrr:CompleteCatalogueAndResourceLabels ;
+                ] ;
+        .
+        """
+    )
+    (tmp_path / "README.md").write_text("not part of the Manifest")
+
+    repo = Repo.init(tmp_path)
+    repo.index.add(["data", "README.md"])
+    first = repo.index.commit("first").hexsha
+    repo.index.remove(["data/vocabs/language-test.ttl"], working_tree=True)
+    repo.index.commit("second")
+    return repo, first
+
+
+def test_resolve_manifest_files_in_tree(tmp_path):
+    repo, first = _make_repo(tmp_path)
+
+    assert sorted(
+        _resolve_manifest_files_in_tree(repo.commit(first), "data/manifest.ttl")
+    ) == [
+        "data/_background/labels.ttl",
+        "data/catalogue.ttl",
+        "data/manifest.ttl",
+        "data/vocabs/image-test.ttl",
+        "data/vocabs/language-test.ttl",
+    ]
+    assert sorted(
+        _resolve_manifest_files_in_tree(repo.head.commit, "data/manifest.ttl")
+    ) == [
+        "data/_background/labels.ttl",
+        "data/catalogue.ttl",
+        "data/manifest.ttl",
+        "data/vocabs/image-test.ttl",
+    ]
+
+
+def test_load_commit_dataset(tmp_path):
+    repo, first = _make_repo(tmp_path)
+
+    ds = _load_commit_dataset(repo, first, tmp_path / "data" / "manifest.ttl")
+
+    language_test = URIRef("https://example.com/demo-vocabs/language-test")
+    assert language_test in [g.identifier for g in ds.graphs()]
+
+    # the working tree & HEAD are untouched
+    assert not repo.head.is_detached
+    assert not (tmp_path / "data" / "vocabs" / "language-test.ttl").exists()
+
+
+def test_load_commit_dataset_changed_paths(tmp_path):
+    repo, first = _make_repo(tmp_path)
+    manifest = tmp_path / "data" / "manifest.ttl"
+
+    changed_paths = _changed_paths(repo, first)
+    assert changed_paths == {"data/vocabs/language-test.ttl"}
+    assert _changed_paths(repo, "0" * 40) is None
+
+    # only the changed file's graph, the catalogue & the System Graph are loaded
+    previous_ds = _load_commit_dataset(repo, first, manifest, changed_paths)
+    assert sorted(str(g.identifier) for g in previous_ds.graphs()) == [
+        "https://example.com/demo-vocabs-catalogue",
+        "https://example.com/demo-vocabs/language-test",
+        str(OLIS.SystemGraph),
+        "urn:x-rdflib:default",
+    ]
+    current_ds = _load_commit_dataset(
+        repo, repo.head.commit.hexsha, manifest, changed_paths
+    )
+    assert sorted(str(g.identifier) for g in current_ds.graphs()) == [
+        "https://example.com/demo-vocabs-catalogue",
+        str(OLIS.SystemGraph),
+        "urn:x-rdflib:default",
+    ]
+
+
+class _ListEventClient:
+    def __init__(self):
+        self.events = []
+
+    def create_event(self, payload: str):
+        self.events.append(payload)
+
+
+def test_sync_rdf_delta_ignores_uncommitted_changes(tmp_path):
+    repo, _ = _make_repo(tmp_path)
+    with open(tmp_path / "data" / "vocabs" / "image-test.ttl", "a") as f:
+        f.write("\n<https://example.com/uncommitted> a <https://example.com/Thing> .\n")
+
+    # an endpoint with no commit hash, so all the Manifest's content is sent
+    http_client = httpx.Client(
+        transport=httpx.MockTransport(
+            lambda request: httpx.Response(
+                200, headers={"Content-Type": "application/n-triples"}, content=b""
+            )
+        )
+    )
+    event_client = _ListEventClient()
+    sync_rdf_delta(
+        tmp_path,
+        tmp_path / "data" / "manifest.ttl",
+        "http://example.com/sparql",
+        http_client,
+        event_client,
+    )
+
+    patch = "".join(event_client.events)
+    assert "https://example.com/demo-vocabs/image-test" in patch
+    assert "https://example.com/uncommitted" not in patch
+    assert repo.head.commit.hexsha in patch
@@ -8,9 +8,13 @@ from rdflib.compare import isomorphic
 
 from prezmanifest import load
 from prezmanifest.definednamespaces import OLIS
+from prezmanifest.event import syncer
 from prezmanifest.event.syncer import (
     _add_commit_hash_to_dataset,
+    _diff_encoded_triples,
+    _encode_triples,
     _generate_rdf_patch_body_add,
+    _generate_rdf_patch_lines,
     _retrieve_commit_hash,
 )
 from prezmanifest.loader import ReturnDatatype
@@ -75,3 +79,47 @@ def test_generate_rdf_patch_body_add():
         rdf_patch_body
         == "TX .\nA <urn:vocab> <http://www.w3.org/1999/02/22-rdf-syntax-ns#type> <http://www.w3.org/2004/02/skos/core#ConceptScheme> .\nTC ."
     )
+
+
+def test_generate_rdf_patch_lines():
+    previous_ds = Dataset()
+    previous_ds.graph(URIRef("urn:g")).add(
+        (URIRef("urn:b"), URIRef("urn:p"), Literal('say "hi"\n'))
+    )
+    previous_ds.graph(URIRef("urn:g")).add(
+        (URIRef("urn:a"), URIRef("urn:p"), URIRef("urn:o"))
+    )
+    ds = Dataset()
+    ds.graph(URIRef("urn:g")).add((URIRef("urn:a"), URIRef("urn:p"), URIRef("urn:o")))
+    ds.add((URIRef("urn:d"), URIRef("urn:p"), Literal("x", lang="en")))
+    ds.graph(URIRef("urn:g")).add((URIRef("urn:c"), URIRef("urn:p"), Literal(1)))
+
+    lines = _generate_rdf_patch_lines(ds, previous_ds)
+    assert hasattr(lines, "__next__")
+    assert list(lines) == [
+        "TX .",
+        'D <urn:b> <urn:p> "say \\"hi\\"\\n" <urn:g> .',
+        'A <urn:c> <urn:p> "1"^^<http://www.w3.org/2001/XMLSchema#integer> <urn:g> .',
+        'A <urn:d> <urn:p> "x"@en .',
+        "TC .",
+    ]
+
+
+@pytest.mark.parametrize("with_numpy", [True, False])
+def test_diff_encoded_triples(monkeypatch: pytest.MonkeyPatch, with_numpy: bool):
+    if with_numpy:
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(syncer, "numpy", None)
+
+    ids = {}
+    terms = []
+    a, b, c, p = (URIRef(f"urn:{x}") for x in "abcp")
+    previous = _encode_triples([(a, p, b), (b, p, c)], ids, terms)
+    current = _encode_triples([(b, p, c), (c, p, a), (c, p, Literal(1))], ids, terms)
+    assert terms == [a, p, b, c, Literal(1)]
+    assert list(previous) == [0, 1, 2, 2, 1, 3]
+
+    deleted, added = _diff_encoded_triples(previous, current)
+    assert list(deleted) == [0, 1, 2]
+    assert sorted(zip(added[::3], added[1::3], added[2::3], strict=True)) == [(3, 1, 0), (3, 1, 4)]
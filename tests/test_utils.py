@@ -1,12 +1,49 @@
-from datetime import datetime
+import bz2
+import datetime
+import gzip
+from pathlib import Path
 
 import pytest
 from dateutil.parser import parse as date_parse
 from kurra.db.gsp import upload
+from kurra.file import load_graph
+from kurra.sparql import query
+from rdflib import BNode, Dataset, Graph, Literal, Namespace, URIRef
+from rdflib.compare import isomorphic
 from typer.testing import CliRunner
 
 import prezmanifest.loader
-from prezmanifest.utils import *
+import prezmanifest.utils
+from prezmanifest.utils import (
+    VersionIndicatorComparison,
+    absolutise_path,
+    compare_version_indicators,
+    denormalise_artifacts,
+    download_graph_to_file,
+    download_remote_artifacts,
+    get_artifact_main_entity_iri,
+    get_catalogue_iri_from_manifest,
+    get_content_hash,
+    get_content_hash_local,
+    get_files_from_artifact,
+    get_identifier_from_file,
+    get_manifest_paths_and_graph,
+    get_rdf_format,
+    get_version_indicators_local,
+    get_version_indicators_sparql,
+    get_version_indicators_sparql_batch,
+    load_artifact_graph,
+    load_rdf_file,
+    load_rdf_file_as_graph,
+    localise_path,
+    make_httpx_client,
+    merge_graphs,
+    path_or_url,
+    replace_graphs_sparql,
+    target_contains_this_manifests_catalogue,
+    update_graph_by_diff_sparql,
+    which_is_more_recent,
+)
 from prezmanifest.validator import ManifestValidationError
 
 runner = CliRunner()
@@ -220,6 +257,26 @@ def test_get_version_indicators_sparql(sparql_endpoint):
     assert r["modified_date"] == date_parse("2024-11-21").date()
 
 
+def test_get_version_indicators_sparql_batch(sparql_endpoint):
+    ASSET_PATH = TESTS_DIR / "demo-vocabs" / "vocabs" / "language-test.ttl"
+    ASSET_GRAPH_IRI = "https://example.com/demo-vocabs/language-test"
+    UNKNOWN_IRI = "https://example.com/demo-vocabs/not-loaded"
+
+    c = make_httpx_client()
+
+    upload(sparql_endpoint, ASSET_PATH, ASSET_GRAPH_IRI, False, http_client=c)
+
+    r = get_version_indicators_sparql_batch(
+        [ASSET_GRAPH_IRI, UNKNOWN_IRI], sparql_endpoint, http_client=c, page_size=1
+    )
+
+    assert r[ASSET_GRAPH_IRI]["known"]
+    assert not r[ASSET_GRAPH_IRI]["catalogue_known"]
+    assert r[ASSET_GRAPH_IRI]["modified_date"] == date_parse("2024-11-21").date()
+    assert not r[UNKNOWN_IRI]["known"]
+    assert r[UNKNOWN_IRI]["modified_date"] is None
+
+
 def test_compare_version_indicators():
     one = {
         "modified_date": date_parse("2024-11-20").date(),
@@ -287,6 +344,331 @@ def test_compare_version_indicators():
 
     assert compare_version_indicators(six, seven) == VersionIndicatorComparison.Second
 
+    # same content, so the newer Version Indicators of the first don't matter
+    assert (
+        compare_version_indicators(
+            {**seven, "content_hash": "abc"}, {**six, "content_hash": "abc"}
+        )
+        == VersionIndicatorComparison.Neither
+    )
+
+    # but the second may have been updated since its content hash was recorded
+    assert (
+        compare_version_indicators(
+            {**six, "content_hash": "abc"}, {**seven, "content_hash": "abc"}
+        )
+        == VersionIndicatorComparison.Second
+    )
+
+    # different content with no other Version Indicators
+    assert (
+        compare_version_indicators({"content_hash": "abc"}, {"content_hash": "def"})
+        == VersionIndicatorComparison.CantCalculate
+    )
+    assert (
+        compare_version_indicators({"content_hash": "abc"}, {"content_hash": "abc"})
+        == VersionIndicatorComparison.Neither
+    )
+
+
+def test_get_content_hash():
+    g = Graph().parse(
+        data="""
+        PREFIX ex: <http://example.com/>
+
+        ex:a ex:b ex:c ;
+            ex:d [ ex:e "f" ] .
+        """,
+        format="turtle",
+    )
+    g2 = Graph().parse(
+        data="""
+        PREFIX ex: <http://example.com/>
+
+        ex:a ex:d [ ex:e "f" ] .
+        ex:a ex:b ex:c .
+        """,
+        format="turtle",
+    )
+    assert get_content_hash(g) == get_content_hash(g2)
+
+    g2.add(
+        (URIRef("http://example.com/a"), URIRef("http://example.com/b"), Literal("g"))
+    )
+    assert get_content_hash(g) != get_content_hash(g2)
+
+    # N-Triples bytes hash the same as the graph they hold
+    g3 = Graph().parse(
+        data="<http://example.com/a> <http://example.com/b> <http://example.com/c> .",
+        format="nt",
+    )
+    assert get_content_hash(g3) == get_content_hash(
+        g3.serialize(format="nt", encoding="utf-8")
+    )
+    assert get_content_hash(g) == get_content_hash(
+        g.serialize(format="nt", encoding="utf-8")
+    )
+
+
+def test_get_content_hash_local(tmp_path, monkeypatch):
+    f = tmp_path / "a.ttl"
+    f.write_text(
+        "<http://example.com/a> <http://example.com/b> <http://example.com/c> ."
+    )
+    indicators = {"content_hash": None}
+    indicators_cache = {
+        (str(f), f.stat().st_mtime_ns, f.stat().st_size): {"content_hash": None}
+    }
+
+    h = get_content_hash_local(f, indicators, indicators_cache)
+    assert h == get_content_hash(load_rdf_file_as_graph(f))
+    assert indicators["content_hash"] == h
+    assert list(indicators_cache.values()) == [{"content_hash": h}]
+
+    # a hash already known isn't worked out again
+    monkeypatch.setattr(prezmanifest.utils, "load_rdf_file_as_graph", None)
+    assert get_content_hash_local(f, indicators, indicators_cache) == h
+
+    assert get_content_hash_local(tmp_path / "b.ttl", {}) is None
+
+
+def test_replace_graphs_sparql(tmp_path):
+    G1 = URIRef("http://example.com/g1")
+    G2 = URIRef("http://example.com/g2")
+    (tmp_path / "g1.ttl").write_text(
+        "<http://example.com/a> <http://example.com/b> <http://example.com/new> ."
+    )
+    (tmp_path / "g2.ttl").write_text(
+        "<http://example.com/a> <http://example.com/b> [ <http://example.com/c> 1 ] ."
+    )
+    ds = Dataset()
+    ds.graph(G1).add(
+        (
+            URIRef("http://example.com/a"),
+            URIRef("http://example.com/b"),
+            URIRef("http://example.com/old"),
+        )
+    )
+
+    requests = []
+
+    def handler(request: httpx.Request):
+        requests.append(request)
+        ds.update(request.read().decode())
+        return httpx.Response(204)
+
+    c = httpx.Client(transport=httpx.MockTransport(handler))
+    r = replace_graphs_sparql(
+        {str(G1): tmp_path / "g1.ttl", str(G2): tmp_path / "g2.ttl"},
+        "http://example.com/sparql",
+        c,
+    )
+
+    assert r == (True, None)
+    assert len(requests) == 1
+    assert requests[0].headers["Content-Type"] == "application/sparql-update"
+    assert len(ds.graph(G1)) == 1
+    assert (None, None, URIRef("http://example.com/new")) in ds.graph(G1)
+    assert len(ds.graph(G2)) == 2
+
+
+def test_update_graph_by_diff_sparql(tmp_path):
+    G = URIRef("http://example.com/g")
+    EX = "http://example.com/"
+    (tmp_path / "g.ttl").write_text(
+        "\n".join(f"<{EX}s{i}> <{EX}p> <{EX}o{i}> ." for i in [*range(1, 10), 11])
+    )
+    (tmp_path / "b.ttl").write_text(f"<{EX}s1> <{EX}p> [ <{EX}p> 1 ] .")
+    ds = Dataset()
+    for i in range(10):
+        ds.graph(G).add((URIRef(f"{EX}s{i}"), URIRef(f"{EX}p"), URIRef(f"{EX}o{i}")))
+
+    requests = []
+
+    def handler(request: httpx.Request):
+        requests.append(request)
+        if request.method == "GET":
+            return httpx.Response(
+                200,
+                content=ds.graph(G).serialize(format="nt", encoding="utf-8"),
+                headers={"Content-Type": "application/n-triples"},
+            )
+        elif request.method == "PUT":
+            ds.remove_graph(G)
+            ds.graph(G).parse(
+                data=request.read(), format=request.headers["Content-Type"]
+            )
+        else:
+            ds.update(request.read().decode())
+        return httpx.Response(204)
+
+    c = httpx.Client(transport=httpx.MockTransport(handler))
+
+    # s0 removed & s11 added: one GET then one Update carrying only those two triples
+    assert update_graph_by_diff_sparql(
+        "http://example.com/sparql", tmp_path / "g.ttl", str(G), c
+    ) == (True, None)
+    assert [r.method for r in requests] == ["GET", "POST"]
+    assert requests[1].read().decode().count(" .\n") == 2
+    assert len(ds.graph(G)) == 10
+    assert (URIRef(f"{EX}s0"), None, None) not in ds.graph(G)
+    assert (URIRef(f"{EX}s11"), None, None) in ds.graph(G)
+
+    # no difference: no Update sent
+    requests.clear()
+    assert update_graph_by_diff_sparql(
+        "http://example.com/sparql", tmp_path / "g.ttl", str(G), c
+    ) == (True, None)
+    assert [r.method for r in requests] == ["GET"]
+
+    # a large difference, or Blank Nodes, replaces the graph
+    requests.clear()
+    assert update_graph_by_diff_sparql(
+        "http://example.com/sparql", tmp_path / "b.ttl", str(G), c
+    ) == (True, None)
+    assert [r.method for r in requests] == ["GET", "PUT"]
+    assert len(ds.graph(G)) == 2
+
+    # a rejected Update is reported as failed
+    def rejecting_handler(request: httpx.Request):
+        if request.method == "GET":
+            return handler(request)
+        requests.append(request)
+        return httpx.Response(400, text="Bad Update")
+
+    c = httpx.Client(transport=httpx.MockTransport(rejecting_handler))
+    assert update_graph_by_diff_sparql(
+        "http://example.com/sparql", tmp_path / "b.ttl", str(G), c
+    ) == (400, "Bad Update")
+    ds.remove_graph(G)
+    for i in range(10):
+        ds.graph(G).add((URIRef(f"{EX}s{i}"), URIRef(f"{EX}p"), URIRef(f"{EX}o{i}")))
+    requests.clear()
+    assert update_graph_by_diff_sparql(
+        "http://example.com/sparql", tmp_path / "g.ttl", str(G), c
+    ) == (400, "Bad Update")
+    assert [r.method for r in requests] == ["GET", "POST"]
+
+
+def test_download_remote_artifacts(tmp_path):
+    EX = "http://example.com/"
+    ds = Dataset()
+    for i in range(3):
+        ds.graph(URIRef(f"{EX}g{i}")).add(
+            (URIRef(f"{EX}s{i}"), URIRef(f"{EX}p"), Literal(i))
+        )
+    ds.graph(URIRef(f"{EX}g0")).add((URIRef(f"{EX}s0"), URIRef(f"{EX}q"), BNode()))
+
+    requests = []
+
+    def handler(request: httpx.Request):
+        requests.append(request)
+        g = ds.graph(URIRef(request.url.params["graph"]))
+        return httpx.Response(200, content=g.serialize(format="nt", encoding="utf-8"))
+
+    c = httpx.Client(transport=httpx.MockTransport(handler))
+    r = download_remote_artifacts(
+        tmp_path, "http://example.com/sparql", [f"{EX}g0", f"{EX}g2"], c
+    )
+
+    # each graph is streamed to its file
+    assert [r.url.params["graph"] for r in requests] == [f"{EX}g0", f"{EX}g2"]
+    assert not c.is_closed
+    assert sorted(r.keys()) == [f"{EX}g0", f"{EX}g2"]
+    g0 = load_graph(tmp_path / r[f"{EX}g0"])
+    assert len(g0) == 2
+    assert (URIRef(f"{EX}s0"), URIRef(f"{EX}p"), Literal(0)) in g0
+    assert len(load_graph(tmp_path / r[f"{EX}g2"])) == 1
+
+
+def test_download_graph_to_file(tmp_path):
+    G = "http://example.com/g"
+    g = Graph()
+    for i in range(5):
+        g.add(
+            (
+                URIRef(f"http://example.com/s{i}"),
+                URIRef("http://example.com/p"),
+                Literal(f"o {i}"),
+            )
+        )
+
+    def handler(request: httpx.Request):
+        assert request.headers["Accept"] == "application/n-triples"
+        if request.url.params["graph"] != G:
+            return httpx.Response(404)
+        return httpx.Response(200, content=g.serialize(format="nt", encoding="utf-8"))
+
+    c = httpx.Client(transport=httpx.MockTransport(handler))
+
+    for name in ["a.nt", "a.nt.gz", "a.ttl", "a.ttl.bz2", "a.nq.gz", "a.trig"]:
+        download_graph_to_file("http://example.com/sparql", G, tmp_path / name, c)
+        d = load_rdf_file(tmp_path / name)
+        if isinstance(d, Dataset):
+            assert isomorphic(d.graph(URIRef(G)), g)
+        else:
+            assert isomorphic(d, g)
+    assert (tmp_path / "a.ttl").read_bytes() != g.serialize(
+        format="nt", encoding="utf-8"
+    )
+
+    # large Turtle downloads are left as streamed, N-Triples
+    download_graph_to_file(
+        "http://example.com/sparql", G, tmp_path / "b.ttl", c, pretty_max_bytes=10
+    )
+    assert (tmp_path / "b.ttl").read_bytes() == g.serialize(
+        format="nt", encoding="utf-8"
+    )
+
+    # failed downloads leave no file behind
+    with pytest.raises(ValueError):
+        download_graph_to_file(
+            "http://example.com/sparql", "http://example.com/x", tmp_path / "c.nt", c
+        )
+    assert not (tmp_path / "c.nt").exists()
+    assert not (tmp_path / ".part-c.nt").exists()
+
+
+def test_merge_graphs():
+    EX = Namespace("http://example.com/")
+    base = Graph()
+    base.add((EX.a, EX.name, Literal("A")))
+    base.add((EX.a, EX.note, Literal("old")))
+    base.add((EX.b, EX.name, Literal("B")))
+
+    # non-overlapping changes are all kept
+    local = Graph()
+    local += base
+    local.remove((EX.a, EX.note, None))
+    local.add((EX.c, EX.name, Literal("C")))
+    remote = Graph()
+    remote += base
+    remote.set((EX.b, EX.name, Literal("Bee")))
+
+    merged, conflicts = merge_graphs(base, local, remote)
+    assert conflicts == []
+    assert set(merged) == {
+        (EX.a, EX.name, Literal("A")),
+        (EX.b, EX.name, Literal("Bee")),
+        (EX.c, EX.name, Literal("C")),
+    }
+
+    # the same change made on both sides isn't a conflict
+    local.set((EX.b, EX.name, Literal("Bee")))
+    merged, conflicts = merge_graphs(base, local, remote)
+    assert conflicts == []
+    assert (EX.b, EX.name, Literal("Bee")) in merged
+
+    # different changes to the same subject & predicate are
+    local.set((EX.b, EX.name, Literal("Bea")))
+    merged, conflicts = merge_graphs(base, local, remote)
+    assert merged is None
+    assert conflicts == [(EX.b, EX.name)]
+
+    # Blank Nodes can't be merged
+    local.add((EX.d, EX.part, BNode()))
+    assert merge_graphs(base, local, base) == (None, [])
+
 
 def test_which_is_more_recent(sparql_endpoint):
     ARTIFACT_PATH = TESTS_DIR / "demo-vocabs" / "vocabs" / "language-test.ttl"
@@ -345,3 +727,69 @@ def test_denormalise_artifacts():
         in x.keys()
     )
     assert manifest_root / "_background/labels.ttl" in x.keys()
+
+
+def test_get_rdf_format(tmp_path):
+    assert get_rdf_format(Path("a.ttl")) == "turtle"
+    assert get_rdf_format(Path("a.nt.gz")) == "nt"
+    assert get_rdf_format(Path("a.nq.zst")) == "nquads"
+    assert get_rdf_format(Path("a.jsonld")) == "json-ld"
+    assert get_rdf_format(Path("README.md")) is None
+
+    # unknown extensions aren't sniffed, even if the content is RDF
+    f = tmp_path / "data.json"
+    f.write_text('{"@id": "https://example.com/a"}')
+    assert get_rdf_format(f) is None
+
+    # no extension so the content is sniffed
+    f = tmp_path / "no-extension"
+    f.write_text(
+        "<https://example.com/a> <https://example.com/b> <https://example.com/c> <https://example.com/g> .\n"
+    )
+    assert get_rdf_format(f) == "nquads"
+
+    f.write_text("PREFIX ex: <https://example.com/>\n\nex:a ex:b ex:c .\n")
+    assert get_rdf_format(f) == "turtle"
+
+
+def test_load_rdf_file_compressed(tmp_path):
+    ttl = TESTS_DIR / "demo-vocabs" / "vocabs" / "image-test.ttl"
+    g = Graph().parse(ttl)
+
+    with gzip.open(tmp_path / "image-test.nt.gz", "wb") as f:
+        f.write(g.serialize(format="nt", encoding="utf-8"))
+
+    d = Dataset()
+    d.graph(URIRef("https://example.com/demo-vocabs/image-test")).parse(ttl)
+    with bz2.open(tmp_path / "image-test.nq.bz2", "wb") as f:
+        f.write(d.serialize(format="nquads", encoding="utf-8"))
+
+    g2 = load_rdf_file(tmp_path / "image-test.nt.gz")
+    assert isinstance(g2, Graph)
+    assert len(g2) == len(g)
+
+    d2 = load_rdf_file(tmp_path / "image-test.nq.bz2")
+    assert isinstance(d2, Dataset)
+    assert len(d2.graph(URIRef("https://example.com/demo-vocabs/image-test"))) == len(g)
+
+    assert get_identifier_from_file(tmp_path / "image-test.nt.gz") == [
+        URIRef("https://example.com/demo-vocabs/image-test")
+    ]
+    assert get_identifier_from_file(tmp_path / "image-test.nq.bz2") == [
+        URIRef("https://example.com/demo-vocabs/image-test")
+    ]
+
+
+def test_load_artifact_graph(tmp_path, monkeypatch):
+    ttl = TESTS_DIR / "demo-vocabs" / "vocabs" / "image-test.ttl"
+    g = Graph().parse(ttl)
+    with gzip.open(tmp_path / "image-test.nt.gz", "wb") as f:
+        f.write(g.serialize(format="nt", encoding="utf-8"))
+
+    # kurra loads the formats it always has, including RDF data strings
+    assert isomorphic(load_artifact_graph(ttl), g)
+    assert len(load_artifact_graph(g.serialize(format="turtle"))) == len(g)
+
+    # N-Triples, N-Quads & compressed files are loaded without kurra
+    monkeypatch.setattr(prezmanifest.utils, "load_graph", None)
+    assert isomorphic(load_artifact_graph(tmp_path / "image-test.nt.gz"), g)
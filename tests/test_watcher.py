@@ -0,0 +1,208 @@
+import threading
+import time
+
+import prezmanifest.watcher
+from prezmanifest.watcher import _written_by_sync, watch, watch_load, watch_sync
+
+
+def test_watch(tmp_path):
+    (tmp_path / "a.ttl").write_text("a")
+    (tmp_path / "b.ttl").write_text("b")
+    (tmp_path / ".hidden").mkdir()
+
+    stop = threading.Event()
+    calls = []
+
+    def on_change(changed):
+        calls.append(changed)
+        stop.set()
+
+    t = threading.Thread(
+        target=watch, args=(tmp_path, on_change, 0.05, 0.2, stop), daemon=True
+    )
+    t.start()
+    time.sleep(0.2)
+
+    # a burst of changes is reported once, after they stop
+    (tmp_path / "a.ttl").write_text("aa")
+    (tmp_path / "c.ttl").write_text("c")
+    (tmp_path / "b.ttl").unlink()
+    (tmp_path / ".hidden" / "d.ttl").write_text("d")
+
+    t.join(5)
+    assert not t.is_alive()
+    assert calls == [
+        {
+            (tmp_path / "a.ttl").resolve(),
+            (tmp_path / "b.ttl").resolve(),
+            (tmp_path / "c.ttl").resolve(),
+        }
+    ]
+
+
+def test_watch_continues_after_errors(tmp_path, caplog):
+    stop = threading.Event()
+    calls = []
+
+    def on_change(changed):
+        calls.append(changed)
+        if len(calls) == 1:
+            raise ValueError("Could not sync")
+        stop.set()
+
+    t = threading.Thread(
+        target=watch, args=(tmp_path, on_change, 0.05, 0.1, stop), daemon=True
+    )
+    t.start()
+    time.sleep(0.2)
+
+    (tmp_path / "a.ttl").write_text("a")
+    time.sleep(0.5)
+    (tmp_path / "b.ttl").write_text("b")
+
+    t.join(5)
+    assert not t.is_alive()
+    assert len(calls) == 2
+    assert "Could not sync" in caplog.text
+    assert str((tmp_path / "a.ttl").resolve()) in caplog.text
+
+
+def test_watch_reports_changes_made_while_acting(tmp_path):
+    (tmp_path / "a.ttl").write_text("a")
+    stop = threading.Event()
+    calls = []
+
+    def on_change(changed):
+        calls.append(changed)
+        if len(calls) == 2:
+            stop.set()
+            return None
+        # a file written by on_change itself, and one edited by someone else meanwhile
+        (tmp_path / "written.ttl").write_text("written")
+        (tmp_path / "a.ttl").write_text("edited")
+        return {tmp_path / "written.ttl"}
+
+    t = threading.Thread(
+        target=watch,
+        args=(tmp_path, on_change, 0.05, 0.1, stop),
+        kwargs={"initial": True},
+        daemon=True,
+    )
+    t.start()
+
+    t.join(5)
+    assert not t.is_alive()
+    assert calls == [set(), {(tmp_path / "a.ttl").resolve()}]
+
+
+def test_watch_sync_ignores_other_files(tmp_path, monkeypatch):
+    manifest = tmp_path / "manifest.ttl"
+    manifest.write_text("")
+    stop = threading.Event()
+    syncs = []
+    monkeypatch.setattr(
+        prezmanifest.watcher, "get_manifest_paths_and_graph", lambda m: m
+    )
+    monkeypatch.setattr(
+        prezmanifest.watcher, "sync", lambda *args, **kwargs: syncs.append(args)
+    )
+
+    t = threading.Thread(
+        target=watch_sync,
+        args=(manifest, "http://example.com/sparql"),
+        kwargs={"interval": 0.05, "debounce": 0.1, "stop": stop},
+        daemon=True,
+    )
+    t.start()
+    time.sleep(0.2)
+    assert len(syncs) == 1
+
+    # only changes that may be to the Manifest's content are synced
+    (tmp_path / "notes.txt").write_text("notes")
+    time.sleep(0.5)
+    assert len(syncs) == 1
+    (tmp_path / "a.ttl").write_text("a")
+    time.sleep(0.5)
+    assert len(syncs) == 2
+
+    stop.set()
+    t.join(5)
+
+
+def test_watch_sync_continues_after_first_sync_errors(tmp_path, monkeypatch, caplog):
+    manifest = tmp_path / "manifest.ttl"
+    manifest.write_text("")
+    stop = threading.Event()
+    syncs = []
+
+    def _sync(*args, **kwargs):
+        syncs.append(args)
+        if len(syncs) == 1:
+            raise ValueError("Could not sync")
+        stop.set()
+        return {}
+
+    monkeypatch.setattr(
+        prezmanifest.watcher, "get_manifest_paths_and_graph", lambda m: m
+    )
+    monkeypatch.setattr(prezmanifest.watcher, "sync", _sync)
+
+    t = threading.Thread(
+        target=watch_sync,
+        args=(manifest, "http://example.com/sparql"),
+        kwargs={"interval": 0.05, "debounce": 0.1, "stop": stop},
+        daemon=True,
+    )
+    t.start()
+    time.sleep(0.2)
+    assert len(syncs) == 1
+    assert "Could not sync" in caplog.text
+
+    (tmp_path / "a.ttl").write_text("a")
+    t.join(5)
+    assert not t.is_alive()
+    assert len(syncs) == 2
+
+
+def test_watch_load_parse_workers(tmp_path, monkeypatch):
+    manifest = tmp_path / "manifest.ttl"
+    manifest.write_text("")
+    stop = threading.Event()
+    loads = []
+
+    def _load(*args, **kwargs):
+        loads.append(kwargs)
+        stop.set()
+
+    monkeypatch.setattr(
+        prezmanifest.watcher, "get_manifest_paths_and_graph", lambda m: m
+    )
+    monkeypatch.setattr(prezmanifest.watcher, "load", _load)
+
+    watch_load(
+        manifest,
+        "http://example.com/sparql",
+        parse_workers=4,
+        interval=0.05,
+        stop=stop,
+    )
+    assert [kwargs["parse_workers"] for kwargs in loads] == [4]
+
+
+def test_written_by_sync(tmp_path):
+    manifest = (tmp_path / "manifest.ttl", tmp_path, None)
+    sync_status = {
+        "a.ttl": {"main_entity": "https://example.com/a", "direction": "download"},
+        "b.ttl": {"main_entity": "https://example.com/b", "direction": "merge"},
+        "c.ttl": {"main_entity": "https://example.com/c", "direction": "upload"},
+        "d.ttl": {"main_entity": "https://example.com/d", "direction": "failed"},
+    }
+
+    assert _written_by_sync(sync_status, manifest) == {
+        tmp_path / "a.ttl",
+        tmp_path / "b.ttl",
+    }
+    assert _written_by_sync({}, manifest, tmp_path / "sync.json") == {
+        tmp_path / "sync.json",
+        tmp_path / "sync.snapshots",
+    }